@@ -0,0 +1,113 @@
+import os
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from metrics import stage, count_bytes
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Generated workbooks and PDFs handed out as signed Cloud Storage URLs instead of through the worker
+class ArtifactStore:
+    """
+    Uploads files to `bucket` under `prefix`/<sha256><extension>, so identical files are stored
+    once whatever they are called, and returns short-lived signed download URLs. `bucket` is
+    anything with the google-cloud-storage Bucket API: firebase_admin.storage.bucket(), a bucket
+    on the Storage emulator (STORAGE_EMULATOR_HOST) or a local stand-in.
+    """
+
+    def __init__(self, bucket, prefix: str = "artifacts", url_ttl: int = 900, api_access_endpoint: str = None,
+                 max_known: int = 1000):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.url_ttl = url_ttl
+        self.api_access_endpoint = api_access_endpoint
+        self.max_known = max_known
+        self._lock = threading.Lock()
+        # Local file (path, size, mtime) -> sha256, and hashes known to be in the bucket
+        self._hashes = OrderedDict()
+        self._uploaded = OrderedDict()
+        self.uploads = 0
+        self.reused = 0
+
+    def _remember(self, entries: OrderedDict, key, value):
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_known:
+                entries.popitem(last=False)
+
+    def content_hash(self, path: str) -> str:
+        """sha256 of the file, cached while the file is unchanged"""
+        status = os.stat(path)
+        key = (path, status.st_size, status.st_mtime_ns)
+        with self._lock:
+            known = self._hashes.get(key)
+        if known is None:
+            known = file_sha256(path)
+            self._remember(self._hashes, key, known)
+        return known
+
+    def publish(self, path: str, filename: str = None) -> dict:
+        """Uploads `path` unless the bucket already has its content, returns a signed URL for it"""
+        filename = filename or os.path.basename(path)
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        sha256 = self.content_hash(path)
+        blob = self.bucket.blob(f"{self.prefix}/{sha256}{os.path.splitext(filename)[1]}")
+
+        with self._lock:
+            uploaded = sha256 in self._uploaded
+        if not uploaded:
+            uploaded = blob.exists()
+        if not uploaded:
+            with stage("upload_artifact"):
+                try:
+                    # if_generation_match=0: only create, a concurrent upload of the same content wins
+                    blob.upload_from_filename(path, content_type=content_type, if_generation_match=0)
+                    count_bytes("artifact_upload", os.path.getsize(path))
+                except Exception as e:
+                    if getattr(e, "code", None) != 412:
+                        raise
+                    # Another worker stored the same content between exists() and the upload
+                    uploaded = True
+        self._remember(self._uploaded, sha256, True)
+        with self._lock:
+            if uploaded:
+                self.reused += 1
+            else:
+                self.uploads += 1
+
+        signing = {
+            "version": "v4",
+            "expiration": timedelta(seconds=self.url_ttl),
+            "method": "GET",
+            "response_disposition": f'attachment; filename="{filename}"',
+            "response_type": content_type,
+        }
+        if self.api_access_endpoint:
+            signing["api_access_endpoint"] = self.api_access_endpoint
+        with stage("sign_url"):
+            url = blob.generate_signed_url(**signing)
+
+        return {
+            "url": url,
+            "expires_in": self.url_ttl,
+            "filename": filename,
+            "sha256": sha256,
+            "size": os.path.getsize(path),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"uploads": self.uploads, "reused": self.reused, "known": len(self._uploaded)}
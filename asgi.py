@@ -0,0 +1,391 @@
+import io
+import os
+import json
+import asyncio
+import contextvars
+import zipfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, Response, request, jsonify, send_file, redirect, g
+from quart_cors import cors
+
+from index import (
+    GENERATION_MODE, GENERATION_MODES, PDF_RENDERER, PDF_RENDERERS, XLSX_MIMETYPE, CONVERT_API_KEY,
+    CONVERT_API_URL, ARTIFACT_DELIVERIES, ARTIFACT_DELIVERY, artifact_store, output_cache, project_store,
+    template_registry, spooled_buffer, build_excel_file, report_cache_key, generate_report_workbook,
+    render_report_pdf, remove_formulas_from_excel,
+)
+from startup import LazyResource
+import metrics
+
+
+# ASGI variant of the Flask app in index.py, serve with `uvicorn asgi:app` (or hypercorn).
+# Firestore reads and ConvertAPI calls are awaited, so one process holds many requests in
+# flight; openpyxl, reportlab and zip work runs on CPU_THREADS threads off the event loop.
+
+CPU_THREADS = int(os.getenv("ASYNC_CPU_THREADS", str(os.cpu_count() or 1)))
+cpu_executor = ThreadPoolExecutor(CPU_THREADS, thread_name_prefix="cpu")
+
+
+def build_async_converter():
+    """Async ConvertAPI client shared by all requests on this event loop"""
+    from async_converter import AsyncConvertApiConverter
+
+    return AsyncConvertApiConverter(
+        api_key=CONVERT_API_KEY,
+        url=CONVERT_API_URL,
+        max_concurrency=int(os.getenv("CONVERT_API_MAX_CONCURRENCY", "4")),
+        max_retries=int(os.getenv("CONVERT_API_MAX_RETRIES", "3")),
+        max_backoff=float(os.getenv("CONVERT_API_MAX_BACKOFF", "30")),
+    )
+
+
+async_converter = LazyResource("async pdf converter", build_async_converter)
+
+# Initialize Quart app
+app = Quart(__name__)
+app = cors(app)
+
+
+async def run_cpu(function, *args):
+    """Runs blocking `function` on the CPU threads and awaits its result"""
+    # Carry the request context over, so stage timings land in this request's Server-Timing
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, context.run, function, *args)
+
+
+# Request metrics: in-flight gauge, stage timings in a Server-Timing header, totals for /metrics
+@app.before_request
+async def start_request_metrics():
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    g.request_metrics = metrics.RequestMetrics(route, request.method)
+
+
+@app.after_request
+async def finish_request_metrics(response):
+    request_metrics = g.get("request_metrics")
+    if request_metrics is not None:
+        response.headers["Server-Timing"] = request_metrics.server_timing()
+        request_metrics.finish(response.status_code, request.content_length, response.content_length)
+    return response
+
+
+@app.teardown_request
+async def close_request_metrics(error=None):
+    request_metrics = g.pop("request_metrics", None)
+    if request_metrics is not None:
+        # Requests that raised never reached after_request
+        request_metrics.finish(500, request.content_length)
+        request_metrics.close()
+
+
+# Route exposing the worker's metrics to Prometheus
+@app.route('/metrics', methods=['GET'])
+async def metrics_route():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.after_serving
+async def close_clients():
+    if async_converter.is_loaded:
+        await async_converter.close()
+    cpu_executor.shutdown(wait=False)
+
+
+# Function reading the delivery of a generated file, ?delivery= overrides ARTIFACT_DELIVERY
+def requested_delivery() -> str:
+    delivery = request.args.get("delivery", ARTIFACT_DELIVERY)
+    if delivery not in ARTIFACT_DELIVERIES:
+        raise ValueError(f"Unknown delivery '{delivery}', expected one of {', '.join(ARTIFACT_DELIVERIES)}")
+    return delivery
+
+
+# Function sending a generated file, or a signed Storage URL for it
+async def send_artifact(path: str, delivery: str = "stream", filename: str = None):
+    """Streams `path`, or uploads it once per content (on a CPU thread) and hands out a signed URL"""
+    if delivery == "stream":
+        return await send_file(path, as_attachment=True, attachment_filename=filename)
+
+    artifact = await run_cpu(artifact_store.publish, path, filename)
+    if delivery == "redirect":
+        return redirect(artifact["url"], code=303)
+    return jsonify(artifact), 200
+
+
+# Route to remove formulas from an Excel file
+@app.route('/remove-formulas', methods=['POST'])
+async def remove_formulas_route():
+    files = await request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    excel_file = files['file']
+    output_filename = f"processed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+    # Quart sends files from a path or BytesIO, the processed workbook stays in memory
+    output = io.BytesIO()
+    try:
+        await run_cpu(remove_formulas_from_excel, excel_file.stream, output)
+    except zipfile.BadZipFile:
+        return jsonify({"error": "Uploaded file is not a valid Excel workbook"}), 400
+
+    output.seek(0)
+    return await send_file(output, mimetype=XLSX_MIMETYPE, as_attachment=True, attachment_filename=output_filename)
+
+
+# Route to generate an Excel file with Firestore data
+@app.route('/generate-excel', methods=['GET'])
+async def generate_excel():
+    """Quart route to generate an Excel file and return it as a response"""
+    try:
+        uid = request.args.get('uid')
+        project_id = request.args.get('project_id')
+
+        if not uid or not project_id:
+            return jsonify({"error": "uid and project_id are required"}), 400
+
+        mode = request.args.get("mode", GENERATION_MODE)
+        if mode not in GENERATION_MODES:
+            return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+        template = request.args.get("template", "main")
+        # The first request builds the registry and its template cache, off the event loop
+        if template not in await run_cpu(template_registry.load):
+            return jsonify({"error": f"Unknown template '{template}'"}), 400
+
+        try:
+            delivery = requested_delivery()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        output_path = await generate_excel_file(uid, project_id, mode, template)
+        return await send_artifact(output_path, delivery)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/generate-excel-hist', methods=['GET'])
+async def generate_excel_hist():
+    """Quart route to generate an Excel file and return it as a response"""
+    try:
+        uid = request.args.get('uid')
+        project_id = request.args.get('project_id')
+
+        if not uid or not project_id:
+            return jsonify({"error": "uid and project_id are required"}), 400
+
+        mode = request.args.get("mode", GENERATION_MODE)
+        if mode not in GENERATION_MODES:
+            return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+
+        try:
+            delivery = requested_delivery()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        output_path = await generate_excel_file(uid, project_id, mode, "hist")
+        return await send_artifact(output_path, delivery)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Route to convert an Excel file to PDF
+@app.route('/convert-to-pdf', methods=['GET'])
+async def convert_to_pdf_route():
+    """GET route to generate an Excel file and convert it to a PDF"""
+    uid = request.args.get("uid")
+    project_id = request.args.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    renderer = request.args.get("renderer", PDF_RENDERER)
+    if renderer not in PDF_RENDERERS:
+        return jsonify({"error": f"Unknown renderer '{renderer}'"}), 400
+
+    try:
+        delivery = requested_delivery()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        data = await fetch_answers(uid, project_id)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    try:
+        return await send_artifact(await generate_report_pdf(data, renderer), delivery)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Route to generate every output of a project in one call
+@app.route('/generate-bundle', methods=['GET'])
+async def generate_bundle_route():
+    """GET route streaming back a zip with the main workbook, the Hist.Fin workbook and the report PDF"""
+    uid = request.args.get("uid")
+    project_id = request.args.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    mode = request.args.get("mode", GENERATION_MODE)
+    if mode not in GENERATION_MODES:
+        return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+
+    renderer = request.args.get("renderer", PDF_RENDERER)
+    if renderer not in PDF_RENDERERS:
+        return jsonify({"error": f"Unknown renderer '{renderer}'"}), 400
+
+    # One read of the answers feeds every output
+    try:
+        data = await fetch_answers(uid, project_id)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Response(
+        generate_bundle(project_id, data, mode, renderer),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={project_id}_{timestamp}.zip"},
+    )
+
+
+# Route to drop a project's cached answers after they were written
+@app.route('/projects/invalidate', methods=['POST'])
+async def invalidate_project():
+    """POST route the writer of a project's answers calls, every worker refetches them on next use"""
+    params = await request.get_json(silent=True) or request.args
+    uid = params.get("uid")
+    project_id = params.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    try:
+        store = await run_cpu(project_store.load)
+        # Touches the marker file shared by the workers
+        await run_cpu(store.invalidate, uid, project_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return "", 204
+
+
+# Function to fetch the answers of a project from Firestore
+async def fetch_answers(uid: str, project_id: str) -> dict:
+    """Returns the mapped `answers` of the project document, from the cache shared with index.py"""
+    with metrics.stage("fetch"):
+        # Building the store needs the template registry, done on a thread the first time
+        store = await run_cpu(project_store.load)
+        return await store.get_answers_async(uid, project_id)
+
+
+# Function to generate excel file
+async def generate_excel_file(uid: str, project_id: str, mode: str = GENERATION_MODE, template: str = "main") -> str:
+    """Generates an Excel file from the registered `template` with Firestore data and returns the file path"""
+    try:
+        if not uid or not project_id:
+            raise ValueError("uid and project_id are required")
+
+        data = await fetch_answers(uid, project_id)
+        return await run_cpu(build_excel_file, data, mode, template)
+
+    except Exception as e:
+        raise RuntimeError(f"Error generating Excel: {str(e)}")
+
+
+# Function to produce the report PDF for a project's answers
+async def generate_report_pdf(data: dict, renderer: str) -> str:
+    """Returns the report PDF path, only the ConvertAPI call is awaited rather than run on a thread"""
+    report_filename = f"final_invoice_{datetime.now().strftime('%Y%m%d_%H%M%S')}_report.pdf"
+
+    if renderer == "local":
+        # Hashing the template may load it and the lookup touches the disk, both stay off the loop
+        cache_key = await run_cpu(report_cache_key, data, "local")
+        cached_path = await run_cpu(output_cache.get, cache_key)
+        if cached_path is not None:
+            return cached_path
+
+        try:
+            with spooled_buffer() as pdf:
+                await run_cpu(render_report_pdf, data, pdf)
+                return await run_cpu(output_cache.put, cache_key, pdf, report_filename)
+        except Exception as e:
+            # Fall back to the ConvertAPI conversion below
+            print(f"Local report rendering failed, falling back to ConvertAPI: {str(e)}")
+
+    cache_key = await run_cpu(report_cache_key, data, "convertapi")
+    cached_path = await run_cpu(output_cache.get, cache_key)
+    if cached_path is not None:
+        return cached_path
+
+    # The sliced workbook only prints the report pages, its PDF is cached as converted
+    with spooled_buffer() as workbook, spooled_buffer() as pdf:
+        await run_cpu(generate_report_workbook, data, workbook)
+        await convert_excel_to_pdf(workbook, pdf, report_filename.replace(".pdf", ".xlsx"))
+        return await run_cpu(output_cache.put, cache_key, pdf, report_filename)
+
+
+# Function producing the zip archive of a project bundle
+async def generate_bundle(project_id: str, data: dict, mode: str, renderer: str):
+    """Yields a zip archive of the project's outputs, built concurrently and added as each one is ready"""
+    from workbook_generation import ArchiveStream
+
+    stream = ArchiveStream()
+    # Workbooks and PDFs are already compressed, storing them avoids compressing twice
+    archive = zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED)
+    manifest = []
+    coroutines = {
+        f"{project_id}.xlsx": run_cpu(build_excel_file, data, mode, "main"),
+        f"{project_id}_hist.xlsx": run_cpu(build_excel_file, data, mode, "hist"),
+        # Awaits ConvertAPI on the event loop, only its CPU stages take a thread
+        f"{project_id}_report.pdf": generate_report_pdf(data, renderer),
+    }
+    tasks = {asyncio.ensure_future(coroutine): entry_name for entry_name, coroutine in coroutines.items()}
+
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                entry_name = tasks[task]
+                try:
+                    await run_cpu(archive.write, task.result(), entry_name)
+                    manifest.append({"file": entry_name})
+                except Exception as e:
+                    # The other outputs are still worth sending
+                    manifest.append({"file": entry_name, "error": str(e)})
+            yield stream.drain()
+
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        archive.close()
+        yield stream.drain()
+
+    finally:
+        # Client went away, do not generate what nobody will receive
+        for task in pending:
+            task.cancel()
+
+
+# Function to convert an Excel file to PDF using ConvertAPI
+async def convert_excel_to_pdf(excel_file, output_pdf, filename: str = "report.xlsx"):
+    """Converts an Excel file (bytes or binary file) to a PDF without blocking the event loop"""
+    import httpx
+
+    try:
+        return await async_converter.convert(excel_file, output_pdf, filename)
+
+    except httpx.TimeoutException:
+        raise RuntimeError("The request to ConvertAPI timed out. Try reducing the file size.")
+
+    except httpx.HTTPError as e:
+        raise RuntimeError(f"Error during API request: {e}")
+
+    except Exception as e:
+        raise RuntimeError(f"Error in PDF conversion: {str(e)}")
@@ -0,0 +1,94 @@
+import asyncio
+import httpx
+from pdf_converter import CONVERT_API_URL, XLSX_CONTENT_TYPE, RETRY_STATUS_CODES, FileDataStream, retry_delay
+from metrics import stage, count_bytes
+
+
+# Non-blocking ConvertAPI client for the ASGI app (asgi.py), many conversions share one event loop
+
+
+class AsyncConvertApiConverter:
+    """
+    Async counterpart of pdf_converter.ConvertApiConverter: one keep-alive connection pool, a
+    semaphore bounding how many conversions run at once, the same retries with exponential backoff
+    (never after the upload may have been received) and the base64 PDF decoded into the output
+    while it downloads.
+    """
+
+    def __init__(self, api_key: str, url: str = CONVERT_API_URL, max_concurrency: int = 4,
+                 max_retries: int = 3, backoff: float = 1.0, max_backoff: float = 30, timeout: float = 120):
+        self.api_key = api_key
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=timeout,
+        )
+
+    async def convert(self, source, output, filename: str = "report.xlsx"):
+        """
+        Converts the workbook `source` (bytes or a binary file) and writes the PDF to the binary
+        file `output`, returns `output`
+        """
+        data = {
+            "StoreFile": "false",
+            "WorksheetActive": "true",
+            "PageOrientation": "landscape",
+        }
+        if not isinstance(source, bytes):
+            source.seek(0)
+            source = source.read()
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            async with self._semaphore:
+                try:
+                    files = {"File": (filename, source, XLSX_CONTENT_TYPE)}
+                    request = self._client.build_request("POST", self.url, files=files, data=data)
+                    # Upload and remote rendering, up to the response headers
+                    with stage("convertapi"):
+                        response = await self._client.send(request, stream=True)
+
+                    try:
+                        if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                            await response.aread()
+                            delay = retry_delay(attempt, self.backoff, self.max_backoff, response)
+                            print(f"ConvertAPI returned {response.status_code}, retrying in {delay:.1f}s")
+                        else:
+                            response.raise_for_status()
+                            output.seek(0)
+                            output.truncate()
+                            # Download and base64 decoding, interleaved chunk by chunk
+                            with stage("decode"):
+                                stream = FileDataStream(output)
+                                async for chunk in response.aiter_bytes():
+                                    if stream.feed(chunk):
+                                        break
+                                size = stream.finish()
+
+                            count_bytes("convertapi_upload", len(source))
+                            count_bytes("convertapi_pdf", size)
+                            print(f"PDF successfully converted from '{filename}' ({size} bytes)")
+                            return output
+                    finally:
+                        await response.aclose()
+
+                # Only connect-phase failures, the upload never left
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    if last_attempt:
+                        raise
+                    delay = retry_delay(attempt, self.backoff, self.max_backoff)
+                    print(f"ConvertAPI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+
+            # The semaphore slot is free for other conversions while this one waits
+            with stage("convertapi_backoff"):
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        await self._client.aclose()
+
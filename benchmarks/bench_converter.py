@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+import tracemalloc
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convertapi_stub import start_stub
+from pdf_converter import ConvertApiConverter, XLSX_CONTENT_TYPE
+
+
+# Compares the pooled streaming converter with one requests.post + response.json() per call
+
+
+def legacy_convert(url: str, excel_file_path: str, output_pdf_path: str):
+    with open(excel_file_path, "rb") as file:
+        files = {"File": (os.path.basename(excel_file_path), file, XLSX_CONTENT_TYPE)}
+        response = requests.post(url, headers={"Authorization": "Bearer stub"}, files=files, timeout=120, stream=True)
+    response.raise_for_status()
+    with open(output_pdf_path, "wb") as pdf_file:
+        pdf_file.write(base64.b64decode(response.json()["Files"][0]["FileData"]))
+
+
+def run(convert, excel_file_path: str, workdir: str, requests_count: int, concurrency: int) -> dict:
+    def one(index: int) -> float:
+        started = time.perf_counter()
+        convert(excel_file_path, os.path.join(workdir, f"out_{index}.pdf"))
+        return time.perf_counter() - started
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = sorted(executor.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        "throughput": requests_count / elapsed,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ConvertAPI client against a local stub")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--pdf-size", type=int, default=2_000_000, help="Bytes of the stubbed PDF")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub server think time in seconds")
+    args = parser.parse_args()
+
+    stub, url = start_stub(os.urandom(args.pdf_size), latency=args.latency)
+    with tempfile.TemporaryDirectory() as workdir:
+        excel_file_path = os.path.join(workdir, "report.xlsx")
+        with open(excel_file_path, "wb") as file:
+            file.write(os.urandom(400_000))
+
+        for concurrency in args.concurrency:
+            converter = ConvertApiConverter("stub", url=url, max_concurrency=concurrency)
+            backends = {
+                "legacy": lambda source, target: legacy_convert(url, source, target),
+                "pooled": converter.convert,
+            }
+            for name, convert in backends.items():
+                result = run(convert, excel_file_path, workdir, args.requests, concurrency)
+                print(
+                    f"{name:<7} concurrency={concurrency:<3} p50={result['p50_ms']:.1f}ms "
+                    f"p95={result['p95_ms']:.1f}ms throughput={result['throughput']:.1f}/s "
+                    f"peak={result['peak_mb']:.1f}MB"
+                )
+            converter.close()
+
+    stub.shutdown()
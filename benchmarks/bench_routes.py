@@ -0,0 +1,372 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from convertapi_stub import start_stub
+from firestore_fake import FakeFirestore
+from storage_fake import FakeBucket
+
+
+# End-to-end benchmark of the real routes: Firestore and Cloud Storage are in-memory fakes, ConvertAPI
+# the local stub, the templates are the real dynamic_excel.xlsx and hist_fin.xlsx. Each stage runs at every
+# concurrency level on projects with distinct answers, so the output cache never answers for it.
+#
+#   python benchmarks/bench_routes.py                      compare with benchmarks/baseline.json
+#   python benchmarks/bench_routes.py --update-baseline    store this run as the baseline
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# Stage -> request; {uid} and {project_id} are filled in per request
+ROUTE_STAGES = {
+    "generate-excel": ("GET", "/generate-excel?uid={uid}&project_id={project_id}&mode=openpyxl"),
+    "generate-excel-patch": ("GET", "/generate-excel?uid={uid}&project_id={project_id}&mode=patch"),
+    "generate-excel-hist": ("GET", "/generate-excel-hist?uid={uid}&project_id={project_id}"),
+    "generate-excel-url": ("GET", "/generate-excel?uid={uid}&project_id={project_id}&delivery=url"),
+    "generate-excel-redirect": ("GET", "/generate-excel?uid={uid}&project_id={project_id}&delivery=redirect"),
+    "convert-to-pdf": ("GET", "/convert-to-pdf?uid={uid}&project_id={project_id}&renderer=convertapi"),
+    "render-pdf": ("GET", "/convert-to-pdf?uid={uid}&project_id={project_id}&renderer=local"),
+    "generate-bundle": ("GET", "/generate-bundle?uid={uid}&project_id={project_id}&renderer=convertapi"),
+    "remove-formulas": ("POST", "/remove-formulas"),
+}
+# Status of a successful response, 200 unless listed
+EXPECTED_STATUS = {"generate-excel-redirect": 303}
+# Stages without a route, called in process
+FUNCTION_STAGES = ("extract-pages",)
+STAGES = tuple(ROUTE_STAGES) + FUNCTION_STAGES
+
+# Numeric blocks of the main template, rows x 6 forecast columns
+SAMPLE_BLOCKS = {
+    "CurrentAssets": 4,
+    "currentLiabilities": 5,
+    "existingStreamsGrossMargin": 4,
+    "pipelineStreamsGrossMargin": 4,
+}
+
+
+def sample_answers(number: int) -> dict:
+    """Answers of a plausible project, `number` makes every project's outputs distinct"""
+    answers = {
+        "clientName": f"Benchmark Client {number}",
+        "subjectCompanyName": f"Benchmark Company {number}",
+        "shortName": "Bench",
+        "projectTitle": "Benchmark valuation",
+        "valuerName": "Benchmark",
+        "valuerType": "External",
+        "purpose": "Benchmark",
+        "premise": "Going concern",
+        "valuationDate": "2024-12-31",
+        "nextFiscalYearEndDate": "2025-12-31",
+        "informationCurrency": "USD",
+        "presentationCurrency": "USD",
+        "units": "Millions",
+        "avgAnnualRevenue": 1000 + number,
+        "CashasatValuationDate": 250 + number,
+        "existingStream1": "Product sales",
+        "pipelineStream1": "Services",
+    }
+    for field, rows in SAMPLE_BLOCKS.items():
+        answers[field] = [[100 + number + row * 10 + column for column in range(6)] for row in range(rows)]
+    return answers
+
+
+def report_pdf_bytes(pages: int = 12) -> bytes:
+    """A real multi-page PDF for the stub to return, so page extraction has work to do"""
+    import fitz
+
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Report page {page_number + 1}", fontsize=18)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def fake_credentials() -> str:
+    """Service account JSON with a throwaway key, firebase_admin validates the key format"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode("ascii")
+    return json.dumps({
+        "type": "service_account",
+        "project_id": "valify-benchmark",
+        "private_key_id": "benchmark",
+        "private_key": pem,
+        "client_email": "benchmark@valify-benchmark.iam.gserviceaccount.com",
+        "client_id": "0",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    })
+
+
+class RssSampler:
+    """Polls this process's resident set size on a thread and keeps the peak"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._thread = None
+
+    def current(self) -> int:
+        try:
+            with open("/proc/self/statm") as file:
+                return int(file.read().split()[1]) * self._page_size
+        except OSError:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def summarize(latencies: list, elapsed: float, peak_rss: int) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 1),
+        "throughput": round(len(latencies) / elapsed, 3),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+    }
+
+
+class Bench:
+    """Sets up the stand-ins, imports the app and runs the stages"""
+
+    def __init__(self, app_name: str, stub_latency: float, firestore_latency: float, workdir: str):
+        self.app_name = app_name
+        self.workdir = workdir
+        self.fake = FakeFirestore(latency=firestore_latency)
+        self.bucket = FakeBucket()
+        self.pdf_bytes = report_pdf_bytes()
+        self.stub, url = start_stub(self.pdf_bytes, latency=stub_latency)
+        self.counter = 0
+        self.loop = asyncio.new_event_loop() if app_name == "asgi" else None
+
+        # The app reads its configuration at import
+        os.environ["RENDER"] = "1"
+        os.environ.setdefault("FIREBASE_CREDENTIALS", fake_credentials())
+        os.environ.setdefault("CONVERT_API_KEY", "benchmark")
+        os.environ["CONVERT_API_URL"] = url
+        os.environ["OUTPUT_CACHE_DIR"] = os.path.join(workdir, "cache")
+
+        import firebase_admin.firestore
+        import firebase_admin.firestore_async
+        import firebase_admin.storage
+        firebase_admin.firestore.client = lambda *args, **kwargs: self.fake
+        firebase_admin.firestore_async.client = lambda *args, **kwargs: self.fake.async_client()
+        firebase_admin.storage.bucket = lambda *args, **kwargs: self.bucket
+
+        started = time.perf_counter()
+        import index
+        self.index = index
+        if app_name == "asgi":
+            import asgi
+            self.app = asgi.app
+        else:
+            self.app = index.app
+        self.import_seconds = time.perf_counter() - started
+
+        with open(index.TEMPLATE_PATH, "rb") as file:
+            self.workbook_bytes = file.read()
+        self.report_pdf = os.path.join(workdir, "report.pdf")
+        with open(self.report_pdf, "wb") as file:
+            file.write(self.pdf_bytes)
+
+    def new_project(self) -> tuple:
+        self.counter += 1
+        project_id = f"bench-{self.counter}"
+        self.fake.collection("users").document("bench").collection("projects").document(project_id).set(
+            {"answers": sample_answers(self.counter)}
+        )
+        return "bench", project_id
+
+    def call_function(self, stage: str, number: int):
+        if stage == "extract-pages":
+            output = os.path.join(self.workdir, f"extract_{number}.pdf")
+            if not self.index.extract_pages_from_pdf(self.report_pdf, output, 2):
+                raise RuntimeError("Page extraction failed")
+            os.remove(output)
+
+    def run_flask(self, stage: str, concurrency: int, count: int) -> tuple:
+        client = self.app.test_client()
+        projects = [self.new_project() for _ in range(count)]
+
+        def one(number: int) -> float:
+            started = time.perf_counter()
+            if stage in FUNCTION_STAGES:
+                self.call_function(stage, number)
+            else:
+                method, path = ROUTE_STAGES[stage]
+                uid, project_id = projects[number]
+                if method == "POST":
+                    data = {"file": (io.BytesIO(self.workbook_bytes), "bench.xlsx")}
+                    response = client.post(path, data=data, content_type="multipart/form-data")
+                else:
+                    response = client.get(path.format(uid=uid, project_id=project_id))
+                response.get_data()
+                if response.status_code != EXPECTED_STATUS.get(stage, 200):
+                    raise RuntimeError(f"{stage} returned {response.status_code}: {response.get_data()[:200]!r}")
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            started = time.perf_counter()
+            latencies = list(executor.map(one, range(count)))
+        return latencies, time.perf_counter() - started
+
+    def run_asgi(self, stage: str, concurrency: int, count: int) -> tuple:
+        from quart.datastructures import FileStorage
+
+        client = self.app.test_client()
+        projects = [self.new_project() for _ in range(count)]
+
+        async def one(semaphore, number: int) -> float:
+            async with semaphore:
+                started = time.perf_counter()
+                if stage in FUNCTION_STAGES:
+                    await asyncio.get_running_loop().run_in_executor(None, self.call_function, stage, number)
+                else:
+                    method, path = ROUTE_STAGES[stage]
+                    uid, project_id = projects[number]
+                    if method == "POST":
+                        files = {"file": FileStorage(io.BytesIO(self.workbook_bytes), filename="bench.xlsx")}
+                        response = await client.post(path, files=files)
+                    else:
+                        response = await client.get(path.format(uid=uid, project_id=project_id))
+                    body = await response.get_data()
+                    if response.status_code != EXPECTED_STATUS.get(stage, 200):
+                        raise RuntimeError(f"{stage} returned {response.status_code}: {body[:200]!r}")
+                return time.perf_counter() - started
+
+        async def run_all() -> list:
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(one(semaphore, number) for number in range(count)))
+
+        # One loop for every stage, the app's async clients stay bound to the loop that made them
+        started = time.perf_counter()
+        latencies = self.loop.run_until_complete(run_all())
+        return latencies, time.perf_counter() - started
+
+    def run(self, stage: str, concurrency: int, count: int) -> dict:
+        runner = self.run_asgi if self.app_name == "asgi" else self.run_flask
+        # One untimed request builds whatever the stage loads on first use
+        runner(stage, 1, 1)
+        with RssSampler() as sampler:
+            latencies, elapsed = runner(stage, concurrency, count)
+        return summarize(latencies, elapsed, sampler.peak)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.close()
+        self.stub.shutdown()
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """Returns a description of every metric worse than the baseline by more than `tolerance`"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            # Tiny absolute changes of fast stages are noise, not regressions
+            if result[metric] > base[metric] * (1 + tolerance) and result[metric] - base[metric] > min_delta_ms:
+                regressions.append(f"{name} {metric} {base[metric]} -> {result[metric]}")
+        # Throughput is compared as time per request, with the same noise floor
+        slower_ms = (1 / result["throughput"] - 1 / base["throughput"]) * 1000
+        if result["throughput"] < base["throughput"] * (1 - tolerance) and slower_ms > min_delta_ms:
+            regressions.append(f"{name} throughput {base['throughput']} -> {result['throughput']}")
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name} peak_rss_mb {base['peak_rss_mb']} -> {result['peak_rss_mb']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the routes end to end against local stand-ins")
+    parser.add_argument("--app", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--requests", type=int, default=8, help="Timed requests per stage and concurrency level")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="ConvertAPI stub think time in seconds")
+    parser.add_argument("--firestore-latency", type=float, default=0.02, help="Firestore fake round trip in seconds")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=20, help="Ignore latency changes smaller than this")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bench = Bench(args.app, args.stub_latency, args.firestore_latency, workdir)
+        print(f"App '{args.app}' imported in {bench.import_seconds:.2f}s")
+
+        results = {}
+        for stage in args.stages:
+            for concurrency in args.concurrency:
+                name = f"{args.app}/{stage}/c{concurrency}"
+                results[name] = bench.run(stage, concurrency, args.requests)
+                result = results[name]
+                print(
+                    f"{name:<36} p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms "
+                    f"throughput={result['throughput']:.2f}/s peak_rss={result['peak_rss_mb']:.1f}MB"
+                )
+        bench.close()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    if args.update_baseline:
+        baseline.setdefault("results", {}).update(results)
+        baseline["machine"] = {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        sys.exit(0)
+
+    if not baseline:
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        sys.exit(0)
+
+    regressions = compare(results, baseline.get("results", {}), args.tolerance, args.min_delta_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
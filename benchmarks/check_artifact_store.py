@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from storage_fake import FakeBucket, FakeBlob
+from artifact_store import ArtifactStore
+
+
+# Checks the content-addressed uploads of artifact_store.ArtifactStore against the Storage fake:
+# identical files are stored once, within a worker, across workers and when two workers race.
+#
+#   python benchmarks/check_artifact_store.py          exit code 1 on any failed check
+
+
+class LateBlob(FakeBlob):
+    """Reports the blob missing, as if another worker uploads it right after the existence check"""
+
+    def exists(self) -> bool:
+        super().exists()
+        return False
+
+
+class RacingBucket(FakeBucket):
+    def blob(self, name: str) -> FakeBlob:
+        return LateBlob(self, name)
+
+
+def write_file(directory: str, name: str, data: bytes) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+
+def run_checks(directory: str) -> list:
+    """Returns a description of every failed check"""
+    failures = []
+
+    def check(name: str, condition: bool, detail=""):
+        print(f"{'ok  ' if condition else 'FAIL'} {name} {detail}".rstrip())
+        if not condition:
+            failures.append(name)
+
+    bucket = FakeBucket()
+    worker = ArtifactStore(bucket, url_ttl=600)
+    first = write_file(directory, "first.pdf", b"%PDF-1.4 report")
+    copy = write_file(directory, "copy.pdf", b"%PDF-1.4 report")
+    other = write_file(directory, "other.pdf", b"%PDF-1.4 another report")
+
+    published = worker.publish(first, "report.pdf")
+    check("first publish uploads", bucket.uploads == 1, bucket.uploads)
+    check("blob named by content", list(bucket.blobs) == [f"artifacts/{published['sha256']}.pdf"], list(bucket.blobs))
+    check("signed URL carries the TTL", "X-Goog-Expires=600" in published["url"], published["url"])
+
+    round_trips = bucket.round_trips
+    again = worker.publish(copy, "renamed.pdf")
+    check("same content is not uploaded again", bucket.uploads == 1, bucket.uploads)
+    check("known content skips the bucket", bucket.round_trips == round_trips, bucket.round_trips - round_trips)
+    check("same blob, own filename", again["sha256"] == published["sha256"] and again["filename"] == "renamed.pdf")
+
+    worker.publish(other)
+    check("different content is uploaded", bucket.uploads == 2, bucket.uploads)
+
+    second_worker = ArtifactStore(bucket)
+    second_worker.publish(copy)
+    check("another worker finds the blob", bucket.uploads == 2 and second_worker.stats()["reused"] == 1,
+          second_worker.stats())
+
+    # The if_generation_match=0 upload loses the race and must count as a reuse, not fail
+    racing = RacingBucket()
+    racing.blobs[f"artifacts/{published['sha256']}.pdf"] = {"data": b"%PDF-1.4 report", "content_type": None}
+    late_worker = ArtifactStore(racing)
+    try:
+        late_worker.publish(first)
+        check("lost create race is not an error", True)
+    except Exception as e:
+        check("lost create race is not an error", False, repr(e))
+    check("lost create race is counted as reused", late_worker.stats() == {"uploads": 0, "reused": 1, "known": 1},
+          late_worker.stats())
+    check("lost create race keeps the stored blob", racing.uploads == 0, racing.uploads)
+
+    return failures
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as workdir:
+        failed = run_checks(workdir)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import math
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_routes import sample_answers, fake_credentials
+
+
+# Checks that GENERATION_MODE "patch" and "openpyxl" produce the same workbook: every cell of
+# every sheet, the mapped inputs and the values derived from the template, compared by value.
+#
+#   python benchmarks/check_generation_modes.py          exit code 1 on any difference
+
+
+def _same(left, right) -> bool:
+    # An empty string and no value are the same blank cell, openpyxl drops the former on save
+    if left in (None, "") and right in (None, ""):
+        return True
+    # openpyxl re-serialises floats, the patch writer copies the template's digits
+    if isinstance(left, float) or isinstance(right, float):
+        try:
+            return math.isclose(float(left), float(right), rel_tol=1e-12, abs_tol=1e-12)
+        except (TypeError, ValueError):
+            return False
+    return left == right
+
+
+def compare_workbooks(left: bytes, right: bytes, limit: int = 20) -> list:
+    """Returns the cells whose formula or value differs between the two workbooks"""
+    from openpyxl import load_workbook
+
+    differences = []
+    first = load_workbook(io.BytesIO(left))
+    second = load_workbook(io.BytesIO(right))
+    if first.sheetnames != second.sheetnames:
+        return [f"Sheet list differs: {first.sheetnames} != {second.sheetnames}"]
+
+    for worksheet in first:
+        other = second[worksheet.title]
+        coordinates = set(worksheet._cells) | set(other._cells)
+        for row, column in sorted(coordinates):
+            value, other_value = worksheet.cell(row, column).value, other.cell(row, column).value
+            if not _same(value, other_value):
+                coordinate = worksheet.cell(row, column).coordinate
+                differences.append(f"{worksheet.title}!{coordinate}: {value!r} != {other_value!r}")
+                if len(differences) >= limit:
+                    return differences
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the patch and openpyxl generation modes cell by cell")
+    parser.add_argument("--projects", type=int, default=2, help="Sample projects to generate")
+    args = parser.parse_args()
+
+    os.environ["RENDER"] = "1"
+    os.environ.setdefault("FIREBASE_CREDENTIALS", fake_credentials())
+    os.environ.setdefault("CONVERT_API_KEY", "check")
+    os.environ.setdefault("STARTUP_MODE", "lazy")
+
+    import index
+    from workbook_generation import fill_template
+
+    failed = False
+    for number in range(1, args.projects + 1):
+        data = sample_answers(number)
+        for template_name in index.template_registry.names():
+            compiled = index.template_registry.get(template_name)
+            outputs = {}
+            for mode in ("openpyxl", "patch"):
+                output = io.BytesIO()
+                fill_template(index.template_cache, compiled, data, output, mode)
+                outputs[mode] = output.getvalue()
+
+            differences = compare_workbooks(outputs["openpyxl"], outputs["patch"])
+            for difference in differences:
+                print(f"MISMATCH project {number} {template_name} {difference}")
+            failed = failed or bool(differences)
+            print(f"project {number} {template_name}: {'differs' if differences else 'identical'}")
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,88 @@
+import json
+import time
+import base64
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the ConvertAPI xls-to-pdf endpoint, used to benchmark the converter client
+
+
+class ConvertApiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        remaining = length
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+
+        with server.lock:
+            server.requests += 1
+            server.bytes_received += length
+            failing = server.failures > 0
+            if failing:
+                server.failures -= 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if failing:
+            body = b'{"Code":5007,"Message":"Service unavailable"}'
+            self.send_response(server.failure_status)
+            self.send_header("Retry-After", "0")
+        else:
+            body = server.response_body
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub(pdf_bytes: bytes, port: int = 0, latency: float = 0.0, failures: int = 0,
+               failure_status: int = 503):
+    """Starts the stub on a background thread and returns (server, url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), ConvertApiStubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.bytes_received = 0
+    server.latency = latency
+    server.failures = failures
+    server.failure_status = failure_status
+    server.response_body = json.dumps({
+        "ConversionCost": 1,
+        "Files": [{
+            "FileName": "report.pdf",
+            "FileExt": "pdf",
+            "FileSize": len(pdf_bytes),
+            "FileData": base64.b64encode(pdf_bytes).decode("ascii"),
+        }],
+    }).encode("utf-8")
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/convert/xls/to/pdf"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fixed PDF the way ConvertAPI returns it")
+    parser.add_argument("pdf", help="PDF file returned for every conversion")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--failures", type=int, default=0, help="Answer the first N requests with 503")
+    args = parser.parse_args()
+
+    with open(args.pdf, "rb") as file:
+        stub, url = start_stub(file.read(), args.port, args.latency, args.failures)
+    print(f"ConvertAPI stub listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
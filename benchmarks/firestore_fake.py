@@ -0,0 +1,194 @@
+import re
+import copy
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+
+# In-memory stand-in for the parts of the Firestore client the backend uses: documents, field
+# masks, get_all and snapshot listeners. Reads can be delayed to mimic the network round trip.
+
+
+FIELD_PATH_RE = re.compile(r"`((?:[^`\\]|\\.)*)`|([^.]+)")
+
+
+def _split_field_path(field_path: str) -> list:
+    return [quoted.replace("\\`", "`") if quoted else plain for quoted, plain in FIELD_PATH_RE.findall(field_path)]
+
+
+def _project(data: dict, field_paths) -> dict:
+    """Keeps only `field_paths` of `data`, like a Firestore field mask"""
+    if field_paths is None:
+        return copy.deepcopy(data)
+
+    projected = {}
+    for field_path in field_paths:
+        parts = _split_field_path(field_path)
+        source = data
+        for part in parts:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = copy.deepcopy(source)
+    return projected
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeWatch:
+    def __init__(self, db, path: str, callback):
+        self._db = db
+        self._path = path
+        self._callback = callback
+
+    def unsubscribe(self):
+        with self._db.lock:
+            listeners = self._db.listeners.get(self._path, [])
+            if self in listeners:
+                listeners.remove(self)
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, **kwargs):
+        self._db.simulate_round_trip()
+        return self._db.snapshot(self, field_paths)
+
+    def set(self, data: dict):
+        self._db.write(self.path, copy.deepcopy(data))
+
+    def update(self, data: dict):
+        with self._db.lock:
+            current = copy.deepcopy(self._db.documents.get(self.path, (None, None))[0])
+        if current is None:
+            raise KeyError(f"No document to update: {self.path}")
+        current.update(copy.deepcopy(data))
+        self._db.write(self.path, current)
+
+    def delete(self):
+        self._db.write(self.path, None)
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self._db, self.path, callback)
+        with self._db.lock:
+            self._db.listeners.setdefault(self.path, []).append(watch)
+        # Like the real client, the current state is delivered first
+        callback([self._db.snapshot(self, None)], [], datetime.now(timezone.utc))
+        return watch
+
+
+class FakeCollectionReference:
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+
+    def document(self, document_id: str):
+        return FakeDocumentReference(self._db, f"{self.path}/{document_id}")
+
+
+class FakeAsyncDocumentReference:
+    """Async view of a document, the round trip is awaited instead of slept"""
+
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str):
+        return FakeAsyncCollectionReference(self._db, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None, **kwargs):
+        with self._db.lock:
+            self._db.round_trips += 1
+        if self._db.latency:
+            await asyncio.sleep(self._db.latency)
+        return self._db.snapshot(FakeDocumentReference(self._db, self.path), field_paths)
+
+
+class FakeAsyncCollectionReference:
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+
+    def document(self, document_id: str):
+        return FakeAsyncDocumentReference(self._db, f"{self.path}/{document_id}")
+
+
+class FakeAsyncFirestore:
+    """Async client over the documents of a FakeFirestore, like firestore.AsyncClient"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def collection(self, name: str):
+        return FakeAsyncCollectionReference(self._db, name)
+
+
+class FakeFirestore:
+    """Documents keyed by path, with per-read latency and read counters"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        # path -> (data, update_time)
+        self.documents = {}
+        self.listeners = {}
+        self.reads = 0
+        self.round_trips = 0
+
+    def simulate_round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self, name)
+
+    def async_client(self) -> FakeAsyncFirestore:
+        return FakeAsyncFirestore(self)
+
+    def snapshot(self, reference, field_paths) -> FakeSnapshot:
+        with self.lock:
+            self.reads += 1
+            data, update_time = self.documents.get(reference.path, (None, None))
+            return FakeSnapshot(reference, _project(data, field_paths) if data is not None else None, update_time)
+
+    def get_all(self, references, field_paths=None, **kwargs):
+        self.simulate_round_trip()
+        for reference in references:
+            yield self.snapshot(reference, field_paths)
+
+    def write(self, path: str, data):
+        with self.lock:
+            if data is None:
+                self.documents.pop(path, None)
+            else:
+                self.documents[path] = (data, datetime.now(timezone.utc))
+            listeners = list(self.listeners.get(path, []))
+
+        reference = FakeDocumentReference(self, path)
+        for watch in listeners:
+            watch._callback([self.snapshot(reference, None)], [], datetime.now(timezone.utc))
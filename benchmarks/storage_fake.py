@@ -0,0 +1,55 @@
+import threading
+from urllib.parse import quote
+
+
+# In-memory stand-in for a Cloud Storage bucket: blobs, create-only uploads and signed URLs
+
+
+class FakePreconditionFailed(Exception):
+    code = 412
+
+
+class FakeBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self) -> bool:
+        with self.bucket.lock:
+            self.bucket.round_trips += 1
+            return self.name in self.bucket.blobs
+
+    def upload_from_filename(self, path: str, content_type: str = None, if_generation_match: int = None):
+        with open(path, "rb") as file:
+            data = file.read()
+        with self.bucket.lock:
+            self.bucket.round_trips += 1
+            if if_generation_match == 0 and self.name in self.bucket.blobs:
+                raise FakePreconditionFailed(f"{self.name} already exists")
+            self.bucket.blobs[self.name] = {"data": data, "content_type": content_type}
+            self.bucket.uploads += 1
+
+    def download_as_bytes(self) -> bytes:
+        with self.bucket.lock:
+            return self.bucket.blobs[self.name]["data"]
+
+    def generate_signed_url(self, expiration=None, method: str = "GET", api_access_endpoint: str = None, **kwargs) -> str:
+        # Signing happens locally in the real client too, no round trip
+        endpoint = api_access_endpoint or self.bucket.endpoint
+        seconds = int(expiration.total_seconds()) if expiration is not None else 0
+        return f"{endpoint}/{self.bucket.name}/{quote(self.name)}?X-Goog-Expires={seconds}&X-Goog-Signature=fake"
+
+
+class FakeBucket:
+    """Blobs keyed by name, with upload and round trip counters"""
+
+    def __init__(self, name: str = "valify-test.appspot.com", endpoint: str = "https://storage.googleapis.com"):
+        self.name = name
+        self.endpoint = endpoint
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.uploads = 0
+        self.round_trips = 0
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
@@ -0,0 +1,135 @@
+import math
+import statistics
+from pycel.excellib import _numerics
+from pycel.excelutil import ERROR_CODES, NA_ERROR, NUM_ERROR, VALUE_ERROR, flatten, list_like
+from pycel.lib.function_helpers import excel_helper, excel_math_func
+
+
+# Excel functions used by the valuation templates that pycel does not ship.
+# pycel loads this module as a plugin and looks functions up by lowercase name.
+
+
+def median(*args):
+    """MEDIAN over every numeric value in the arguments"""
+    data = _numerics(*args)
+
+    # A returned string is an error code
+    if isinstance(data, str):
+        return data
+    elif len(data) == 0:
+        return NUM_ERROR
+    return statistics.median(data)
+
+
+def mode(*args):
+    """MODE, the first most frequent numeric value"""
+    data = _numerics(*args)
+
+    if isinstance(data, str):
+        return data
+
+    counts = {}
+    for value in data:
+        counts[value] = counts.get(value, 0) + 1
+
+    best = max(counts.values(), default=0)
+    if best < 2:
+        return NA_ERROR
+    return next(value for value in data if counts[value] == best)
+
+
+def percentile(array, k):
+    """PERCENTILE / PERCENTILE.INC with linear interpolation"""
+    if k in ERROR_CODES:
+        return k
+
+    data = _numerics(array)
+    if isinstance(data, str):
+        return data
+    if not data or not 0 <= k <= 1:
+        return NUM_ERROR
+
+    data = sorted(data)
+    position = (len(data) - 1) * k
+    lower = math.floor(position)
+    upper = min(lower + 1, len(data) - 1)
+    return data[lower] + (data[upper] - data[lower]) * (position - lower)
+
+
+def quartile(array, quart):
+    """QUARTILE / QUARTILE.INC"""
+    if quart in ERROR_CODES:
+        return quart
+    if quart not in (0, 1, 2, 3, 4):
+        return NUM_ERROR
+    return percentile(array, quart / 4)
+
+
+@excel_math_func
+def mround(number, multiple):
+    """MROUND, rounds half away from zero to the nearest multiple"""
+    if multiple == 0:
+        return 0
+    if number * multiple < 0:
+        return NUM_ERROR
+
+    steps = math.floor(abs(number / multiple) + 0.5)
+    return math.copysign(steps * abs(multiple), multiple)
+
+
+def transpose(array):
+    """TRANSPOSE of a range"""
+    if not list_like(array):
+        return ((array, ), )
+    return tuple(zip(*array))
+
+
+def single(value):
+    """Implicit intersection operator (@), takes the first cell of a range"""
+    if list_like(value):
+        return next(iter(flatten(value)), None)
+    return value
+
+
+def _lookup_equal(left, right) -> bool:
+    if isinstance(left, str) and isinstance(right, str):
+        return left.lower() == right.lower()
+    return left == right
+
+
+@excel_helper(cse_params=0, err_str_params=0)
+def xlookup(lookup_value, lookup_array, return_array, if_not_found=NA_ERROR, match_mode=0, search_mode=1):
+    """XLOOKUP for exact (0) and next smaller/larger (-1/1) matches"""
+    horizontal = len(lookup_array) == 1
+    keys = tuple(flatten(lookup_array))
+
+    if horizontal:
+        results = tuple(tuple(row[index] for row in return_array) for index in range(len(keys)))
+    else:
+        results = tuple(return_array)
+
+    if len(results) != len(keys):
+        return VALUE_ERROR
+
+    order = range(len(keys)) if search_mode >= 0 else range(len(keys) - 1, -1, -1)
+    found = None
+    for index in order:
+        key = keys[index]
+        if _lookup_equal(key, lookup_value):
+            found = index
+            break
+
+        if match_mode in (-1, 1) and isinstance(key, (int, float)) and not isinstance(key, bool):
+            if match_mode == -1 and key < lookup_value and (found is None or key > keys[found]):
+                found = index
+            elif match_mode == 1 and key > lookup_value and (found is None or key < keys[found]):
+                found = index
+
+    if found is None:
+        return if_not_found
+
+    row = results[found]
+    if len(row) == 1:
+        return row[0]
+    return tuple((value, ) for value in row) if horizontal else (row, )
+
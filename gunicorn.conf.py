@@ -0,0 +1,15 @@
+import os
+
+
+# Gunicorn reads this file from the working directory, the Procfile sets bind and threads
+
+# STARTUP_MODE=preload imports index.py in the master, so the parsed templates and compiled
+# models are built once and shared copy-on-write by every forked worker
+preload_app = os.getenv("STARTUP_MODE") == "preload"
+
+
+def post_worker_init(worker):
+    """Logs each worker's memory once it is ready to serve, to compare startup modes"""
+    from startup import memory_usage
+
+    worker.log.info(f"Worker {worker.pid} ready, memory {memory_usage()}")
@@ -1,20 +1,26 @@
+import io
 import os
+import gc
+import time
 import json
 import tempfile
-import requests
-import base64
 from datetime import datetime
-import firebase_admin
-from firebase_admin import credentials, firestore, storage, auth
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, redirect, Response, stream_with_context, g
 from flask_cors import CORS
 from dotenv import load_dotenv
-from openpyxl import load_workbook
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import fitz 
-import shutil
 import warnings
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from output_cache import OutputCache
+from job_queue import JobQueue, QueueFullError
+from startup import STARTUP_MODES, LazyResource, memory_usage
+import metrics
+
+# Heavy libraries (firebase_admin, openpyxl, pycel, reportlab, numpy, fitz, requests) are
+# imported by the factories and functions that need them, see STARTUP_MODE below
+STARTUP_STARTED = time.perf_counter()
 
 warnings.simplefilter("ignore", UserWarning)
 
@@ -27,7 +33,10 @@ if os.getenv("RENDER") is None:  # Render automatically sets this variable
 
 # Function to verify Firebase Authentication Token
 def verify_token(id_token):
+    from firebase_admin import auth
+
     try:
+        firebase_app.load()
         decoded_token = auth.verify_id_token(id_token)
         return decoded_token
     except auth.ExpiredIdTokenError:
@@ -45,205 +54,366 @@ if not firebase_credentials:
 
 try:
     cred_dict = json.loads(firebase_credentials)
-    cred = credentials.Certificate(cred_dict)
-    firebase_admin.initialize_app(cred, {"storageBucket": "valify-7e530.appspot.com"})
-    db = firestore.client()
 except json.JSONDecodeError as e:
     raise ValueError(f"Invalid FIREBASE_CREDENTIALS JSON: {e}")
 
+# "eager" builds all worker state at import, "lazy" on first use, "preload" builds the templates
+# and models in the gunicorn master (preload_app, see gunicorn.conf.py) to share them copy-on-write
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+if STARTUP_MODE not in STARTUP_MODES:
+    raise ValueError(f"Unknown STARTUP_MODE '{STARTUP_MODE}', expected one of {', '.join(STARTUP_MODES)}")
+
+
+def build_firebase_app():
+    """Initializes the default Firebase app"""
+    import firebase_admin
+    from firebase_admin import credentials
+
+    cred = credentials.Certificate(cred_dict)
+    return firebase_admin.initialize_app(cred, {"storageBucket": "valify-7e530.appspot.com"})
+
+
+def build_db():
+    """Firestore client of the default app"""
+    from firebase_admin import firestore
+
+    firebase_app.load()
+    return firestore.client()
+
+
+def build_async_db():
+    """Async Firestore client of the default app, for the ASGI app (asgi.py)"""
+    from firebase_admin import firestore_async
+
+    firebase_app.load()
+    return firestore_async.client()
+
+
+firebase_app = LazyResource("firebase", build_firebase_app)
+db = LazyResource("firestore", build_db)
+# Bound to the event loop that first uses it, so it is never built at import
+async_db = LazyResource("async firestore", build_async_db)
+
 CONVERT_API_KEY = os.getenv("CONVERT_API_KEY")
-CONVERT_API_URL = "https://v2.convertapi.com/convert/xls/to/pdf"
+CONVERT_API_URL = os.getenv("CONVERT_API_URL", "https://v2.convertapi.com/convert/xls/to/pdf")
 
 if not CONVERT_API_KEY:
     raise ValueError("Missing CONVERT_API_KEY in environment variables!")
 
+def build_pdf_converter():
+    """Pooled converter client shared by all requests handled in this worker"""
+    from pdf_converter import create_converter
+
+    return create_converter(
+        os.getenv("PDF_CONVERTER_BACKEND", "convertapi"),
+        api_key=CONVERT_API_KEY,
+        url=CONVERT_API_URL,
+        max_concurrency=int(os.getenv("CONVERT_API_MAX_CONCURRENCY", "4")),
+        max_retries=int(os.getenv("CONVERT_API_MAX_RETRIES", "3")),
+        max_backoff=float(os.getenv("CONVERT_API_MAX_BACKOFF", "30")),
+    )
+
+
+pdf_converter = LazyResource("pdf converter", build_pdf_converter)
+
+# How generated files reach the client: "stream" sends them through the worker, "redirect"
+# answers 303 to a signed Storage URL and "url" returns that URL as JSON
+ARTIFACT_DELIVERIES = ("stream", "redirect", "url")
+ARTIFACT_DELIVERY = os.getenv("ARTIFACT_DELIVERY", "stream")
+if ARTIFACT_DELIVERY not in ARTIFACT_DELIVERIES:
+    raise ValueError(f"Unknown ARTIFACT_DELIVERY '{ARTIFACT_DELIVERY}', expected one of {', '.join(ARTIFACT_DELIVERIES)}")
+
+
+def build_artifact_store():
+    """Content-addressed artifact uploads to the app's Storage bucket"""
+    from firebase_admin import storage
+    from artifact_store import ArtifactStore
+
+    firebase_app.load()
+    # google-cloud-storage talks to the emulator when STORAGE_EMULATOR_HOST is set, signed
+    # URLs have to point there too
+    return ArtifactStore(
+        storage.bucket(),
+        prefix=os.getenv("ARTIFACT_PREFIX", "artifacts"),
+        url_ttl=int(os.getenv("ARTIFACT_URL_TTL", "900")),
+        api_access_endpoint=os.getenv("STORAGE_EMULATOR_HOST"),
+    )
+
+
+artifact_store = LazyResource("artifact store", build_artifact_store)
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
 
+
+# Request metrics: in-flight gauge, stage timings in a Server-Timing header, totals for /metrics
+@app.before_request
+def start_request_metrics():
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    g.request_metrics = metrics.RequestMetrics(route, request.method)
+
+
+@app.after_request
+def finish_request_metrics(response):
+    request_metrics = g.get("request_metrics")
+    if request_metrics is not None:
+        response.headers["Server-Timing"] = request_metrics.server_timing()
+        # Streamed responses (batch zips) have no length up front and are not counted
+        request_metrics.finish(response.status_code, request.content_length, response.content_length)
+    return response
+
+
+@app.teardown_request
+def close_request_metrics(error=None):
+    request_metrics = g.pop("request_metrics", None)
+    if request_metrics is not None:
+        # Requests that raised never reached after_request
+        request_metrics.finish(500, request.content_length)
+        request_metrics.close()
+
 # Define paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-TEMPLATE_PATH = os.path.join(BASE_DIR, "dynamic_excel.xlsx")  # Ensure this file exists
-TEMPLATE_PATH_HIST = os.path.join(BASE_DIR, "hist_fin.xlsx")  # Ensure this file exists
+# Point these at the runtime templates built by template_precompile.py to serve those instead
+TEMPLATE_PATH = os.getenv("TEMPLATE_PATH", os.path.join(BASE_DIR, "dynamic_excel.xlsx"))  # Ensure this file exists
+TEMPLATE_PATH_HIST = os.getenv("TEMPLATE_PATH_HIST", os.path.join(BASE_DIR, "hist_fin.xlsx"))  # Ensure this file exists
+# Shared state of the workers (output cache, jobs, project invalidations), each directory is created on first use
 OUTPUT_DIR = os.path.join(BASE_DIR, "output")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-
-json_to_excel_mapping = {
-    "Inputs": {
-  "CashasatValuationDate": "E257",
-  "CurrentAssets_0_0": "L232",
-  "CurrentAssets_0_1": "M232",
-  "CurrentAssets_0_2": "N232",
-  "CurrentAssets_0_3": "O232",
-  "CurrentAssets_0_4": "P232",
-  "CurrentAssets_0_5": "Q232",
-  "CurrentAssets_1_0": "L233",
-  "CurrentAssets_1_1": "M233",
-  "CurrentAssets_1_2": "N233",
-  "CurrentAssets_1_3": "O233",
-  "CurrentAssets_1_4": "P233",
-  "CurrentAssets_1_5": "Q233",
-  "CurrentAssets_2_0": "L234",
-  "CurrentAssets_2_1": "M234",
-  "CurrentAssets_2_2": "N234",
-  "CurrentAssets_2_3": "O234",
-  "CurrentAssets_2_4": "P234",
-  "CurrentAssets_2_5": "Q234",
-  "CurrentAssets_3_0": "L235",
-  "CurrentAssets_3_1": "M235",
-  "CurrentAssets_3_2": "N235",
-  "CurrentAssets_3_3": "O235",
-  "CurrentAssets_3_4": "P235",
-  "CurrentAssets_3_5": "Q235",
-  "Cyclicality": "E279",
-  "PenetrationRisk": "E275",
-  "VendorRisk": "E276",
-  "avgAnnualRevenue": "E49",
-  "clientName": "E19",
-  "currentLiabilities_0_0": "L237",
-  "currentLiabilities_0_1": "M237",
-  "currentLiabilities_0_2": "N237",
-  "currentLiabilities_0_3": "O237",
-  "currentLiabilities_0_4": "P237",
-  "currentLiabilities_0_5": "Q237",
-  "currentLiabilities_1_0": "L238",
-  "currentLiabilities_1_1": "M238",
-  "currentLiabilities_1_2": "N238",
-  "currentLiabilities_1_3": "O238",
-  "currentLiabilities_1_4": "P238",
-  "currentLiabilities_1_5": "Q238",
-  "currentLiabilities_2_0": "L239",
-  "currentLiabilities_2_1": "M239",
-  "currentLiabilities_2_2": "N239",
-  "currentLiabilities_2_3": "O239",
-  "currentLiabilities_2_4": "P239",
-  "currentLiabilities_2_5": "Q239",
-  "currentLiabilities_3_0": "L240",
-  "currentLiabilities_3_1": "M240",
-  "currentLiabilities_3_2": "N240",
-  "currentLiabilities_3_3": "O240",
-  "currentLiabilities_3_4": "P240",
-  "currentLiabilities_3_5": "Q240",
-  "currentLiabilities_4_0": "L241",
-  "currentLiabilities_4_1": "M241",
-  "currentLiabilities_4_2": "N241",
-  "currentLiabilities_4_3": "O241",
-  "currentLiabilities_4_4": "P241",
-  "currentLiabilities_4_5": "Q241",
-  "developmentPhase": "E50",
-  "existingStream1": "E77",
-  "existingStream2": "E78",
-  "existingStream3": "E79",
-  "existingStream4": "E80",
-  "existingStreamsGrossMargin_0_0": "L167",
-  "existingStreamsGrossMargin_0_1": "M167",
-  "existingStreamsGrossMargin_0_2": "N167",
-  "existingStreamsGrossMargin_0_3": "O167",
-  "existingStreamsGrossMargin_0_4": "P167",
-  "existingStreamsGrossMargin_0_5": "Q167",
-  "existingStreamsGrossMargin_1_0": "L168",
-  "existingStreamsGrossMargin_1_1": "M168",
-  "existingStreamsGrossMargin_1_2": "N168",
-  "existingStreamsGrossMargin_1_3": "O168",
-  "existingStreamsGrossMargin_1_4": "P168",
-  "existingStreamsGrossMargin_1_5": "Q168",
-  "existingStreamsGrossMargin_2_0": "L169",
-  "existingStreamsGrossMargin_2_1": "M169",
-  "existingStreamsGrossMargin_2_2": "N169",
-  "existingStreamsGrossMargin_2_3": "O169",
-  "existingStreamsGrossMargin_2_4": "P169",
-  "existingStreamsGrossMargin_2_5": "Q169",
-  "existingStreamsGrossMargin_3_0": "L170",
-  "existingStreamsGrossMargin_3_1": "M170",
-  "existingStreamsGrossMargin_3_2": "N170",
-  "existingStreamsGrossMargin_3_3": "O170",
-  "existingStreamsGrossMargin_3_4": "P170",
-  "existingStreamsGrossMargin_3_5": "Q170",
-  "industryPrimaryBusiness": "E52",
-  "industrySecondaryBusiness": "E63",
-  "informationCurrency": "E43",
-  "otherOperatingRegionsSecondaryName1": "D71",
-  "otherOperatingRegionsSecondaryName2": "D72",
-  "otherOperatingRegionsSecondaryName3": "D73",
-  "otherOperatingRegionsSecondaryValue1": "E71",
-  "otherOperatingRegionsSecondaryValue2": "E72",
-  "otherOperatingRegionsSecondaryValue3": "E73",
-  "otherRegionsName1": "D59",
-  "otherRegionsName2": "D60",
-  "otherRegionsName3": "D61",
-  "otherRegionsValue1": "E59",
-  "otherRegionsValue2": "E60",
-  "otherRegionsValue3": "E61",
-  "pipelineStream1": "E82",
-  "pipelineStream2": "E83",
-  "pipelineStream3": "E84",
-  "pipelineStream4": "E85",
-  "pipelineStreamsGrossMargin_0_0": "L171",
-  "pipelineStreamsGrossMargin_0_1": "M171",
-  "pipelineStreamsGrossMargin_0_2": "N171",
-  "pipelineStreamsGrossMargin_0_3": "O171",
-  "pipelineStreamsGrossMargin_0_4": "P171",
-  "pipelineStreamsGrossMargin_0_5": "Q171",
-  "pipelineStreamsGrossMargin_1_0": "L172",
-  "pipelineStreamsGrossMargin_1_1": "M172",
-  "pipelineStreamsGrossMargin_1_2": "N172",
-  "pipelineStreamsGrossMargin_1_3": "O172",
-  "pipelineStreamsGrossMargin_1_4": "P172",
-  "pipelineStreamsGrossMargin_1_5": "Q172",
-  "pipelineStreamsGrossMargin_2_0": "L173",
-  "pipelineStreamsGrossMargin_2_1": "M173",
-  "pipelineStreamsGrossMargin_2_2": "N173",
-  "pipelineStreamsGrossMargin_2_3": "O173",
-  "pipelineStreamsGrossMargin_2_4": "P173",
-  "pipelineStreamsGrossMargin_2_5": "Q173",
-  "pipelineStreamsGrossMargin_3_0": "L174",
-  "pipelineStreamsGrossMargin_3_1": "M174",
-  "pipelineStreamsGrossMargin_3_2": "N174",
-  "pipelineStreamsGrossMargin_3_3": "O174",
-  "pipelineStreamsGrossMargin_3_4": "P174",
-  "pipelineStreamsGrossMargin_3_5": "Q174",
-  "potentialStream1": "E87",
-  "potentialStream1Probability": "E93",
-  "potentialStream2": "E88",
-  "potentialStream2Probability": "E94",
-  "potentialStream3": "E89",
-  "potentialStream3Probability": "E95",
-  "potentialStream4": "E90",
-  "potentialStream4Probability": "E96",
-  "presentationCurrency": "E44",
-  "primaryBusiness": "E54",
-  "premise": "E22",
-  "draftNote": "E23",
-  "projectTitle": "E26",
-  "primaryBusinessDescription": "E55",
-  "primaryRegions": "E56",
-  "purpose": "E21",
-  "secondaryRegions": "E67",
-  "secondaryBusiness": "E65",
-  "secondaryBusinessDescription": "E66",
-  "shortName": "E25",
-  "valuationDate": "E29",
-  "nextFiscalYearEndDate": "E30",
-  "subindustryPrimaryBusiness": "E53",
-  "subindustrySecondaryBusiness": "E64",
-  "subjectCompanyName": "E24",
-  "units": "E45",
-  "valuerName": "E20",
-  "valuerType": "E18",
-  "ytd": "E33",
-  "ytgApproach": "E36"
 
-    }
-}
-json_to_excel_mapping_currency = {
-    "Hist.Fin": {
-        "valuationDate": "D7",
-        "informationCurrency": "D8",
-        "units": "D9"
-    }
+# Parse the templates once per worker, requests get isolated copies from the cache
+TEMPLATE_CACHE_MAX_COPIES = int(os.getenv("TEMPLATE_CACHE_MAX_COPIES", "2"))
+
+
+def build_template_cache():
+    from template_cache import TemplateCache
+
+    cache = TemplateCache(max_copies=TEMPLATE_CACHE_MAX_COPIES)
+    cache.register(TEMPLATE_PATH, keep_vba=True, data_only=True)
+    cache.register(TEMPLATE_PATH_HIST, keep_vba=True, data_only=True)
+    # Patch mode writes from formula-free copies, build them now rather than on the first request
+    if GENERATION_MODE == "patch":
+        cache.formula_free(TEMPLATE_PATH)
+        cache.formula_free(TEMPLATE_PATH_HIST)
+    return cache
+
+
+template_cache = LazyResource("templates", build_template_cache)
+
+# Produced workbooks and PDFs, keyed on the template hash and the mapped answers
+output_cache = OutputCache(
+    os.getenv("OUTPUT_CACHE_DIR", os.path.join(OUTPUT_DIR, "cache")),
+    max_bytes=int(os.getenv("OUTPUT_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    max_age=int(os.getenv("OUTPUT_CACHE_MAX_AGE", "86400")),
+)
+
+# Buffers handed between pipeline stages stay in memory up to this size, then spill to an unnamed temp file
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_MB", "16")) * 1024 * 1024
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Background workers for the asynchronous job API, job state is shared by the workers through JOB_DIR
+job_queue = JobQueue(
+    os.getenv("JOB_DIR", os.path.join(OUTPUT_DIR, "jobs")),
+    max_workers=int(os.getenv("JOB_WORKERS", "2")),
+    max_queued=int(os.getenv("JOB_QUEUE_MAX_DEPTH", "20")),
+    result_ttl=int(os.getenv("JOB_RESULT_TTL", "3600")),
+)
+
+# "openpyxl" round-trips the workbook, "patch" rewrites only the mapped sheet inside the zip
+GENERATION_MODES = ("openpyxl", "patch")
+GENERATION_MODE = os.getenv("GENERATION_MODE", "openpyxl")
+
+
+# Firestore answers fields -> template cells. A range takes a nested list of rows or the
+# flattened "<field>_<row>_<column>" keys the questionnaire stores
+TEMPLATE_MAPPINGS = {
+    "main": {
+        "path": TEMPLATE_PATH,
+        "sheet": "Inputs",
+        "fields": {
+            "CashasatValuationDate": "E257",
+            "CurrentAssets": "L232:Q235",
+            "Cyclicality": "E279",
+            "PenetrationRisk": "E275",
+            "VendorRisk": "E276",
+            "avgAnnualRevenue": "E49",
+            "clientName": "E19",
+            "currentLiabilities": "L237:Q241",
+            "developmentPhase": "E50",
+            "existingStream1": "E77",
+            "existingStream2": "E78",
+            "existingStream3": "E79",
+            "existingStream4": "E80",
+            "existingStreamsGrossMargin": "L167:Q170",
+            "industryPrimaryBusiness": "E52",
+            "industrySecondaryBusiness": "E63",
+            "informationCurrency": "E43",
+            "otherOperatingRegionsSecondaryName1": "D71",
+            "otherOperatingRegionsSecondaryName2": "D72",
+            "otherOperatingRegionsSecondaryName3": "D73",
+            "otherOperatingRegionsSecondaryValue1": "E71",
+            "otherOperatingRegionsSecondaryValue2": "E72",
+            "otherOperatingRegionsSecondaryValue3": "E73",
+            "otherRegionsName1": "D59",
+            "otherRegionsName2": "D60",
+            "otherRegionsName3": "D61",
+            "otherRegionsValue1": "E59",
+            "otherRegionsValue2": "E60",
+            "otherRegionsValue3": "E61",
+            "pipelineStream1": "E82",
+            "pipelineStream2": "E83",
+            "pipelineStream3": "E84",
+            "pipelineStream4": "E85",
+            "pipelineStreamsGrossMargin": "L171:Q174",
+            "potentialStream1": "E87",
+            "potentialStream1Probability": "E93",
+            "potentialStream2": "E88",
+            "potentialStream2Probability": "E94",
+            "potentialStream3": "E89",
+            "potentialStream3Probability": "E95",
+            "potentialStream4": "E90",
+            "potentialStream4Probability": "E96",
+            "presentationCurrency": "E44",
+            "primaryBusiness": "E54",
+            "premise": "E22",
+            "draftNote": "E23",
+            "projectTitle": "E26",
+            "primaryBusinessDescription": "E55",
+            "primaryRegions": "E56",
+            "purpose": "E21",
+            "secondaryRegions": "E67",
+            "secondaryBusiness": "E65",
+            "secondaryBusinessDescription": "E66",
+            "shortName": "E25",
+            "valuationDate": "E29",
+            "nextFiscalYearEndDate": "E30",
+            "subindustryPrimaryBusiness": "E53",
+            "subindustrySecondaryBusiness": "E64",
+            "subjectCompanyName": "E24",
+            "units": "E45",
+            "valuerName": "E20",
+            "valuerType": "E18",
+            "ytd": "E33",
+            "ytgApproach": "E36",
+        },
+        # Answered directly instead of the title the template composes from the company name
+        "overrides": ["projectTitle"],
+    },
+    "hist": {
+        "path": TEMPLATE_PATH_HIST,
+        "sheet": "Hist.Fin",
+        "fields": {
+            "valuationDate": "D7",
+            "informationCurrency": "D8",
+            "units": "D9",
+        },
+    },
 }
 
+def build_template_registry():
+    """Compiles every mapping to numeric coordinates and checks it against its template"""
+    from template_registry import TemplateRegistry
+
+    registry = TemplateRegistry(template_cache.load())
+    for template_name, template_mapping in TEMPLATE_MAPPINGS.items():
+        registry.register(
+            template_name, template_mapping["path"], template_mapping["sheet"], template_mapping["fields"],
+            template_mapping.get("overrides", ()),
+        )
+    return registry
+
+
+def build_project_store():
+    """Project answers read with a field mask, hot projects cached until they expire or are invalidated"""
+    from project_store import ProjectStore
+
+    return ProjectStore(
+        db.load(),
+        [field for name in template_registry.names() for field in template_registry.get(name).answer_fields],
+        max_entries=int(os.getenv("PROJECT_CACHE_MAX_ENTRIES", "100")),
+        max_age=int(os.getenv("PROJECT_CACHE_MAX_AGE", "60")),
+        async_db=async_db,
+        invalidation_dir=os.getenv("PROJECT_INVALIDATION_DIR", os.path.join(OUTPUT_DIR, "projects")),
+    )
+
+
+def build_valuation_engine():
+    """Compiles the valuation model's formula graph once per worker"""
+    from valuation_engine import ValuationEngine
+
+    engine = ValuationEngine(
+        TEMPLATE_PATH,
+        [f"Inputs!{cell_location}" for cell_location in template_registry.get("main").refs.values()],
+    )
+    engine.compile()
+    return engine
+
+
+template_registry = LazyResource("template registry", build_template_registry)
+project_store = LazyResource("project store", build_project_store)
+valuation_engine = LazyResource("valuation engine", build_valuation_engine)
+
+# "convertapi" sends a values-only workbook sliced to the report sheets to ConvertAPI,
+# "local" (opt-in) draws the Report sheet in-process
+PDF_RENDERERS = ("convertapi", "local")
+PDF_RENDERER = os.getenv("PDF_RENDERER", "convertapi")
+
+def build_report_layout():
+    """Report sheet geometry, styles, pictures and charts, extracted once per worker"""
+    from report_renderer import ReportLayout
+
+    return ReportLayout(valuation_engine.workbook, source=TEMPLATE_PATH)
+
+
+def build_sensitivity_model():
+    """DCF of the template as array math for the sensitivity grid"""
+    from sensitivity import SensitivityModel
+
+    return SensitivityModel(valuation_engine.workbook)
+
+
+report_layout = LazyResource("report layout", build_report_layout)
+sensitivity_model = LazyResource("sensitivity model", build_sensitivity_model)
+SENSITIVITY_MAX_POINTS = int(os.getenv("SENSITIVITY_MAX_POINTS", "100000"))
+
+# Batch processes, each holds its own copy of the parsed templates: about 70 MB idle and up to 140 MB
+# while filling a workbook in openpyxl mode, on top of every gunicorn worker. Raise it only with the memory to match
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_MAX_PROJECTS = int(os.getenv("BATCH_MAX_PROJECTS", "100"))
+
+# Threads building the outputs of /generate-bundle side by side, started on first submit
+BUNDLE_THREADS = int(os.getenv("BUNDLE_THREADS", "3"))
+bundle_executor = ThreadPoolExecutor(BUNDLE_THREADS, thread_name_prefix="bundle")
+
+# Process pool for batch generation, started on first use
+batch_pool = None
+batch_pool_lock = threading.Lock()
+
+
+# Function returning a scratch buffer for one pipeline stage
+def spooled_buffer():
+    """In-memory buffer that spills to an anonymous temp file past SPOOL_MAX_BYTES, deleted on close"""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+
+# Function reading the delivery of a generated file, ?delivery= overrides ARTIFACT_DELIVERY
+def requested_delivery() -> str:
+    delivery = request.args.get("delivery", ARTIFACT_DELIVERY)
+    if delivery not in ARTIFACT_DELIVERIES:
+        raise ValueError(f"Unknown delivery '{delivery}', expected one of {', '.join(ARTIFACT_DELIVERIES)}")
+    return delivery
+
+
+# Function sending a generated file, or a signed Storage URL for it
+def send_artifact(path: str, delivery: str = "stream", filename: str = None):
+    """Streams `path` through the worker, or uploads it once per content and hands out a signed URL"""
+    if delivery == "stream":
+        return send_file(path, as_attachment=True, download_name=filename)
+
+    artifact = artifact_store.publish(path, filename)
+    if delivery == "redirect":
+        return redirect(artifact["url"], code=303)
+    return jsonify(artifact), 200
+
 
 # Route to remove formulas from an Excel file
 @app.route('/remove-formulas', methods=['POST'])
@@ -252,25 +422,19 @@ def remove_formulas_route():
         return jsonify({"error": "No file uploaded"}), 400
 
     excel_file = request.files['file']
+    output_filename = f"processed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_input:
-        excel_file.save(temp_input.name)
-        
-        # Define output file paths
-        temp_output = temp_input.name.replace(".xlsx", "_no_formulas.xlsx")
-        
-        # Ensure output directory exists
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        output_filename = f"processed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-        # Remove formulas and save the processed file
-        remove_formulas_from_excel(temp_input.name, temp_output)
-
-        # Move the file to the output directory
-        os.rename(temp_output, output_path)
+    # Remove formulas straight from the uploaded stream, werkzeug spools large uploads to disk
+    output = spooled_buffer()
+    try:
+        remove_formulas_from_excel(excel_file.stream, output)
+    except zipfile.BadZipFile:
+        output.close()
+        return jsonify({"error": "Uploaded file is not a valid Excel workbook"}), 400
 
-        return send_file(output_path, as_attachment=True)
+    # Stream the buffer back, it is closed (and any spilled temp file removed) once sent
+    output.seek(0)
+    return send_file(output, as_attachment=True, download_name=output_filename, mimetype=XLSX_MIMETYPE)
 
 
 # Route to generate an Excel file with Firestore data
@@ -284,10 +448,22 @@ def generate_excel():
         if not uid or not project_id:
             return jsonify({"error": "uid and project_id are required"}), 400
 
+        mode = request.args.get("mode", GENERATION_MODE)
+        if mode not in GENERATION_MODES:
+            return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+        template = request.args.get("template", "main")
+        if template not in template_registry:
+            return jsonify({"error": f"Unknown template '{template}'"}), 400
+
+        try:
+            delivery = requested_delivery()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Call the function that generates Excel
-        output_path = generate_excel_file(uid, project_id)
+        output_path = generate_excel_file(uid, project_id, mode, template)
 
-        return send_file(output_path, as_attachment=True)
+        return send_artifact(output_path, delivery)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -302,10 +478,19 @@ def generate_excel_hist():
         if not uid or not project_id:
             return jsonify({"error": "uid and project_id are required"}), 400
 
+        mode = request.args.get("mode", GENERATION_MODE)
+        if mode not in GENERATION_MODES:
+            return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+
+        try:
+            delivery = requested_delivery()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Call the function that generates Excel
-        output_path = generate_excel_file_hist(uid, project_id)
+        output_path = generate_excel_file(uid, project_id, mode, "hist")
 
-        return send_file(output_path, as_attachment=True)
+        return send_artifact(output_path, delivery)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -322,177 +507,592 @@ def convert_to_pdf_route():
     if not uid or not project_id:
         return jsonify({"error": "Missing uid or project_id"}), 400
 
+    renderer = request.args.get("renderer", PDF_RENDERER)
+    if renderer not in PDF_RENDERERS:
+        return jsonify({"error": f"Unknown renderer '{renderer}'"}), 400
+
+    try:
+        delivery = requested_delivery()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        data = fetch_answers(uid, project_id)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
     try:
-        # Generate the Excel file (without sending it as a response)
-        excel_file_path = generate_excel_file(uid, project_id)
-        if not os.path.exists(excel_file_path):
-            return jsonify({"error": "Failed to generate Excel file"}), 500
+        # Return the final PDF file
+        return send_artifact(generate_report_pdf(data, renderer), delivery)
 
-        # Define PDF output path
-        pdf_output_path = excel_file_path.replace(".xlsx", ".pdf")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Convert Excel to PDF
-        conversion_success = convert_excel_to_pdf(excel_file_path, pdf_output_path)
-        if not conversion_success:
-            return jsonify({"error": "Failed to convert Excel to PDF"}), 500
 
-        # Extract pages from 104 onward (optional step)
-        extracted_pdf_output = pdf_output_path.replace(".pdf", "_report.pdf")
-        extraction_success = extract_pages_from_pdf(pdf_output_path, extracted_pdf_output, start_page=104)
 
-        if not extraction_success:
-            return jsonify({"error": "Failed to extract report pages from PDF"}), 500
+# Route to generate workbooks for many projects in one call
+@app.route('/generate-excel-batch', methods=['POST'])
+def generate_excel_batch_route():
+    """POST route streaming back a zip of generated workbooks for a list of (uid, project_id) pairs"""
+    body = request.get_json(silent=True) or {}
+    projects = body.get("projects")
 
-        # Store in output directory
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        final_pdf_path = os.path.join(OUTPUT_DIR, os.path.basename(extracted_pdf_output))
-        shutil.move(extracted_pdf_output, final_pdf_path)
+    if not isinstance(projects, list) or not projects:
+        return jsonify({"error": "projects must be a non-empty list of {uid, project_id}"}), 400
 
-        # Return the final PDF file
-        return send_file(final_pdf_path, as_attachment=True)
+    if len(projects) > BATCH_MAX_PROJECTS:
+        return jsonify({"error": f"At most {BATCH_MAX_PROJECTS} projects per batch"}), 400
 
+    pairs = []
+    for project in projects:
+        uid, project_id = (project.get("uid"), project.get("project_id")) if isinstance(project, dict) else (None, None)
+        if not uid or not project_id:
+            return jsonify({"error": "Every project needs uid and project_id"}), 400
+        pairs.append((uid, project_id))
+
+    template = body.get("template", "main")
+    if template not in template_registry:
+        return jsonify({"error": f"Unknown template '{template}'"}), 400
+
+    mode = body.get("mode", GENERATION_MODE)
+    if mode not in GENERATION_MODES:
+        return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+
+    try:
+        answers = fetch_answers_many(pairs)
+    except Exception as e:
+        return jsonify({"error": f"Error fetching projects: {str(e)}"}), 500
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Response(
+        stream_with_context(generate_excel_batch(answers, template, mode)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=batch_{timestamp}.zip"},
+    )
+
+
+# Route to generate every output of a project in one call
+@app.route('/generate-bundle', methods=['GET'])
+def generate_bundle_route():
+    """GET route streaming back a zip with the main workbook, the Hist.Fin workbook and the report PDF"""
+    uid = request.args.get("uid")
+    project_id = request.args.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    mode = request.args.get("mode", GENERATION_MODE)
+    if mode not in GENERATION_MODES:
+        return jsonify({"error": f"Unknown generation mode '{mode}'"}), 400
+
+    renderer = request.args.get("renderer", PDF_RENDERER)
+    if renderer not in PDF_RENDERERS:
+        return jsonify({"error": f"Unknown renderer '{renderer}'"}), 400
+
+    # One read of the answers feeds every output
+    try:
+        data = fetch_answers(uid, project_id)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Response(
+        stream_with_context(generate_bundle(project_id, data, mode, renderer)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={project_id}_{timestamp}.zip"},
+    )
 
 
-# Function to generate excel file
-def generate_excel_file(uid: str, project_id: str) -> str:
-    """Generates an Excel file with Firestore data and returns the file path"""
+# Route to submit a background PDF generation job
+@app.route('/jobs/convert-to-pdf', methods=['POST'])
+def submit_convert_to_pdf_job():
+    """POST route queuing report PDF generation, returns the job id to poll"""
+    params = request.get_json(silent=True) or request.args
+    uid = params.get("uid")
+    project_id = params.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    renderer = params.get("renderer", PDF_RENDERER)
+    if renderer not in PDF_RENDERERS:
+        return jsonify({"error": f"Unknown renderer '{renderer}'"}), 400
+
+    stages = ("fetch", "render") if renderer == "local" else ("fetch", "generate", "convert")
     try:
-        if not uid or not project_id:
-            raise ValueError("uid and project_id are required")
+        job_id = job_queue.submit("convert-to-pdf", report_pdf_job, uid, project_id, renderer, stages=stages)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "10"}
+
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+    }), 202
 
-        # Fetch Firestore data
-        doc_ref = db.collection("users").document(uid).collection("projects").document(project_id)
-        doc = doc_ref.get()
 
-        if not doc.exists:
-            raise FileNotFoundError("Document not found")
+# Route to poll a background job
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """GET route returning the job status and stage progress"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
 
-        res = doc.to_dict()
-        data = res.get("answers", {})
+    job.pop("result")
+    return jsonify(job), 200
 
-        # Load Excel template
-        workbook = load_workbook(TEMPLATE_PATH, keep_vba=True, data_only=True)
 
-        if "Inputs" not in workbook.sheetnames:
-            raise Exception("Excel template is missing 'Inputs' sheet")
+# Route to download the result of a finished job
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """GET route sending the produced file once the job is done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
 
-        worksheet = workbook["Inputs"]
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), 500
 
-        for field, cell_location in json_to_excel_mapping["Inputs"].items():
-            value = data.get(field, None)
-            if value is not None:
-                worksheet[cell_location].value = value
+    if job["status"] != "done":
+        return jsonify({"status": job["status"], "stage": job["stage"]}), 409
 
-        # Ensure output directory exists
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if not os.path.exists(job["result"]):
+        return jsonify({"error": "Job result is no longer available"}), 410
 
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"final_invoice_{timestamp}.xlsx"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
+    try:
+        delivery = requested_delivery()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Save and close the workbook
-        workbook.save(output_path)
-        workbook.close()
+    try:
+        return send_artifact(job["result"], delivery)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Ensure file exists before returning the path
-        if not os.path.exists(output_path):
-            raise Exception("Failed to generate Excel file")
 
-        return output_path  # Return the file path
+# Route to drop a project's cached answers after they were written
+@app.route('/projects/invalidate', methods=['POST'])
+def invalidate_project():
+    """POST route the writer of a project's answers calls, every worker refetches them on next use"""
+    params = request.get_json(silent=True) or request.args
+    uid = params.get("uid")
+    project_id = params.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
 
+    try:
+        project_store.invalidate(uid, project_id)
     except Exception as e:
-        raise RuntimeError(f"Error generating Excel: {str(e)}")
-    
-# Function to generate excel file for historical template
-def generate_excel_file_hist(uid: str, project_id: str) -> str:
-    """Generates an Excel file with Firestore data and returns the file path"""
+        return jsonify({"error": str(e)}), 500
+    return "", 204
+
+
+# Route to evaluate the valuation model in-process and return the computed values
+@app.route('/evaluate-valuation', methods=['GET'])
+def evaluate_valuation_route():
+    """GET route returning the valuation outputs computed from the project's answers"""
+    uid = request.args.get("uid")
+    project_id = request.args.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    # Optional extra cells, e.g. cells=DCF!L31,WACC!D25
+    cells = [cell for cell in request.args.get("cells", "").split(",") if cell]
+
+    try:
+        return jsonify(evaluate_valuation(uid, project_id, cells)), 200
+
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Route to evaluate the valuation over a grid of discount rates, terminal growth rates and margins
+@app.route('/sensitivity', methods=['GET', 'POST'])
+def sensitivity_route():
+    """
+    Returns enterprise and equity value matrices for every combination of the given axes.
+    Axes are lists, "a,b,c" or "start:stop:step"; margin_change shifts the EBIT margin of
+    every forecast year, e.g. discount_rate=0.10:0.16:0.01&terminal_growth=0.01,0.02,0.03
+    """
+    from sensitivity import parse_axis
+
+    params = request.get_json(silent=True) or request.args
+    uid = params.get("uid")
+    project_id = params.get("project_id")
+
+    if not uid or not project_id:
+        return jsonify({"error": "Missing uid or project_id"}), 400
+
+    try:
+        discount_rates = parse_axis(params.get("discount_rate"))
+        growth_rates = parse_axis(params.get("terminal_growth"))
+        margin_changes = parse_axis(params.get("margin_change"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    points = 1
+    for axis in (discount_rates, growth_rates, margin_changes):
+        points *= len(axis) if axis else 5
+    if points > SENSITIVITY_MAX_POINTS:
+        return jsonify({"error": f"The grid has {points} points, at most {SENSITIVITY_MAX_POINTS} are allowed"}), 400
+
+    try:
+        return jsonify(evaluate_sensitivity(uid, project_id, discount_rates, growth_rates, margin_changes)), 200
+
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+
+# Function to fetch the answers of a project from Firestore
+def fetch_answers(uid: str, project_id: str) -> dict:
+    """Returns the mapped `answers` of the project document"""
+    with metrics.stage("fetch"):
+        return project_store.get_answers(uid, project_id)
+
+
+# Function to fetch the answers of many projects in one round trip
+def fetch_answers_many(pairs: list) -> dict:
+    """Returns {(uid, project_id): answers}, None for projects that do not exist"""
+    with metrics.stage("fetch"):
+        return project_store.get_answers_many(pairs)
+
+
+# Function returning the batch process pool
+def get_batch_pool() -> ProcessPoolExecutor:
+    """Starts the pool on first use, workers adopt the already parsed templates instead of reparsing"""
+    from workbook_generation import init_worker
+
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is None:
+            batch_pool = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS,
+                # Spawned, not forked, since this process runs request threads
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(template_cache.export(),),
+            )
+        return batch_pool
+
+
+# Function producing the zip archive of a batch
+def generate_excel_batch(answers: dict, template: str, mode: str):
+    """Yields a zip archive of the generated workbooks, adding each one as soon as it is ready"""
+    from workbook_generation import generate_in_worker, ArchiveStream
+
+    compiled = template_registry.get(template)
+    template_hash = template_cache.template_hash(compiled.path)
+
+    stream = ArchiveStream()
+    # Workbooks are already deflated inside, storing them avoids compressing twice
+    archive = zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED)
+    manifest = []
+    futures = {}
+
+    try:
+        for (uid, project_id), data in answers.items():
+            entry_name = f"{uid}/{project_id}.xlsx"
+            if data is None:
+                manifest.append({"uid": uid, "project_id": project_id, "error": "Document not found"})
+                continue
+
+            cache_key = output_cache.key("xlsx", template_hash, mode, compiled.flat_values(data))
+            cached_path = output_cache.get(cache_key)
+            if cached_path is not None:
+                archive.write(cached_path, entry_name)
+                manifest.append({"uid": uid, "project_id": project_id, "file": entry_name, "cached": True})
+                yield stream.drain()
+                continue
+
+            future = get_batch_pool().submit(generate_in_worker, compiled, data, mode)
+            futures[future] = (uid, project_id, entry_name, cache_key)
+
+        for future in as_completed(futures):
+            uid, project_id, entry_name, cache_key = futures[future]
+            try:
+                workbook_bytes = future.result()
+                archive.writestr(entry_name, workbook_bytes)
+                output_cache.put(cache_key, io.BytesIO(workbook_bytes), f"{project_id}.xlsx")
+                manifest.append({"uid": uid, "project_id": project_id, "file": entry_name, "cached": False})
+            except Exception as e:
+                manifest.append({"uid": uid, "project_id": project_id, "error": f"Error generating Excel: {str(e)}"})
+            yield stream.drain()
+
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        archive.close()
+        yield stream.drain()
+
+    finally:
+        # Client went away, do not generate what nobody will receive
+        for future in futures:
+            future.cancel()
+
+
+# Function listing the outputs of a project bundle
+def bundle_outputs(project_id: str, data: dict, mode: str, renderer: str) -> dict:
+    """Returns {archive entry name: (function, *args)}, each function returns the output's path"""
+    return {
+        f"{project_id}.xlsx": (build_excel_file, data, mode, "main"),
+        f"{project_id}_hist.xlsx": (build_excel_file, data, mode, "hist"),
+        f"{project_id}_report.pdf": (generate_report_pdf, data, renderer),
+    }
+
+
+# Function producing the zip archive of a project bundle
+def generate_bundle(project_id: str, data: dict, mode: str, renderer: str):
+    """Yields a zip archive of the project's outputs, built in parallel and added as each one is ready"""
+    from workbook_generation import ArchiveStream
+
+    stream = ArchiveStream()
+    # Workbooks and PDFs are already compressed, storing them avoids compressing twice
+    archive = zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED)
+    manifest = []
+    futures = {
+        bundle_executor.submit(*task): entry_name
+        for entry_name, task in bundle_outputs(project_id, data, mode, renderer).items()
+    }
+
+    try:
+        for future in as_completed(futures):
+            entry_name = futures[future]
+            try:
+                archive.write(future.result(), entry_name)
+                manifest.append({"file": entry_name})
+            except Exception as e:
+                # The other outputs are still worth sending
+                manifest.append({"file": entry_name, "error": str(e)})
+            yield stream.drain()
+
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        archive.close()
+        yield stream.drain()
+
+    finally:
+        # Client went away, do not generate what nobody will receive
+        for future in futures:
+            future.cancel()
+
+
+# Function to generate excel file
+def generate_excel_file(uid: str, project_id: str, mode: str = GENERATION_MODE, template: str = "main") -> str:
+    """Generates an Excel file from the registered `template` with Firestore data and returns the file path"""
     try:
         if not uid or not project_id:
             raise ValueError("uid and project_id are required")
 
+        if mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown generation mode '{mode}'")
+
         # Fetch Firestore data
-        doc_ref = db.collection("users").document(uid).collection("projects").document(project_id)
-        doc = doc_ref.get()
+        data = fetch_answers(uid, project_id)
+        return build_excel_file(data, mode, template)
+
+    except Exception as e:
+        raise RuntimeError(f"Error generating Excel: {str(e)}")
 
-        if not doc.exists:
-            raise FileNotFoundError("Document not found")
 
-        res = doc.to_dict()
-        data = res.get("answers", {})
+# Function to build the workbook for a project's answers
+def build_excel_file(data: dict, mode: str = GENERATION_MODE, template: str = "main") -> str:
+    """Fills the registered `template` with `data` and returns the file path, reusing the cached workbook"""
+    from workbook_generation import fill_template
 
-        # Load Excel template
-        workbook = load_workbook(TEMPLATE_PATH_HIST, keep_vba=True, data_only=True)
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"Unknown generation mode '{mode}'")
 
-        if "Hist.Fin" not in workbook.sheetnames:
-            raise Exception("Excel template is missing 'Inputs' sheet")
+    compiled = template_registry.get(template)
 
-        worksheet = workbook["Hist.Fin"]
+    # Serve the workbook produced earlier for the same template and answers
+    cache_key = output_cache.key(
+        "xlsx", template_cache.template_hash(compiled.path), mode, compiled.flat_values(data),
+    )
+    cached_path = output_cache.get(cache_key)
+    if cached_path is not None:
+        return cached_path
 
-        for field, cell_location in json_to_excel_mapping_currency["Hist.Fin"].items():
-            value = data.get(field, None)
-            if value is not None:
-                worksheet[cell_location].value = value
+    # Build the workbook in a scratch buffer, the cache entry is its only copy on disk
+    output_filename = f"final_invoice_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    with spooled_buffer() as output:
+        fill_template(template_cache, compiled, data, output, mode)
+        return output_cache.put(cache_key, output, output_filename)  # Return the file path
 
-        # Ensure output directory exists
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"final_invoice_{timestamp}.xlsx"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
 
-        # Save and close the workbook
-        workbook.save(output_path)
-        workbook.close()
+# Function to evaluate the valuation model for a project
+def evaluate_valuation(uid: str, project_id: str, cells: list = ()) -> dict:
+    """Recalculates the valuation outputs for the project's answers, a missing project raises FileNotFoundError"""
+    if not uid or not project_id:
+        raise ValueError("uid and project_id are required")
 
-        # Ensure file exists before returning the path
-        if not os.path.exists(output_path):
-            raise Exception("Failed to generate Excel file")
+    data = fetch_answers(uid, project_id)
 
-        return output_path  # Return the file path
+    try:
+        return valuation_engine.evaluate(valuation_inputs(data), cells)
 
     except Exception as e:
-        raise RuntimeError(f"Error generating Excel: {str(e)}")
+        raise RuntimeError(f"Error evaluating valuation: {str(e)}")
 
 
+# Function to evaluate the sensitivity grid for a project
+def evaluate_sensitivity(uid: str, project_id: str, discount_rates: list = None, growth_rates: list = None,
+                         margin_changes: list = None) -> dict:
+    """Evaluates the DCF once through the engine, then the whole grid in one vectorized pass"""
+    from sensitivity import around, to_json_matrix
+
+    data = fetch_answers(uid, project_id)
 
-# Function to convert an Excel file to PDF using ConvertAPI
-def convert_excel_to_pdf(excel_file_path: str, output_pdf_path: str):
-    """Converts an Excel file to a PDF using an external API"""
     try:
-        headers = {"Authorization": f"Bearer {CONVERT_API_KEY}"}
+        values = valuation_engine.values(valuation_inputs(data), sensitivity_model.addresses)
+        base = sensitivity_model.base(values)
+
+        # Missing axes default to the template's sensitivity steps around the project's own rates
+        discount_rates = discount_rates or around(base["discount_rate"])
+        growth_rates = growth_rates or around(base["terminal_growth"])
+        margin_changes = margin_changes or [0.0]
+
+        grid = sensitivity_model.grid(base, discount_rates, growth_rates, margin_changes)
+        return {
+            "base": {
+                "discount_rate": base["discount_rate"],
+                "terminal_growth": base["terminal_growth"],
+                "enterprise_value": base["enterprise_value"],
+            },
+            "discount_rates": [float(rate) for rate in discount_rates],
+            "terminal_growth_rates": [float(rate) for rate in growth_rates],
+            "margin_changes": [float(change) for change in margin_changes],
+            # Indexed [margin change][terminal growth][discount rate]
+            "enterprise_value": to_json_matrix(grid["enterprise_value"]),
+            "equity_value": to_json_matrix(grid["equity_value"]),
+        }
+
+    except Exception as e:
+        raise RuntimeError(f"Error evaluating sensitivity: {str(e)}")
+
+
+# Function to map the project's answers onto the valuation engine inputs
+def valuation_inputs(data: dict) -> dict:
+    """Returns {"Inputs!E19": value} for every mapped cell"""
+    return {
+        f"Inputs!{cell_location}": value
+        for cell_location, value in template_registry.get("main").cell_values(data).items()
+    }
+
+
+# Background job producing the report PDF for a project
+def report_pdf_job(uid: str, project_id: str, renderer: str, progress) -> str:
+    """Runs fetch and generation in a job worker, reporting each stage through `progress`"""
+    progress("fetch")
+    data = fetch_answers(uid, project_id)
+    return generate_report_pdf(data, renderer, progress)
+
+
+# Function to produce the report PDF for a project's answers
+def generate_report_pdf(data: dict, renderer: str, progress=None) -> str:
+    """Returns the report PDF path, reusing the cached PDF when the template and answers are unchanged"""
+    def stage(name: str):
+        if progress is not None:
+            progress(name)
 
-        # Open and read the Excel file
-        with open(excel_file_path, "rb") as file:
-            files = {"File": (os.path.basename(excel_file_path), file, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
-            data = {
-                "StoreFile": "false",
-                "WorksheetActive": "true",
-                "PageOrientation": "landscape",
-            }
-            response = requests.post(CONVERT_API_URL, headers=headers, files=files, data=data, timeout=120, stream=True)
+    report_filename = f"final_invoice_{datetime.now().strftime('%Y%m%d_%H%M%S')}_report.pdf"
 
-            response.raise_for_status()
-            response_data = response.json()
+    if renderer == "local":
+        cached_path = output_cache.get(report_cache_key(data, "local"))
+        if cached_path is not None:
+            return cached_path
 
-            if "Files" not in response_data or not response_data["Files"]:
-                raise Exception("No files returned in the response")
+        try:
+            stage("render")
+            with spooled_buffer() as pdf:
+                render_report_pdf(data, pdf)
+                return output_cache.put(report_cache_key(data, "local"), pdf, report_filename)
+        except Exception as e:
+            # Fall back to the ConvertAPI conversion below
+            print(f"Local report rendering failed, falling back to ConvertAPI: {str(e)}")
 
-            file_data_base64 = response_data["Files"][0]["FileData"]
-            file_data_bytes = base64.b64decode(file_data_base64)
+    cached_path = output_cache.get(report_cache_key(data, "convertapi"))
+    if cached_path is not None:
+        return cached_path
 
-            # Ensure output directory exists
-            os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
+    # Build a values-only workbook holding just the report pages
+    stage("generate")
+    with spooled_buffer() as workbook, spooled_buffer() as pdf:
+        generate_report_workbook(data, workbook)
 
-            with open(output_pdf_path, "wb") as pdf_file:
-                pdf_file.write(file_data_bytes)
+        # Convert Excel to PDF, the workbook only prints the report pages so no extraction is needed
+        stage("convert")
+        convert_excel_to_pdf(workbook, pdf, report_filename.replace(".pdf", ".xlsx"))
 
-            print(f"PDF successfully saved as '{output_pdf_path}'")
-            return output_pdf_path
+        return output_cache.put(report_cache_key(data, "convertapi"), pdf, report_filename)
+
+
+# Function returning the output cache key of a report PDF
+def report_cache_key(data: dict, renderer: str) -> str:
+    """Key on the renderer, the template hash and the mapped answers"""
+    return output_cache.key(
+        "pdf", renderer, template_cache.template_hash(TEMPLATE_PATH),
+        template_registry.get("main").flat_values(data),
+    )
+
+
+# Function to build the workbook sent to the remote PDF converter
+def generate_report_workbook(data: dict, output):
+    """Writes a values-only workbook with just the report sheets to `output` (path or binary file)"""
+    from report_renderer import slice_report_workbook, write_report_values
+
+    try:
+        values = valuation_engine.values(valuation_inputs(data), report_layout.value_cells)
+
+        # The sliced template is built once per template version, a request only writes its values
+        with template_cache.checkout(
+            TEMPLATE_PATH, "report", lambda workbook: slice_report_workbook(workbook, report_layout.load())
+        ) as workbook:
+            with metrics.stage("write_values"):
+                write_report_values(workbook, values)
+            with metrics.stage("save_workbook"):
+                workbook.save(output)
+
+        return output
+
+    except Exception as e:
+        raise RuntimeError(f"Error generating report workbook: {str(e)}")
+
+
+# Function to render the report PDF locally
+def render_report_pdf(data: dict, output):
+    """Renders the Report sheet with values from the valuation engine to `output` (path or binary file)"""
+    from report_renderer import render_report
+
+    try:
+        values = valuation_engine.values(valuation_inputs(data), report_layout.value_cells)
+        with metrics.stage("render_pdf"):
+            render_report(report_layout.load(), values, output)
+        return output
+
+    except Exception as e:
+        raise RuntimeError(f"Error rendering report: {str(e)}")
+
+
+# Function to convert an Excel file to PDF using ConvertAPI
+def convert_excel_to_pdf(excel_file, output_pdf, filename: str = "report.xlsx"):
+    """Converts an Excel file (path or binary file) to a PDF using an external API"""
+    import requests
+
+    try:
+        # Pooled sessions, retries and streaming decode live in the converter backend
+        return pdf_converter.convert(excel_file, output_pdf, filename)
 
     except requests.Timeout:
         raise RuntimeError("The request to ConvertAPI timed out. Try reducing the file size.")
@@ -505,58 +1105,78 @@ def convert_excel_to_pdf(excel_file_path: str, output_pdf_path: str):
 
         
 
-def extract_pages_from_pdf(input_pdf: str, output_pdf: str, start_page: int):
+def extract_pages_from_pdf(input_pdf, output_pdf, start_page: int = None, required: bool = True) -> bool:
     """
-    Extracts pages from `start_page` to the end from `input_pdf` and saves it as `output_pdf`.
+    Copies the report section of `input_pdf` to `output_pdf` (paths or binary files). The section
+    starts at the "Report" bookmark or named destination, or the first "Page N:" marker page,
+    unless `start_page` (1-based) is given.
     """
-    doc = fitz.open(input_pdf)
-    total_pages = len(doc)
+    from pdf_extract import extract_section
 
-    if start_page > total_pages:
-        print(f"Error: The PDF only has {total_pages} pages, cannot extract from page {start_page}")
+    try:
+        with metrics.stage("extract_pages"):
+            result = extract_section(input_pdf, output_pdf, start_page, required)
+    except Exception as e:
+        print(f"Error extracting report pages: {str(e)}")
         return False
 
-    new_doc = fitz.open()
-    for page_num in range(start_page - 1, total_pages):  # Convert to 0-based index
-        new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
-
-    # Save to a new file instead of overwriting
-    temp_output_pdf = output_pdf.replace(".pdf", "_temp.pdf")
-    new_doc.save(temp_output_pdf)
-    new_doc.close()
-    doc.close()
-
-    # Replace old file with new one
-    os.replace(temp_output_pdf, output_pdf)
-
-    if os.path.exists(output_pdf):
-        print(f"Extracted report pages saved as '{output_pdf}'")
-        return True
-    else:
-        print(f"Failed to save extracted report pages as '{output_pdf}'")
-        return False
+    print(f"Extracted {result['pages']} report pages from page {result['start_page']} (found by {result['found_by']})")
+    return True
 
 
 # Function to remove formulas from an Excel file
-def remove_formulas_from_excel(input_file: str, output_file: str):
-    wb = load_workbook(input_file, data_only=True)  # Load with computed values
-    new_wb = load_workbook(input_file)  # Load without data_only to retain structure
+def remove_formulas_from_excel(input_file, output_file):
+    """Replaces every formula with its cached value, streaming one sheet at a time"""
+    from xlsx_patch import strip_formulas
 
-    for sheet_name in wb.sheetnames:
-        source_sheet = wb[sheet_name]  # Sheet with computed values
-        target_sheet = new_wb[sheet_name]  # Sheet with formulas
+    with metrics.stage("strip_formulas"):
+        strip_formulas(input_file, output_file)
+    print("Formulas removed from uploaded workbook")
 
-        for row_idx, row in enumerate(source_sheet.iter_rows(), start=1):
-            for col_idx, cell in enumerate(row, start=1):
-                target_sheet.cell(row=row_idx, column=col_idx, value=cell.value)  # Copy value, removing formula
 
-    new_wb.save(output_file)
-    print(f"Processed file saved as: {output_file}")
+# Route exposing the worker's metrics to Prometheus
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
-   return jsonify({"status": "ok", "message": "Flask app is running"}), 200
+   return jsonify({
+       "status": "ok",
+       "message": "Flask app is running",
+       "output_cache": output_cache.stats(),
+       # Not built yet in lazy mode, reporting it must not build it
+       "projects": project_store.stats() if project_store.is_loaded else None,
+       "jobs": job_queue.stats(),
+       "artifacts": artifact_store.stats() if artifact_store.is_loaded else None,
+       "startup": {
+           "mode": STARTUP_MODE,
+           "seconds": round(STARTUP_SECONDS, 3),
+           "loaded": [resource.resource_name for resource in LAZY_RESOURCES if resource.is_loaded],
+       },
+       "memory": dict(memory_usage(), pid=os.getpid()),
+   }), 200
+
+
+# Worker state, in dependency order
+LAZY_RESOURCES = (
+    firebase_app, db, pdf_converter, artifact_store, template_cache, template_registry, project_store,
+    valuation_engine, report_layout, sensitivity_model,
+)
+
+if STARTUP_MODE == "eager":
+    for resource in LAZY_RESOURCES:
+        resource.load()
+elif STARTUP_MODE == "preload":
+    # Only the CPU-heavy state, gRPC and HTTP clients are not fork-safe and stay per worker
+    for resource in (template_cache, template_registry, valuation_engine, report_layout, sensitivity_model):
+        resource.load()
+    # Keep the garbage collector from writing to (and so copying) the shared objects in workers
+    gc.freeze()
+
+STARTUP_SECONDS = time.perf_counter() - STARTUP_STARTED
+print(f"Startup ({STARTUP_MODE}) finished in {STARTUP_SECONDS:.2f}s, memory {memory_usage()}")
 
 # Run the Flask app
 if __name__ == '__main__':
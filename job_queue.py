@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit"""
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Background jobs shared by every worker on the host
+class JobQueue:
+    """
+    Bounded pool of background workers with per-job status and stage progress. Jobs run in the
+    process that accepted them, their state is a JSON file per job in `directory`, so any worker
+    can answer a poll. The queue depth limit and queue positions count the jobs of all workers.
+    """
+
+    LOCK_NAME = ".lock"
+
+    def __init__(self, directory: str, max_workers: int = 2, max_queued: int = 20, result_ttl: float = 3600):
+        self.directory = directory
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        # job id -> state of the jobs this process runs, the file is written from it
+        self._owned = {}
+
+    @contextmanager
+    def _directory_lock(self):
+        """Exclusive flock across processes, the directory is created on first use"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, job: dict):
+        """Replaces the job file in one step, readers never see a partial write"""
+        staging = os.path.join(self.directory, f".{job['id']}.{uuid.uuid4().hex}")
+        with open(staging, "w") as file:
+            json.dump(job, file)
+        os.replace(staging, self._path(job["id"]))
+
+    def _read(self, job_id: str):
+        try:
+            with open(self._path(job_id)) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _jobs(self) -> list:
+        """Every job on disk"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        jobs = [self._read(name[:-5]) for name in names if name.endswith(".json") and not name.startswith(".")]
+        return [job for job in jobs if job is not None]
+
+    def _expire(self) -> list:
+        """
+        Forgets finished jobs older than the result TTL and fails the unfinished jobs of workers
+        that exited. Needs the directory lock, returns the remaining jobs
+        """
+        now = time.time()
+        remaining = []
+        for job in self._jobs():
+            if job["finished_at"] is None and job["pid"] != os.getpid() and not _process_alive(job["pid"]):
+                job.update(status="failed", error="The worker running the job exited", finished_at=now)
+                self._save(job)
+            if job["finished_at"] is not None and now - job["finished_at"] > self.result_ttl:
+                try:
+                    os.remove(self._path(job["id"]))
+                except FileNotFoundError:
+                    pass
+                continue
+            remaining.append(job)
+        return remaining
+
+    def submit(self, kind: str, function, *args, stages: tuple = ()) -> str:
+        """
+        Queues `function(*args, progress=...)` and returns the job id. `function` reports each
+        stage it enters through `progress(stage)` and returns the result file path.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "stage": None,
+            "stages": list(stages),
+            "completed_stages": [],
+            "error": None,
+            "result": None,
+            "pid": os.getpid(),
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+
+        with self._directory_lock():
+            queued = sum(1 for other in self._expire() if other["status"] == "queued")
+            if queued >= self.max_queued:
+                raise QueueFullError(f"Job queue is full ({queued} jobs waiting)")
+            with self._lock:
+                self._owned[job_id] = job
+                self._save(job)
+
+        self._executor.submit(self._run, job_id, function, args)
+        return job_id
+
+    def _progress(self, job_id: str, stage: str):
+        with self._lock:
+            job = self._owned[job_id]
+            if job["stage"] is not None:
+                job["completed_stages"].append(job["stage"])
+            # Jobs may take a path other than the one announced, e.g. a fallback
+            if stage not in job["stages"]:
+                job["stages"].append(stage)
+            job["stage"] = stage
+            self._save(job)
+
+    def _run(self, job_id: str, function, args: tuple):
+        with self._lock:
+            job = self._owned[job_id]
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            self._save(job)
+
+        try:
+            result = function(*args, progress=lambda stage: self._progress(job_id, stage))
+            update = {"status": "done", "result": result}
+        except Exception as e:
+            print(f"Job {job_id} failed: {str(e)}")
+            update = {"status": "failed", "error": str(e)}
+
+        with self._lock:
+            job.update(update)
+            if job["status"] == "done" and job["stage"] is not None:
+                job["completed_stages"].append(job["stage"])
+                job["stage"] = None
+            job["finished_at"] = time.time()
+            self._save(job)
+            del self._owned[job_id]
+
+    def get(self, job_id: str):
+        """Returns a snapshot of the job, or None if it is unknown or expired"""
+        with self._directory_lock():
+            jobs = {job["id"]: job for job in self._expire()}
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+
+        snapshot = dict(job)
+        snapshot.pop("pid")
+
+        # Position among the queued jobs of every worker, 0 once the job is running
+        snapshot["queue_position"] = sum(
+            1 for other in jobs.values()
+            if other["status"] == "queued" and other["submitted_at"] <= job["submitted_at"]
+        ) if job["status"] == "queued" else 0
+
+        if snapshot["status"] == "done":
+            snapshot["progress"] = 1.0
+        elif snapshot["stages"]:
+            snapshot["progress"] = round(len(snapshot["completed_stages"]) / len(snapshot["stages"]), 2)
+        return snapshot
+
+    def stats(self) -> dict:
+        """Job counts by status across every worker"""
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        with self._directory_lock():
+            for job in self._expire():
+                counts[job["status"]] += 1
+        return counts
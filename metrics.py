@@ -0,0 +1,188 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# Stage timings, request counters and payload sizes of this worker, exposed on /metrics in the
+# Prometheus text format. Each gunicorn worker keeps its own numbers.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """A metric family, one series per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in series]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self) -> list:
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self._series.items())
+
+        lines = []
+        for key, value in series:
+            for bound, count in zip(self.buckets, value["buckets"]):
+                bucket_labels = _labels(self.labelnames, key, 'le="%s"' % _number(bound))
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            bucket_labels = _labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {value['count']}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {value['sum']}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {value['count']}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("valify_stage_seconds", "Time spent in each pipeline stage", ("stage",))
+REQUEST_SECONDS = Histogram("valify_request_seconds", "Request handling time", ("route", "method"))
+REQUESTS = Counter("valify_requests_total", "Finished requests", ("route", "method", "status"))
+IN_FLIGHT = Gauge("valify_requests_in_flight", "Requests being handled", ("route",))
+REQUEST_BYTES = Counter("valify_request_bytes_total", "Request body bytes received", ("route",))
+RESPONSE_BYTES = Counter("valify_response_bytes_total", "Response body bytes sent, streamed bodies excluded", ("route",))
+PAYLOAD_BYTES = Counter("valify_payload_bytes_total", "Bytes moved by pipeline stages", ("kind",))
+
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, IN_FLIGHT, REQUEST_BYTES, RESPONSE_BYTES, PAYLOAD_BYTES)
+
+# Stage timings of the request being handled, None outside requests (jobs, batch workers)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the enclosed block as pipeline stage `name`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_stage(name: str, seconds: float):
+    """Records a stage duration measured by the caller"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def count_bytes(kind: str, size: int):
+    PAYLOAD_BYTES.inc(size, kind=kind)
+
+
+class RequestMetrics:
+    """Tracks one request: in-flight gauge, its stage timings and the totals recorded when it finishes"""
+
+    def __init__(self, route: str, method: str):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.timings = []
+        self._token = _request_timings.set(self.timings)
+        self._finished = False
+        IN_FLIGHT.inc(route=route)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations of repeated stages are added up"""
+        totals = {}
+        for name, seconds in self.timings:
+            totals[name] = totals.get(name, 0.0) + seconds
+        totals["total"] = time.perf_counter() - self.started
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+    def finish(self, status: int, request_bytes: int = 0, response_bytes: int = None):
+        if self._finished:
+            return
+        self._finished = True
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started, route=self.route, method=self.method)
+        REQUESTS.inc(route=self.route, method=self.method, status=str(status))
+        REQUEST_BYTES.inc(request_bytes or 0, route=self.route)
+        if response_bytes is not None:
+            RESPONSE_BYTES.inc(response_bytes, route=self.route)
+
+    def close(self):
+        """Leaves the request, called once the response is done even if the handler failed"""
+        IN_FLIGHT.dec(route=self.route)
+        try:
+            _request_timings.reset(self._token)
+        except ValueError:
+            # Closed from another context, e.g. after a streamed response
+            _request_timings.set(None)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
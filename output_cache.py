@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import datetime
+import threading
+from contextlib import contextmanager
+
+
+def _canonical(value):
+    """JSON fallback for Firestore values (timestamps, dates)"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Content-addressed store for generated workbooks and PDFs shared by every worker on the host
+class OutputCache:
+    """
+    Keeps produced files under a hash of everything that went into them, with LRU size and age limits.
+    The directory is the shared state: eviction runs under an flock on it, each file's mtime is its
+    creation and its atime its last use, so the limits hold across worker processes. A path handed
+    out by get() or put() is pinned with a shared flock for `pin_seconds`, eviction skips pinned files.
+    Nothing touches the disk before the first use, which creates the directory.
+    """
+
+    LOCK_NAME = ".lock"
+    STAGING_PREFIX = ".staging-"
+    # Open pins per process, the oldest is released early beyond this
+    MAX_PINS = 256
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float, pin_seconds: float = 10,
+                 sweep_interval: float = 5):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.pin_seconds = pin_seconds
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # path -> (open file holding LOCK_SH, expiry), oldest first, per process
+        self._pins = {}
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = False
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hashes `parts` (template hash, mode, mapped answers, ...) into a cache key"""
+        canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=_canonical)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _directory_lock(self):
+        """
+        Exclusive flock across processes, opened per call so forked workers never share it.
+        The first call creates the directory and loads it
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+            yield
+
+    def _load(self):
+        """Drops staging directories left by workers that are gone, then applies the limits. Needs the directory lock"""
+        for name in os.listdir(self.directory):
+            if not name.startswith(self.STAGING_PREFIX):
+                continue
+            pid = name[len(self.STAGING_PREFIX):]
+            if not pid.isdigit() or int(pid) == os.getpid() or not _process_alive(int(pid)):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        self._evict()
+
+    def _entries(self) -> list:
+        """[(last used, created, size, key, path)] of every complete entry on disk"""
+        entries = []
+        for key in os.listdir(self.directory):
+            # Lock file and staging directories
+            if "." in key:
+                continue
+            entry_dir = os.path.join(self.directory, key)
+            try:
+                names = os.listdir(entry_dir)
+                if len(names) != 1:
+                    # An interrupted removal, nothing can be serving it
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    continue
+                path = os.path.join(entry_dir, names[0])
+                status = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            entries.append((status.st_atime, status.st_mtime, status.st_size, key, path))
+        return entries
+
+    def _remove(self, path: str) -> bool:
+        """Removes the entry of `path` unless a process has it pinned"""
+        try:
+            with open(path, "rb") as file:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        except BlockingIOError:
+            return False
+        except FileNotFoundError:
+            return True
+        with self._lock:
+            self.evictions += 1
+        return True
+
+    def _evict(self):
+        """Expires old entries, then removes the least recently used until under `max_bytes`. Needs the directory lock"""
+        now = time.time()
+        self._last_sweep = now
+        remaining = []
+        for entry in sorted(self._entries()):
+            if now - entry[1] > self.max_age and self._remove(entry[4]):
+                continue
+            remaining.append(entry)
+
+        size = sum(entry[2] for entry in remaining)
+        for last_used, created, entry_size, key, path in remaining:
+            if size <= self.max_bytes:
+                break
+            if self._remove(path):
+                size -= entry_size
+
+    def _sweep(self, force: bool = False):
+        """Releases expired pins and, at most every `sweep_interval` unless forced, applies the limits"""
+        now = time.time()
+        with self._lock:
+            for path in [path for path, (_, expiry) in self._pins.items() if expiry < now]:
+                self._pins.pop(path)[0].close()
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+
+        with self._directory_lock():
+            self._evict()
+
+    def _pin(self, path: str):
+        """Takes a shared flock on `path` and marks it used, returns its stat or None if it was removed"""
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        fcntl.flock(file, fcntl.LOCK_SH)
+        status = os.fstat(file.fileno())
+        if status.st_nlink == 0:
+            file.close()
+            return None
+
+        now = time.time()
+        # The atime is the LRU order every worker sees, the mtime keeps the creation time
+        os.utime(path, (now, status.st_mtime))
+        with self._lock:
+            released = [self._pins.pop(path, (None,))[0]]
+            self._pins[path] = (file, now + self.pin_seconds)
+            while len(self._pins) > self.MAX_PINS:
+                released.append(self._pins.pop(next(iter(self._pins)))[0])
+        for pinned in released:
+            if pinned is not None:
+                pinned.close()
+        return status
+
+    def get(self, key: str):
+        """Returns the cached file path for `key`, pinned for `pin_seconds`, or None"""
+        # Lookups also sweep expired entries, so idle keys do not linger on disk
+        self._sweep()
+        entry_dir = os.path.join(self.directory, key)
+        try:
+            names = os.listdir(entry_dir)
+        except FileNotFoundError:
+            names = []
+
+        status = self._pin(os.path.join(entry_dir, names[0])) if len(names) == 1 else None
+        with self._lock:
+            if status is None or time.time() - status.st_mtime > self.max_age:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return os.path.join(entry_dir, names[0])
+
+    def put(self, key: str, source, filename: str = None) -> str:
+        """
+        Stores `source` under `key` and returns the cached path, pinned like get(). A path is moved
+        into the cache, a binary file object (an in-memory or spooled buffer) is copied as `filename`.
+        """
+        if not self._loaded:
+            # Loading clears this process's staging directory, so it runs before anything is staged
+            with self._directory_lock():
+                pass
+
+        # Staging lives in a directory of this process only, a restarting worker never touches it
+        staging_dir = os.path.join(self.directory, f"{self.STAGING_PREFIX}{os.getpid()}", uuid.uuid4().hex)
+        os.makedirs(staging_dir)
+
+        try:
+            if isinstance(source, str):
+                filename = filename or os.path.basename(source)
+                shutil.move(source, os.path.join(staging_dir, filename))
+            else:
+                source.seek(0)
+                with open(os.path.join(staging_dir, filename), "wb") as file:
+                    shutil.copyfileobj(source, file)
+
+            entry_dir = os.path.join(self.directory, key)
+            with self._directory_lock():
+                names = os.listdir(entry_dir) if os.path.isdir(entry_dir) else []
+                if len(names) == 1:
+                    # Same key, same content: keep the entry others may be serving
+                    target = os.path.join(entry_dir, names[0])
+                else:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    os.replace(staging_dir, entry_dir)
+                    target = os.path.join(entry_dir, filename)
+                self._pin(target)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        self._sweep(force=True)
+        return target
+
+    def stats(self) -> dict:
+        """This worker's hit, miss and eviction counters plus the footprint shared by all workers"""
+        with self._directory_lock():
+            entries = self._entries()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "bytes": sum(entry[2] for entry in entries),
+                "pinned": len(self._pins),
+            }
@@ -0,0 +1,283 @@
+import os
+import time
+import uuid
+import base64
+import queue
+import random
+import binascii
+import requests
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from metrics import stage, count_bytes
+
+
+CONVERT_API_URL = "https://v2.convertapi.com/convert/xls/to/pdf"
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Responses worth retrying: rate limiting and server-side failures
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# The PDF is the first "FileData" string of the JSON response
+FILE_DATA_MARKER = b'"FileData"'
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class PdfConverter:
+    """
+    Converter backend interface, turns an Excel workbook into a PDF. Source and output
+    are each a path or a binary file object, so stages can hand over in-memory buffers.
+    """
+
+    def convert(self, source, output, filename: str = "report.xlsx"):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Base64StreamDecoder:
+    """Decodes a base64 stream arriving in arbitrary chunks, writing the bytes to `output`"""
+
+    def __init__(self, output):
+        self.output = output
+        self._pending = b""
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        # JSON may escape "/" as "\/", backslashes are never part of base64
+        data = self._pending + chunk.replace(b"\\", b"")
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            decoded = binascii.a2b_base64(data[:usable])
+            self.output.write(decoded)
+            self.size += len(decoded)
+
+    def close(self):
+        if self._pending:
+            decoded = base64.b64decode(self._pending + b"=" * (-len(self._pending) % 4))
+            self.output.write(decoded)
+            self.size += len(decoded)
+            self._pending = b""
+
+
+class FileDataStream:
+    """
+    Incremental reader of a ConvertAPI JSON response: fed the response in chunks, it decodes
+    the first file's base64 "FileData" into `output` as it arrives.
+    """
+
+    def __init__(self, output):
+        self.decoder = Base64StreamDecoder(output)
+        self.done = False
+        self._head = b""
+        self._state = "search"
+
+    def feed(self, chunk: bytes) -> bool:
+        """Consumes one chunk, returns True once the file data is complete"""
+        if not chunk or self.done:
+            return self.done
+
+        if self._state == "search":
+            self._head += chunk
+            position = self._head.find(FILE_DATA_MARKER)
+            if position < 0:
+                # Keep only what could still be the start of a split marker
+                self._head = self._head[-len(FILE_DATA_MARKER):]
+                return False
+            self._state = "open"
+            chunk = self._head[position + len(FILE_DATA_MARKER):]
+            self._head = b""
+
+        if self._state == "open":
+            # Skip the colon and whitespace up to the opening quote
+            quote = chunk.find(b'"')
+            if quote < 0:
+                return False
+            self._state = "data"
+            chunk = chunk[quote + 1:]
+
+        end = chunk.find(b'"')
+        if end < 0:
+            self.decoder.write(chunk)
+            return False
+        self.decoder.write(chunk[:end])
+        self.decoder.close()
+        self.done = True
+        return True
+
+    def finish(self) -> int:
+        """Returns the number of bytes written, raises if the response ended too early"""
+        if self.done:
+            return self.decoder.size
+        if self._state == "search":
+            raise ValueError("No files returned in the response")
+        raise ValueError("Response ended before the file data was complete")
+
+
+def retry_delay(attempt: int, backoff: float, max_backoff: float, response=None) -> float:
+    """Backoff before retry `attempt`, the response's Retry-After included, capped at `max_backoff`"""
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        delay = float(response.headers["Retry-After"])
+    else:
+        delay = backoff * (2 ** attempt) + random.uniform(0, backoff)
+    return min(delay, max_backoff)
+
+
+def connect_failed(error: requests.ConnectionError) -> bool:
+    """True when the connection was never established, so ConvertAPI cannot have received the upload"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # NewConnectionError and NameResolutionError derive from ConnectTimeoutError
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def stream_file_data(chunks, output) -> int:
+    """
+    Reads a ConvertAPI JSON response from `chunks` and decodes the first file's base64
+    "FileData" into `output` as it arrives. Returns the number of bytes written.
+    """
+    stream = FileDataStream(output)
+    for chunk in chunks:
+        if stream.feed(chunk):
+            break
+    return stream.finish()
+
+
+class ConvertApiConverter(PdfConverter):
+    """
+    ConvertAPI client with a pool of keep-alive sessions. The pool size bounds how many
+    conversions run at once, rate limited, failed (5xx) and unconnected calls are retried with
+    exponential backoff and the base64 PDF is decoded into the output while it downloads.
+    A conversion is billed once accepted, so nothing that may have reached ConvertAPI without
+    an answer (a read timeout, a dropped connection) is sent again.
+    """
+
+    def __init__(self, api_key: str, url: str = CONVERT_API_URL, max_concurrency: int = 4,
+                 max_retries: int = 3, backoff: float = 1.0, max_backoff: float = 30, timeout: float = 120):
+        self.api_key = api_key
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._sessions = queue.Queue()
+        for _ in range(max_concurrency):
+            self._sessions.put(self._new_session())
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {self.api_key}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @contextmanager
+    def _session(self):
+        """Blocks until a pooled session is free, this is what bounds concurrency"""
+        session = self._sessions.get()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    @contextmanager
+    def _source(self, source):
+        """Opens a source path, or rewinds a source file object, for one upload attempt"""
+        if isinstance(source, str):
+            with open(source, "rb") as file:
+                yield file
+        else:
+            source.seek(0)
+            yield source
+
+    @contextmanager
+    def _target(self, output):
+        """
+        Yields the file the PDF is decoded into. Paths are written through a uniquely named
+        ".part" file that replaces the output only once complete, file objects are truncated.
+        """
+        if not isinstance(output, str):
+            output.seek(0)
+            output.truncate()
+            yield output
+            return
+
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        partial_path = f"{output}.{uuid.uuid4().hex}.part"
+        try:
+            with open(partial_path, "wb") as file:
+                yield file
+            os.replace(partial_path, output)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def convert(self, source, output, filename: str = "report.xlsx"):
+        """Converts the workbook `source` and writes the PDF to `output`, returns `output`"""
+        data = {
+            "StoreFile": "false",
+            "WorksheetActive": "true",
+            "PageOrientation": "landscape",
+        }
+        if isinstance(source, str):
+            filename = os.path.basename(source)
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            with self._session() as session:
+                try:
+                    with self._source(source) as file:
+                        upload_size = file.seek(0, os.SEEK_END)
+                        file.seek(0)
+                        files = {"File": (filename, file, XLSX_CONTENT_TYPE)}
+                        # Upload and remote rendering, up to the response headers
+                        with stage("convertapi"):
+                            response = session.post(self.url, files=files, data=data, timeout=self.timeout, stream=True)
+
+                    with response:
+                        if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                            # Drain the short error body so the connection goes back to the pool
+                            response.content
+                            delay = retry_delay(attempt, self.backoff, self.max_backoff, response)
+                            print(f"ConvertAPI returned {response.status_code}, retrying in {delay:.1f}s")
+                        else:
+                            response.raise_for_status()
+                            # Download and base64 decoding, interleaved chunk by chunk
+                            with stage("decode"), self._target(output) as pdf_file:
+                                size = stream_file_data(response.iter_content(READ_CHUNK_SIZE), pdf_file)
+
+                            count_bytes("convertapi_upload", upload_size)
+                            count_bytes("convertapi_pdf", size)
+                            print(f"PDF successfully converted from '{filename}' ({size} bytes)")
+                            return output
+
+                except requests.ConnectionError as e:
+                    if last_attempt or not connect_failed(e):
+                        raise
+                    delay = retry_delay(attempt, self.backoff, self.max_backoff)
+                    print(f"ConvertAPI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+
+            # The session is back in the pool while this conversion waits
+            with stage("convertapi_backoff"):
+                time.sleep(delay)
+
+    def close(self):
+        while not self._sessions.empty():
+            self._sessions.get_nowait().close()
+
+
+# Backends selectable with PDF_CONVERTER_BACKEND
+CONVERTER_BACKENDS = {
+    "convertapi": ConvertApiConverter,
+}
+
+
+def create_converter(backend: str, **options) -> PdfConverter:
+    """Builds the converter backend called `backend`"""
+    if backend not in CONVERTER_BACKENDS:
+        raise ValueError(f"Unknown PDF converter backend '{backend}'")
+    return CONVERTER_BACKENDS[backend](**options)
@@ -0,0 +1,101 @@
+import os
+import re
+import uuid
+import fitz
+
+
+# Locating and copying the report section of a converted PDF
+
+# Bookmark titles and named destinations that mark the start of the report, matched case-insensitively
+REPORT_BOOKMARKS = ("Report",)
+REPORT_DESTINATIONS = ("Report",)
+# Report pages start with a row such as "Page 1: Cover" (report_renderer.PAGE_MARKER_RE) in column A.
+# Only whole-workbook conversions print it; the sliced report workbook prints B:F and is already
+# just the report, so the ConvertAPI report path never extracts
+REPORT_MARKER_RE = re.compile(r"^\s*Page\s+\d+\s*:", re.M)
+
+# garbage=3 drops unused and duplicate objects, deflate compresses streams and linear lets
+# viewers show the first page before the whole file has downloaded
+SAVE_OPTIONS = {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True, "linear": True}
+
+
+def _open(source) -> fitz.Document:
+    if isinstance(source, str):
+        return fitz.open(source)
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    source.seek(0)
+    return fitz.open(stream=source.read(), filetype="pdf")
+
+
+def find_section_start(doc: fitz.Document, bookmarks=REPORT_BOOKMARKS, destinations=REPORT_DESTINATIONS,
+                       marker=REPORT_MARKER_RE):
+    """
+    Returns the 0-based page where the section starts and how it was found, looking at
+    bookmarks, then named destinations, then page text. Returns (None, None) if nothing matches.
+    """
+    titles = {title.casefold() for title in bookmarks}
+    for _, title, page_number in doc.get_toc(simple=True):
+        if title.strip().casefold() in titles and page_number >= 1:
+            return page_number - 1, "bookmark"
+
+    names = {name.casefold() for name in destinations}
+    for name, destination in doc.resolve_names().items():
+        if name.casefold() in names and destination.get("page", -1) >= 0:
+            return destination["page"], "destination"
+
+    if marker is not None:
+        for page in doc:
+            if marker.search(page.get_text("text")):
+                return page.number, "marker"
+
+    return None, None
+
+
+def extract_section(source, output, start_page: int = None, required: bool = True) -> dict:
+    """
+    Copies the pages from the section start to the end of `source` (path, bytes or binary file)
+    into `output` (path or binary file). `start_page` (1-based) skips the search. When the
+    section is not found, raises ValueError, or copies every page if `required` is False.
+    """
+    doc = _open(source)
+    try:
+        if start_page is not None:
+            start, found_by = start_page - 1, "start_page"
+        else:
+            start, found_by = find_section_start(doc)
+
+        if start is None:
+            if required:
+                raise ValueError("Report section not found: no bookmark, named destination or page marker")
+            start, found_by = 0, "none"
+
+        if not 0 <= start < len(doc):
+            raise ValueError(f"The PDF has {len(doc)} pages, cannot extract from page {start + 1}")
+
+        section = fitz.open()
+        try:
+            # One copy of the whole range, links and outline entries inside it come along
+            section.insert_pdf(doc, from_page=start, to_page=len(doc) - 1)
+            pages = len(section)
+            if isinstance(output, str):
+                # Written next to the target and swapped in, so `output` may also be the source
+                partial_path = f"{output}.{uuid.uuid4().hex}.part"
+                try:
+                    section.save(partial_path, **SAVE_OPTIONS)
+                    os.replace(partial_path, output)
+                finally:
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+            else:
+                # PyMuPDF only writes into BytesIO-like objects, not spooled temp files
+                data = section.tobytes(**SAVE_OPTIONS)
+                output.seek(0)
+                output.truncate()
+                output.write(data)
+        finally:
+            section.close()
+    finally:
+        doc.close()
+
+    return {"start_page": start + 1, "pages": pages, "found_by": found_by}
@@ -0,0 +1,176 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+# Firestore reads of project answers shared by all requests handled in this worker
+class ProjectStore:
+    """
+    Reads `answers` of users/{uid}/projects/{project_id} with a field mask, so only the mapped
+    answers cross the network, and keeps recently used projects in memory for `max_age` seconds.
+    invalidate() drops a project sooner: it touches a marker file in `invalidation_dir`, and every
+    worker sharing the directory refetches a project it read before its marker. `db` is any client
+    with the Firestore API: the real one, the emulator (FIRESTORE_EMULATOR_HOST) or a fake.
+    `async_db` is the matching async client, used by `get_answers_async` on cache misses.
+    """
+
+    def __init__(self, db, answer_fields, max_entries: int = 100, max_age: float = 60, async_db=None,
+                 invalidation_dir: str = None):
+        self.db = db
+        self.async_db = async_db
+        self.field_paths = [FieldPath("answers", field).to_api_repr() for field in sorted(set(answer_fields))]
+        self.max_entries = max_entries
+        # Bounds how stale a project can be when nobody calls invalidate() after writing it
+        self.max_age = max_age
+        self.invalidation_dir = invalidation_dir
+        self._lock = threading.Lock()
+        # (uid, project_id) -> {"answers", "loaded"}, least recently used first
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _ref(self, uid: str, project_id: str):
+        return self.db.collection("users").document(uid).collection("projects").document(project_id)
+
+    def _marker(self, key: tuple) -> str:
+        return os.path.join(self.invalidation_dir, hashlib.sha256("/".join(key).encode("utf-8")).hexdigest())
+
+    def _invalidated_at(self, key: tuple) -> float:
+        """Time of the last invalidate() of `key` by any worker, 0 if none is known"""
+        if self.invalidation_dir is None:
+            return 0.0
+        try:
+            return os.stat(self._marker(key)).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def _cached(self, key: tuple):
+        """Returns the cached answers for `key` or None, the caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry["loaded"] > self.max_age:
+            del self._entries[key]
+            entry = None
+        elif entry is not None and self._invalidated_at(key) >= entry["loaded"]:
+            del self._entries[key]
+            self.invalidations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry["answers"]
+
+    def _store(self, key: tuple, answers: dict, started: float):
+        """Caches a fetched project, `started` is when its read began so a write during the read is not missed"""
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {"answers": answers, "loaded": started}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_answers(self, uid: str, project_id: str) -> dict:
+        """Returns the project's mapped answers, raises FileNotFoundError if the project does not exist"""
+        key = (uid, project_id)
+        with self._lock:
+            answers = self._cached(key)
+        if answers is not None:
+            return dict(answers)
+
+        started = time.time()
+        snapshot = self._ref(uid, project_id).get(field_paths=self.field_paths)
+        if not snapshot.exists:
+            raise FileNotFoundError("Document not found")
+
+        answers = (snapshot.to_dict() or {}).get("answers", {})
+        self._store(key, answers, started)
+        return dict(answers)
+
+    async def get_answers_async(self, uid: str, project_id: str) -> dict:
+        """`get_answers` for the ASGI app, the Firestore read does not block the event loop"""
+        key = (uid, project_id)
+        with self._lock:
+            answers = self._cached(key)
+        if answers is not None:
+            return dict(answers)
+
+        started = time.time()
+        async_ref = self.async_db.collection("users").document(uid).collection("projects").document(project_id)
+        snapshot = await async_ref.get(field_paths=self.field_paths)
+        if not snapshot.exists:
+            raise FileNotFoundError("Document not found")
+
+        answers = (snapshot.to_dict() or {}).get("answers", {})
+        self._store(key, answers, started)
+        return dict(answers)
+
+    def get_answers_many(self, pairs: list) -> dict:
+        """Returns {(uid, project_id): answers}, None for projects that do not exist, in one round trip"""
+        answers = {}
+        refs = {}
+        started = time.time()
+        with self._lock:
+            for key in pairs:
+                cached = self._cached(key)
+                answers[key] = dict(cached) if cached is not None else None
+                if cached is None:
+                    doc_ref = self._ref(*key)
+                    refs[doc_ref.path] = (key, doc_ref)
+
+        if refs:
+            for snapshot in self.db.get_all([doc_ref for _, doc_ref in refs.values()], field_paths=self.field_paths):
+                if snapshot.exists:
+                    key, _ = refs[snapshot.reference.path]
+                    data = (snapshot.to_dict() or {}).get("answers", {})
+                    self._store(key, data, started)
+                    answers[key] = dict(data)
+
+        return answers
+
+    def invalidate(self, uid: str, project_id: str):
+        """Drops the cached answers of a project in every worker sharing `invalidation_dir`, call it after writing them"""
+        key = (uid, project_id)
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+        if self.invalidation_dir is None:
+            return
+
+        os.makedirs(self.invalidation_dir, exist_ok=True)
+        with open(self._marker(key), "a"):
+            pass
+        now = time.time()
+        os.utime(self._marker(key), (now, now))
+
+        # Entries older than max_age expire anyway, so are their markers
+        for name in os.listdir(self.invalidation_dir):
+            path = os.path.join(self.invalidation_dir, name)
+            try:
+                if now - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """Hit, miss and invalidation counters plus the number of cached projects"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+    def close(self):
+        """Forgets every cached project"""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,638 @@
+import io
+import re
+import zipfile
+import posixpath
+import datetime
+from openpyxl.styles.numbers import is_date_format
+from openpyxl.utils.cell import range_boundaries, get_column_letter
+from openpyxl.utils.datetime import from_excel
+from openpyxl.worksheet.pagebreak import Break, RowBreak
+from openpyxl.worksheet.properties import PageSetupProperties
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.graphics.charts.barcharts import VerticalBarChart, HorizontalBarChart
+from reportlab.graphics.charts.linecharts import HorizontalLineChart
+from reportlab.graphics.charts.legends import Legend
+from reportlab.graphics import renderPDF
+from reportlab.lib import colors
+from PIL import Image, ImageOps
+from xlsx_patch import _resolve_sheet_part
+
+
+REPORT_SHEETS = ("Report",)
+
+# Rows in column A such as "Page 6: Executive Summary" start a new report page
+PAGE_MARKER_RE = re.compile(r"^Page\s+\d+\s*:")
+
+EMU_PER_POINT = 12700
+# Embedded pictures are downscaled once to this many pixels per point of their printed size
+IMAGE_PIXELS_PER_POINT = 2
+DEFAULT_ROW_HEIGHT = 15.0
+DEFAULT_COLUMN_WIDTH = 8.43
+PAGE_MARGIN = 24
+
+# Office default theme order used by <color theme="n"/>
+THEME_COLOR_ORDER = ("lt1", "dk1", "lt2", "dk2", "accent1", "accent2", "accent3", "accent4", "accent5", "accent6")
+
+# DrawingML percentages (srcRect, lum) are stored in thousandths of a percent
+DRAWING_PERCENT = 100000
+
+PICTURE_RE = re.compile(r"<xdr:(?:twoCellAnchor|oneCellAnchor)\b.*?</xdr:(?:twoCellAnchor|oneCellAnchor)>", re.S)
+ANCHOR_FROM_RE = re.compile(
+    r"<xdr:from><xdr:col>(\d+)</xdr:col><xdr:colOff>(-?\d+)</xdr:colOff>"
+    r"<xdr:row>(\d+)</xdr:row><xdr:rowOff>(-?\d+)</xdr:rowOff></xdr:from>"
+)
+
+SERIES_COLORS = ("#00CCE2", "#1F3864", "#92A4FC", "#F4B183", "#A9D18E", "#FFD966", "#7F7F7F", "#C00000", "#5B9BD5")
+
+
+def _points_for_width(width: float) -> float:
+    """Converts an Excel column width (characters) to points"""
+    return (width * 7 + 5) * 0.75
+
+
+def _theme_colors(workbook) -> dict:
+    """Reads the scheme colours from the workbook theme"""
+    theme = workbook.loaded_theme or b""
+    if isinstance(theme, bytes):
+        theme = theme.decode("utf-8", "ignore")
+
+    found = {}
+    for name in THEME_COLOR_ORDER:
+        match = re.search(rf"<a:{name}>.*?(?:srgbClr val|lastClr)=\"([0-9A-Fa-f]{{6}})\"", theme, re.S)
+        if match:
+            found[name] = "#" + match.group(1)
+    return {index: found[name] for index, name in enumerate(THEME_COLOR_ORDER) if name in found}
+
+
+def _resolve_color(color, theme_colors: dict):
+    """Returns a reportlab colour for an openpyxl Color, or None"""
+    if color is None:
+        return None
+    if color.type == "rgb" and isinstance(color.rgb, str) and len(color.rgb) == 8 and color.rgb != "00000000":
+        return colors.HexColor("#" + color.rgb[2:])
+    if color.type == "theme" and color.theme in theme_colors:
+        return colors.HexColor(theme_colors[color.theme])
+    return None
+
+
+def picture_effects(source, sheet_name: str) -> dict:
+    """
+    Reads the crop and colour effects of the pictures on `sheet_name` from the template
+    (a path or bytes), keyed by their anchor (col, colOff, row, rowOff). openpyxl drops these.
+    """
+    with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as archive:
+        sheet_part = _resolve_sheet_part(archive.read, sheet_name)
+        rels_part = posixpath.join(posixpath.dirname(sheet_part), "_rels", posixpath.basename(sheet_part) + ".rels")
+        if rels_part not in archive.namelist():
+            return {}
+
+        rels_xml = archive.read(rels_part).decode("utf-8")
+        drawing = re.search(r'<Relationship\s[^>]*?Type="[^"]*/drawing"[^>]*?/>', rels_xml)
+        if drawing is None:
+            return {}
+        target = re.search(r'\sTarget="([^"]*)"', drawing.group()).group(1)
+        drawing_part = posixpath.normpath(posixpath.join(posixpath.dirname(sheet_part), target))
+        drawing_xml = archive.read(drawing_part).decode("utf-8")
+
+    effects = {}
+    for match in PICTURE_RE.finditer(drawing_xml):
+        anchor_xml = match.group()
+        start = ANCHOR_FROM_RE.search(anchor_xml)
+        if start is None or "<xdr:pic>" not in anchor_xml:
+            continue
+
+        effect = {}
+        crop = re.search(r"<a:srcRect((?:\s[^>]*?)?)/>", anchor_xml)
+        if crop and crop.group(1).strip():
+            sides = dict(re.findall(r'\s([ltrb])="(-?\d+)"', crop.group(1)))
+            effect["crop"] = tuple(int(sides.get(side, 0)) / DRAWING_PERCENT for side in "ltrb")
+
+        lum = re.search(r"<a:lum((?:\s[^>]*?)?)/>", anchor_xml)
+        if lum:
+            levels = dict(re.findall(r'\s(bright|contrast)="(-?\d+)"', lum.group(1)))
+            effect["lum"] = (
+                int(levels.get("bright", 0)) / DRAWING_PERCENT,
+                int(levels.get("contrast", 0)) / DRAWING_PERCENT,
+            )
+
+        if "<a:duotone>" in anchor_xml:
+            effect["duotone"] = True
+
+        if effect:
+            effects[tuple(int(value) for value in start.groups())] = effect
+    return effects
+
+
+def apply_picture_effects(picture, effect: dict, theme_colors: dict):
+    """Approximates the srcRect crop, lum and duotone effects Excel applies when drawing a picture"""
+    crop = effect.get("crop")
+    if crop:
+        left, top, right, bottom = (max(value, 0.0) for value in crop)
+        box = (
+            int(picture.width * left), int(picture.height * top),
+            int(picture.width * (1 - right)), int(picture.height * (1 - bottom)),
+        )
+        if box[2] > box[0] and box[3] > box[1]:
+            picture = picture.crop(box)
+
+    lum = effect.get("lum")
+    if lum:
+        bright, contrast = lum
+        factor = 1 + contrast
+        offset = 255 * bright
+
+        def adjust(level: int) -> int:
+            return max(0, min(255, int((level - 128) * factor + 128 + offset)))
+
+        bands = picture.split()
+        picture = Image.merge(picture.mode, [band.point(adjust) for band in bands[:3]] + list(bands[3:]))
+
+    if effect.get("duotone"):
+        # Dark tone is the shaded background-2 colour, light tone is white
+        dark = theme_colors.get(2, "#7F7F7F")
+        shaded = "#" + "".join(f"{int(int(dark[index:index + 2], 16) * 0.45):02X}" for index in (1, 3, 5))
+        alpha = picture.getchannel("A") if picture.mode == "RGBA" else None
+        picture = ImageOps.colorize(picture.convert("L"), shaded, "#FFFFFF")
+        if alpha is not None:
+            picture.putalpha(alpha)
+
+    return picture
+
+
+def parse_reference(reference: str) -> list:
+    """Expands a chart reference such as "(Sheet!$A$1:$B$1,Sheet!$D$1)" into "Sheet!A1" cells"""
+    cells = []
+    for part in re.findall(r"(?:'[^']+'|[^,()'!]+)![$A-Z0-9:]+", reference or ""):
+        sheet_name, cell_range = part.rsplit("!", 1)
+        sheet_name = sheet_name.strip("'")
+        min_col, min_row, max_col, max_row = range_boundaries(cell_range.replace("$", ""))
+        for row in range(min_row, max_row + 1):
+            for column in range(min_col, max_col + 1):
+                cells.append(f"{sheet_name}!{get_column_letter(column)}{row}")
+    return cells
+
+
+def format_value(value, number_format: str) -> str:
+    """Formats a cell value roughly the way Excel displays it"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, str):
+        return value
+
+    number_format = number_format or "General"
+    if is_date_format(number_format):
+        if isinstance(value, (int, float)):
+            value = from_excel(value)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            if "mmmm" in number_format:
+                return value.strftime("%B %d, %Y")
+            if "mmm" in number_format:
+                return value.strftime("%d-%b-%Y")
+            return value.strftime("%d/%m/%Y")
+
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime("%d/%m/%Y")
+
+    if not isinstance(value, (int, float)):
+        return str(value)
+
+    if number_format == "General":
+        if float(value).is_integer():
+            return str(int(value))
+        return f"{value:.10g}"
+
+    section = number_format.split(";")[0]
+    decimals = len(re.search(r"0(?:\.(0+))?", section).group(1) or "") if "0" in section else 0
+
+    if "%" in section:
+        return f"{value * 100:.{decimals}f}%"
+
+    text = f"{abs(value):,.{decimals}f}" if "," in section else f"{abs(value):.{decimals}f}"
+    if value < 0:
+        return f"({text})" if "(" in number_format else f"-{text}"
+    return text
+
+
+class ReportLayout:
+    """Geometry, styles, images and charts of the report sheets, extracted once from the template"""
+
+    def __init__(self, workbook, sheet_names=REPORT_SHEETS, source=None):
+        """`source` is the template file (path or bytes), used to read picture effects"""
+        self.theme_colors = _theme_colors(workbook)
+        self.pages = []
+        self.value_cells = []
+        self.print_columns = {}
+
+        for sheet_name in sheet_names:
+            if sheet_name not in workbook.sheetnames:
+                raise KeyError(f"Excel template is missing '{sheet_name}' sheet")
+            effects = picture_effects(source, sheet_name) if source is not None else {}
+            self._extract_sheet(workbook[sheet_name], effects)
+
+    def _extract_sheet(self, worksheet, effects: dict):
+        sheet_name = worksheet.title
+
+        # Printed columns come from the print area, falling back to the used range
+        if worksheet.print_area:
+            area = worksheet.print_area[0] if isinstance(worksheet.print_area, (list, tuple)) else worksheet.print_area
+            min_col, _, max_col, _ = range_boundaries(area.split("!")[-1].replace("$", ""))
+        else:
+            min_col, _, max_col, _ = range_boundaries(worksheet.dimensions)
+        self.print_columns[sheet_name] = (min_col, max_col)
+
+        column_x = {}
+        x = 0.0
+        for column in range(1, max_col + 2):
+            column_x[column] = x
+            dimension = worksheet.column_dimensions.get(get_column_letter(column))
+            hidden = dimension is not None and dimension.hidden
+            width = dimension.width if dimension is not None and dimension.width else DEFAULT_COLUMN_WIDTH
+            if min_col <= column <= max_col and not hidden:
+                x += _points_for_width(width)
+
+        default_height = worksheet.sheet_format.defaultRowHeight or DEFAULT_ROW_HEIGHT
+        row_y = {}
+        y = 0.0
+        for row in range(1, worksheet.max_row + 2):
+            row_y[row] = y
+            dimension = worksheet.row_dimensions.get(row)
+            if dimension is not None and dimension.hidden:
+                continue
+            y += dimension.height if dimension is not None and dimension.height else default_height
+
+        # Page blocks start at every marker row in column A
+        markers = [
+            (cell.row, str(cell.value))
+            for cell in worksheet["A"]
+            if isinstance(cell.value, str) and PAGE_MARKER_RE.match(cell.value)
+        ] or [(1, sheet_name)]
+
+        merged = {}
+        for merged_range in worksheet.merged_cells.ranges:
+            merged[(merged_range.min_row, merged_range.min_col)] = (merged_range.max_row, merged_range.max_col)
+
+        for index, (first_row, title) in enumerate(markers):
+            last_row = markers[index + 1][0] - 1 if index + 1 < len(markers) else worksheet.max_row
+            page = {
+                "title": title,
+                "sheet": sheet_name,
+                "rows": (first_row, last_row),
+                "origin": (column_x[min_col], row_y[first_row]),
+                "size": (column_x[max_col + 1] - column_x[min_col], row_y[last_row + 1] - row_y[first_row]),
+                "cells": [],
+                "images": [],
+                "charts": [],
+            }
+
+            for row in worksheet.iter_rows(min_row=first_row, max_row=last_row, min_col=min_col, max_col=max_col):
+                for cell in row:
+                    fill = cell.fill.fgColor if cell.fill is not None and cell.fill.fill_type == "solid" else None
+                    if cell.value is None and fill is None:
+                        continue
+
+                    end_row, end_col = merged.get((cell.row, cell.column), (cell.row, cell.column))
+                    address = f"{sheet_name}!{cell.coordinate}"
+                    is_formula = isinstance(cell.value, str) and cell.value.startswith("=")
+                    if is_formula:
+                        self.value_cells.append(address)
+
+                    page["cells"].append({
+                        "address": address,
+                        "value": None if is_formula else cell.value,
+                        "formula": is_formula,
+                        "box": (
+                            column_x[cell.column], row_y[cell.row],
+                            column_x[end_col + 1] - column_x[cell.column], row_y[end_row + 1] - row_y[cell.row],
+                        ),
+                        "font": (
+                            "Helvetica-Bold" if cell.font.b else "Helvetica",
+                            float(cell.font.sz or 10),
+                            _resolve_color(cell.font.color, self.theme_colors) or colors.black,
+                        ),
+                        "fill": _resolve_color(fill, self.theme_colors) if fill is not None else None,
+                        "align": cell.alignment.horizontal or ("right" if not isinstance(cell.value, str) else "left"),
+                        "wrap": bool(cell.alignment.wrap_text),
+                        "number_format": cell.number_format,
+                    })
+
+            for image in worksheet._images:
+                box = self._anchor_box(image.anchor, column_x, row_y)
+                if box and first_row <= image.anchor._from.row + 1 <= last_row:
+                    anchor = self._anchor_key(image.anchor)
+                    picture = self._prepare_image(image._data(), box, effects.get(anchor, {}))
+                    page["images"].append({"box": box, "anchor": anchor, "picture": picture, "image": ImageReader(picture)})
+
+            for chart in worksheet._charts:
+                box = self._anchor_box(chart.anchor, column_x, row_y)
+                if box and first_row <= chart.anchor._from.row + 1 <= last_row:
+                    page["charts"].append(self._extract_chart(chart, box))
+
+            self.pages.append(page)
+
+    def _prepare_image(self, data: bytes, box: tuple, effect: dict):
+        """Decodes, applies effects and downscales a picture once so rendering does not re-encode the original"""
+        picture = Image.open(io.BytesIO(data))
+        if picture.mode not in ("RGB", "RGBA"):
+            picture = picture.convert("RGBA")
+        picture = apply_picture_effects(picture, effect, self.theme_colors)
+        target = (
+            max(int(box[2] * IMAGE_PIXELS_PER_POINT), 1),
+            max(int(box[3] * IMAGE_PIXELS_PER_POINT), 1),
+        )
+        if picture.width > target[0] or picture.height > target[1]:
+            picture = picture.resize(target, Image.LANCZOS)
+        return picture
+
+    @staticmethod
+    def _anchor_key(anchor) -> tuple:
+        start = anchor._from
+        return start.col, start.colOff, start.row, start.rowOff
+
+    @property
+    def sheets(self) -> list:
+        """Report sheets followed by the sheets their formulas and charts read values from"""
+        names = [page["sheet"] for page in self.pages]
+        names += [address.rsplit("!", 1)[0] for address in self.value_cells]
+        return list(dict.fromkeys(names))
+
+    @staticmethod
+    def _anchor_box(anchor, column_x: dict, row_y: dict):
+        """Returns (x, y, width, height) in points for a drawing anchor"""
+        start = getattr(anchor, "_from", None)
+        if start is None or start.col + 1 not in column_x or start.row + 1 not in row_y:
+            return None
+
+        x = column_x[start.col + 1] + start.colOff / EMU_PER_POINT
+        y = row_y[start.row + 1] + start.rowOff / EMU_PER_POINT
+
+        end = getattr(anchor, "to", None)
+        if end is not None and end.col + 1 in column_x and end.row + 1 in row_y:
+            width = column_x[end.col + 1] + end.colOff / EMU_PER_POINT - x
+            height = row_y[end.row + 1] + end.rowOff / EMU_PER_POINT - y
+        elif getattr(anchor, "ext", None) is not None:
+            width = anchor.ext.width / EMU_PER_POINT
+            height = anchor.ext.height / EMU_PER_POINT
+        else:
+            return None
+
+        return x, y, width, height
+
+    def _extract_chart(self, chart, box) -> dict:
+        series = []
+        for item in chart.series:
+            values = parse_reference(item.val.numRef.f) if item.val is not None and item.val.numRef is not None else []
+            categories = []
+            if item.cat is not None:
+                reference = item.cat.strRef or item.cat.numRef or item.cat.multiLvlStrRef
+                categories = parse_reference(reference.f) if reference is not None else []
+            name = parse_reference(item.tx.strRef.f) if item.tx is not None and item.tx.strRef is not None else []
+
+            self.value_cells.extend(values + categories + name)
+            series.append({"values": values, "categories": categories, "name": name})
+
+        return {
+            "box": box,
+            "kind": "line" if chart.tagname == "lineChart" else getattr(chart, "barDir", "col"),
+            "grouping": getattr(chart, "grouping", "clustered"),
+            "title": self._chart_title(chart),
+            "series": series,
+        }
+
+    @staticmethod
+    def _chart_title(chart) -> str:
+        title = chart.title
+        if title is None or title.tx is None or title.tx.rich is None:
+            return ""
+        return "".join(run.t or "" for paragraph in title.tx.rich.p for run in (paragraph.r or []))
+
+
+def slice_report_workbook(workbook, layout: ReportLayout):
+    """
+    Reduces `workbook` (a private copy) to just the report sheets and the sheets feeding their
+    charts, ready for a remote converter once write_report_values() filled in the values.
+    Nothing here depends on the answers, so it runs once per template.
+    """
+    report_sheets = list(dict.fromkeys(page["sheet"] for page in layout.pages))
+    keep = layout.sheets
+
+    for worksheet in list(workbook.worksheets):
+        if worksheet.title not in keep:
+            workbook.remove(worksheet)
+    for chartsheet in list(workbook.chartsheets):
+        workbook.remove(chartsheet)
+
+    # Workbook-level names pointing at removed sheets would turn into #REF! on open
+    for name, defined_name in list(workbook.defined_names.items()):
+        if "!" in (defined_name.attr_text or "") and not any(
+            re.search(rf"(?<![\w.])'?{re.escape(title)}'?!", defined_name.attr_text) for title in keep
+        ):
+            del workbook.defined_names[name]
+    workbook._external_links = []
+
+    # Macros are not needed to print values
+    if workbook.vba_archive is not None:
+        workbook.vba_archive.close()
+        workbook.vba_archive = None
+
+    # Pictures are replaced with the cropped, print-sized versions prepared for the layout
+    pictures = {
+        (page["sheet"], image["anchor"]): image["picture"]
+        for page in layout.pages
+        for image in page["images"]
+    }
+    for worksheet in workbook.worksheets:
+        for image in worksheet._images:
+            picture = pictures.get((worksheet.title, ReportLayout._anchor_key(image.anchor)))
+            if picture is not None:
+                buffer = io.BytesIO()
+                picture.save(buffer, format="PNG", optimize=True)
+                image.ref = buffer
+                image.format = "png"
+
+    for worksheet in workbook.worksheets:
+        worksheet.data_validations.dataValidation = []
+        # Chart data sheets are only read, never printed
+        if worksheet.title not in report_sheets:
+            worksheet.sheet_state = "hidden"
+
+    # Print exactly the marker-delimited page blocks, one block per page
+    for sheet_name in report_sheets:
+        worksheet = workbook[sheet_name]
+        pages = [page for page in layout.pages if page["sheet"] == sheet_name]
+        min_col, max_col = layout.print_columns[sheet_name]
+        worksheet.print_area = (
+            f"{get_column_letter(min_col)}{pages[0]['rows'][0]}:{get_column_letter(max_col)}{pages[-1]['rows'][1]}"
+        )
+        worksheet.row_breaks = RowBreak()
+        for page in pages[1:]:
+            worksheet.row_breaks.append(Break(id=page["rows"][0] - 1))
+        worksheet.page_setup.fitToHeight = 0
+        worksheet.sheet_properties.pageSetUpPr = PageSetupProperties(fitToPage=True)
+
+    for worksheet in workbook.worksheets:
+        worksheet.sheet_view.tabSelected = worksheet.title == report_sheets[0]
+    workbook.active = workbook[report_sheets[0]]
+
+
+def write_report_values(workbook, values: dict):
+    """Writes the evaluated `values` ({"Sheet!A1": value}) into a workbook sliced by slice_report_workbook()"""
+    for address, value in values.items():
+        sheet_name, coordinate = address.rsplit("!", 1)
+        if sheet_name in workbook.sheetnames:
+            workbook[sheet_name][coordinate].value = value
+
+
+def _number(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0.0
+    return float(value)
+
+
+def _draw_chart(pdf, chart: dict, lookup, x: float, y: float, width: float, height: float):
+    """Draws a bar or line chart with reportlab graphics"""
+    series = [item for item in chart["series"] if item["values"]]
+    if not series or width <= 0 or height <= 0:
+        return
+
+    data = [[_number(lookup(address)) for address in item["values"]] for item in series]
+    if chart["grouping"] == "percentStacked":
+        totals = [sum(abs(values[index]) for values in data) or 1.0 for index in range(len(data[0]))]
+        data = [[value / totals[index] * 100 for index, value in enumerate(values)] for values in data]
+
+    categories = [format_value(lookup(address), "General") for address in series[0]["categories"]]
+    names = [" ".join(format_value(lookup(address), "General") for address in item["name"]) for item in series]
+
+    drawing = Drawing(width, height)
+    title_height = 14 if chart["title"] else 0
+    legend_height = 14
+
+    if chart["kind"] == "line":
+        plot = HorizontalLineChart()
+    elif chart["kind"] == "bar":
+        plot = HorizontalBarChart()
+    else:
+        plot = VerticalBarChart()
+
+    plot.x = 30
+    plot.y = 20 + legend_height
+    plot.width = max(width - 40, 10)
+    plot.height = max(height - 40 - legend_height - title_height, 10)
+    plot.data = data
+    plot.categoryAxis.categoryNames = categories or None
+    plot.categoryAxis.labels.fontSize = 5
+    plot.valueAxis.labels.fontSize = 5
+    if chart["grouping"] in ("stacked", "percentStacked") and chart["kind"] != "line":
+        plot.categoryAxis.style = "stacked"
+
+    for index in range(len(data)):
+        color = colors.HexColor(SERIES_COLORS[index % len(SERIES_COLORS)])
+        if chart["kind"] == "line":
+            plot.lines[index].strokeColor = color
+        else:
+            plot.bars[index].fillColor = color
+            plot.bars[index].strokeColor = None
+
+    drawing.add(plot)
+
+    legend = Legend()
+    legend.x = 30
+    legend.y = 8
+    legend.fontSize = 5
+    legend.alignment = "right"
+    legend.columnMaximum = 1
+    legend.deltax = max(width - 40, 10) / max(len(data), 1)
+    legend.colorNamePairs = [
+        (colors.HexColor(SERIES_COLORS[index % len(SERIES_COLORS)]), names[index])
+        for index in range(len(data))
+    ]
+    drawing.add(legend)
+
+    if chart["title"]:
+        drawing.add(String(width / 2, height - 10, chart["title"], fontSize=7, textAnchor="middle"))
+
+    renderPDF.draw(drawing, pdf, x, y)
+
+
+def render_report(layout: ReportLayout, values: dict, output):
+    """
+    Writes the report pages to `output` (a path or binary file) as a PDF.
+    `values` maps "Sheet!A1" addresses of formula and chart cells to their computed values.
+    """
+    def lookup(address: str):
+        return values.get(address)
+
+    page_width, page_height = landscape(A4)
+    pdf = canvas.Canvas(output, pagesize=(page_width, page_height))
+    pdf.setTitle("Valuation Report")
+
+    for page in layout.pages:
+        origin_x, origin_y = page["origin"]
+        block_width, block_height = page["size"]
+        scale = min(
+            (page_width - 2 * PAGE_MARGIN) / max(block_width, 1),
+            (page_height - 2 * PAGE_MARGIN) / max(block_height, 1),
+        )
+        offset_x = (page_width - block_width * scale) / 2
+        offset_y = (page_height - block_height * scale) / 2
+
+        def to_page(x: float, y: float, height: float = 0.0) -> tuple:
+            """Maps sheet points (top-left origin) to PDF points (bottom-left origin)"""
+            return (
+                offset_x + (x - origin_x) * scale,
+                page_height - offset_y - (y - origin_y + height) * scale,
+            )
+
+        for cell in page["cells"]:
+            if cell["fill"] is not None:
+                x, y, width, height = cell["box"]
+                left, bottom = to_page(x, y, height)
+                pdf.setFillColor(cell["fill"])
+                pdf.rect(left, bottom, width * scale, height * scale, stroke=0, fill=1)
+
+        for image in page["images"]:
+            x, y, width, height = image["box"]
+            left, bottom = to_page(x, y, height)
+            pdf.drawImage(image["image"], left, bottom, width * scale, height * scale, mask="auto")
+
+        for cell in page["cells"]:
+            value = lookup(cell["address"]) if cell["formula"] else cell["value"]
+            text = format_value(value, cell["number_format"])
+            if not text.strip():
+                continue
+
+            x, y, width, height = cell["box"]
+            font_name, font_size, font_color = cell["font"]
+            size = font_size * scale
+            pdf.setFont(font_name, size)
+            pdf.setFillColor(font_color)
+
+            left, bottom = to_page(x, y, height)
+            padding = 2 * scale
+            if cell["wrap"]:
+                lines = simpleSplit(text, font_name, size, width * scale - 2 * padding)
+                top = bottom + height * scale - size
+                for number, line in enumerate(lines):
+                    pdf.drawString(left + padding, top - number * size * 1.2, line)
+                continue
+
+            baseline = bottom + padding + size * 0.2
+            if cell["align"] in ("center", "centerContinuous"):
+                pdf.drawCentredString(left + width * scale / 2, baseline, text)
+            elif cell["align"] == "right":
+                pdf.drawRightString(left + width * scale - padding, baseline, text)
+            else:
+                pdf.drawString(left + padding, baseline, text)
+
+        for chart in page["charts"]:
+            x, y, width, height = chart["box"]
+            left, bottom = to_page(x, y, height)
+            _draw_chart(pdf, chart, lookup, left, bottom, width * scale, height * scale)
+
+        pdf.showPage()
+
+    pdf.save()
@@ -0,0 +1,146 @@
+import re
+import numpy as np
+
+
+# DCF sheet layout the grid is built from: the explicit forecast columns and their rows
+DCF_SHEET = "DCF"
+DCF_COLUMNS = ("L", "M", "N", "O", "P", "Q")
+DCF_ROWS = {"ebit": 10, "tax": 11, "depreciation": 13, "capex": 14, "nwc_change": 15, "period": 18}
+
+# EBIT links of the DCF columns, used to find each column's revenue on the IS sheet
+EBIT_LINK_RE = re.compile(r"^=IS!\$?([A-Z]+)\$?57$")
+IS_REVENUE_ROW = 23
+
+# Scalars of the terminal year and the equity bridge
+SCALAR_CELLS = {
+    "discount_rate": "DCF!K19",
+    "terminal_growth": "DCF!L27",
+    "terminal_nwc": "BS_Calc!R32",
+    "cash": "DCF!L36",
+    "net_debt": "DCF!L37",
+    "enterprise_value": "DCF!M31",
+}
+
+# Default grid around the project's own rates, the template's sensitivity steps (DCF!K55, DCF!K56)
+DEFAULT_STEP = 0.005
+DEFAULT_STEPS_EACH_SIDE = 2
+MAX_AXIS_POINTS = 201
+
+
+def parse_axis(value) -> list:
+    """
+    Parses a grid axis: a list of numbers, "0.1,0.11,0.12" or an inclusive "start:stop:step".
+    Returns None when `value` is empty.
+    """
+    if value is None or value == "" or value == []:
+        return None
+
+    if isinstance(value, (list, tuple)):
+        points = [float(point) for point in value]
+    elif ":" in str(value):
+        parts = [float(part) for part in str(value).split(":")]
+        if len(parts) != 3 or parts[2] <= 0 or parts[1] < parts[0]:
+            raise ValueError(f"Invalid range '{value}', expected start:stop:step with step > 0")
+        count = int(np.floor((parts[1] - parts[0]) / parts[2] + 1e-9)) + 1
+        if count > MAX_AXIS_POINTS:
+            raise ValueError(f"Range '{value}' has more than {MAX_AXIS_POINTS} points")
+        points = list(np.round(parts[0] + parts[2] * np.arange(count), 10))
+    else:
+        points = [float(point) for point in str(value).split(",") if point.strip()]
+
+    if not points or len(points) > MAX_AXIS_POINTS:
+        raise ValueError(f"An axis needs between 1 and {MAX_AXIS_POINTS} points")
+    if not all(np.isfinite(points)):
+        raise ValueError("Axis points must be finite numbers")
+    return points
+
+
+def around(center: float) -> list:
+    """Default axis: the template's sensitivity step on either side of `center`"""
+    offsets = np.arange(-DEFAULT_STEPS_EACH_SIDE, DEFAULT_STEPS_EACH_SIDE + 1) * DEFAULT_STEP
+    return list(np.round(center + offsets, 10))
+
+
+def _number(address: str, value) -> float:
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{address} evaluated to {value!r}, not a number")
+    return float(value)
+
+
+class SensitivityModel:
+    """
+    The template's DCF (DCF sheet rows 10-31 and the equity bridge) as array math, so a whole
+    discount rate x terminal growth x EBIT margin grid is one NumPy evaluation.
+    """
+
+    def __init__(self, workbook):
+        sheet = workbook[DCF_SHEET]
+
+        # The DCF columns do not map one-to-one onto IS columns, follow the EBIT links instead
+        self.revenue_cells = []
+        for column in DCF_COLUMNS:
+            link = sheet[f"{column}{DCF_ROWS['ebit']}"].value
+            match = EBIT_LINK_RE.match(str(link))
+            if match is None:
+                raise ValueError(f"DCF!{column}{DCF_ROWS['ebit']} is not a link to IS EBIT: {link!r}")
+            self.revenue_cells.append(f"IS!{match.group(1)}{IS_REVENUE_ROW}")
+
+        self.row_cells = {
+            name: [f"{DCF_SHEET}!{column}{row}" for column in DCF_COLUMNS]
+            for name, row in DCF_ROWS.items()
+        }
+        self.addresses = (
+            [address for cells in self.row_cells.values() for address in cells]
+            + self.revenue_cells
+            + list(SCALAR_CELLS.values())
+        )
+
+    def base(self, values: dict) -> dict:
+        """Turns the engine's {"Sheet!A1": value} for `addresses` into the model's vectors and scalars"""
+        base = {
+            name: np.array([_number(address, values.get(address)) for address in cells])
+            for name, cells in self.row_cells.items()
+        }
+        base["revenue"] = np.array([_number(address, values.get(address)) for address in self.revenue_cells])
+        for name, address in SCALAR_CELLS.items():
+            base[name] = _number(address, values.get(address))
+        return base
+
+    def grid(self, base: dict, discount_rates, growth_rates, margin_changes) -> dict:
+        """
+        Evaluates the DCF over every combination. Results are indexed
+        [margin change][terminal growth][discount rate], NaN where the discount rate does not
+        exceed the growth rate.
+        """
+        # Axes: margin (M, 1, 1), growth (1, G, 1), discount (1, 1, R), forecast years last
+        margin = np.asarray(margin_changes, dtype=float)[:, None, None, None]
+        growth = np.asarray(growth_rates, dtype=float)[None, :, None]
+        discount = np.asarray(discount_rates, dtype=float)[None, None, :]
+
+        # EBIT moves by the margin change times revenue, tax keeps each year's effective rate
+        ebit = base["ebit"] + margin * base["revenue"]
+        tax_rate = np.divide(base["tax"], base["ebit"], out=np.zeros_like(base["tax"]), where=base["ebit"] != 0)
+        nopat = ebit * (1 + tax_rate)
+        fcff = nopat + base["depreciation"] + base["capex"] + base["nwc_change"]
+
+        # Present value of the explicit years, as rows 19-25 compute it
+        period = base["period"]
+        factors = (1 + discount[..., None]) ** -period
+        explicit = (fcff * period * factors).sum(axis=-1)
+
+        # Terminal year FCFF (row 16 column R): depreciation and capex cancel out
+        terminal_fcff = nopat[..., -1] * (1 + growth) - base["terminal_nwc"] * growth
+        spread = discount - growth
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terminal_value = np.where(spread > 0, terminal_fcff / spread, np.nan) * factors[..., -1]
+
+        enterprise_value = explicit + terminal_value
+        equity_value = enterprise_value + base["cash"] + base["net_debt"]
+        return {"enterprise_value": enterprise_value, "equity_value": equity_value}
+
+
+def to_json_matrix(values: np.ndarray) -> list:
+    """Nested lists with NaN as None, so the grid serializes to valid JSON"""
+    return np.where(np.isnan(values), None, np.round(values, 4)).tolist()
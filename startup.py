@@ -0,0 +1,68 @@
+import threading
+
+
+# Startup modes: "eager" builds all worker state at import, "lazy" builds each piece on first
+# use, "preload" builds the CPU-heavy state once in the gunicorn master before it forks
+STARTUP_MODES = ("eager", "lazy", "preload")
+
+
+class LazyResource:
+    """
+    Stand-in for a module-level object that is built on first attribute access. The factory
+    runs once, under a lock, and holds any imports the object needs so they are deferred too.
+    """
+
+    def __init__(self, name: str, factory):
+        self._lazy_name = name
+        self._lazy_factory = factory
+        self._lazy_lock = threading.Lock()
+        self._lazy_value = None
+        self._lazy_loaded = False
+
+    def load(self):
+        """Builds the object if needed and returns it"""
+        if not self._lazy_loaded:
+            with self._lazy_lock:
+                if not self._lazy_loaded:
+                    self._lazy_value = self._lazy_factory()
+                    self._lazy_loaded = True
+        return self._lazy_value
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._lazy_loaded
+
+    @property
+    def resource_name(self) -> str:
+        return self._lazy_name
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.load(), attribute)
+
+    def __contains__(self, item) -> bool:
+        return item in self.load()
+
+
+def memory_usage() -> dict:
+    """
+    Memory of this process in MB. On Linux `pss_mb` splits shared pages between the processes
+    sharing them and `private_mb` is what this process alone holds, which shows how much of a
+    preloaded master a worker still shares.
+    """
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        import resource
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        return {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+    return {
+        "rss_mb": round(fields.get("Rss", 0), 1),
+        "pss_mb": round(fields.get("Pss", 0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0), 1),
+    }
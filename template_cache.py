@@ -0,0 +1,138 @@
+import os
+import io
+import hashlib
+import pickle
+import threading
+import zipfile
+from contextlib import contextmanager
+from openpyxl import load_workbook
+from metrics import stage
+
+
+# Parsed-template cache shared by all requests handled in this worker
+class TemplateCache:
+    """Parses each Excel template once and hands out isolated copies per request"""
+
+    def __init__(self, max_copies: int = 2):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Bounds how many full workbook copies can be alive at the same time
+        self._copies = threading.BoundedSemaphore(max_copies)
+
+    def register(self, path: str, **load_kwargs):
+        """Parses `path` now and keeps it cached for later checkouts"""
+        with self._lock:
+            self._entries[path] = self._parse(path, load_kwargs)
+
+    def _parse(self, path: str, load_kwargs: dict) -> dict:
+        with open(path, "rb") as file:
+            raw = file.read()
+
+        workbook = load_workbook(io.BytesIO(raw), **load_kwargs)
+
+        # The VBA archive holds a lock and cannot be pickled, every copy gets its own
+        workbook.vba_archive = None
+        snapshot = pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL)
+        workbook.close()
+
+        print(f"Template '{os.path.basename(path)}' parsed and cached ({len(snapshot)} bytes)")
+        return {
+            "mtime": os.path.getmtime(path),
+            "sha256": hashlib.sha256(raw).hexdigest(),
+            "raw": raw,
+            "snapshot": snapshot,
+            "keep_vba": load_kwargs.get("keep_vba", False),
+            "load_kwargs": load_kwargs,
+        }
+
+    def _current(self, path: str) -> dict:
+        """Returns the cache entry for `path`, reparsing it if the file changed on disk"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                raise KeyError(f"Template '{path}' is not registered")
+
+            mtime = os.path.getmtime(path)
+            if mtime != entry["mtime"]:
+                with open(path, "rb") as file:
+                    digest = hashlib.sha256(file.read()).hexdigest()
+
+                if digest != entry["sha256"]:
+                    entry = self._parse(path, entry["load_kwargs"])
+                    self._entries[path] = entry
+                else:
+                    entry["mtime"] = mtime
+
+            return entry
+
+    def export(self) -> dict:
+        """Returns the parsed entries, picklable, so another process can adopt them without reparsing"""
+        with self._lock:
+            return {path: dict(entry) for path, entry in self._entries.items()}
+
+    def adopt(self, entries: dict):
+        """Takes over entries produced by `export` in another process"""
+        with self._lock:
+            self._entries.update(entries)
+
+    def raw(self, path: str) -> bytes:
+        """Returns the file bytes of the template currently cached for `path`"""
+        return self._current(path)["raw"]
+
+    def formula_free(self, path: str) -> bytes:
+        """
+        Returns the template currently cached for `path` with every formula replaced by its
+        cached value, what the data_only checkouts hold. Built on first use per template.
+        """
+        from xlsx_patch import strip_formulas
+
+        entry = self._current(path)
+        if entry.get("formula_free") is None:
+            # Concurrent first calls may both build it, the results are identical
+            output = io.BytesIO()
+            strip_formulas(io.BytesIO(entry["raw"]), output)
+            entry["formula_free"] = output.getvalue()
+        return entry["formula_free"]
+
+    def prepared(self, path: str, name: str, prepare) -> bytes:
+        """
+        Returns the snapshot of the template currently cached for `path` after `prepare(workbook)`
+        ran on it, kept under `name` and without the VBA archive. Built on first use per template.
+        """
+        entry = self._current(path)
+        variants = entry.setdefault("prepared", {})
+        if variants.get(name) is None:
+            # A fresh parse, an unpickled copy cannot be pickled again (its dimension holders lose their worksheet).
+            # Concurrent first calls may both build it, the results are identical
+            workbook = load_workbook(io.BytesIO(entry["raw"]), **entry["load_kwargs"])
+            try:
+                prepare(workbook)
+                if workbook.vba_archive is not None:
+                    workbook.vba_archive.close()
+                    workbook.vba_archive = None
+                variants[name] = pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                workbook.close()
+        return variants[name]
+
+    def template_hash(self, path: str) -> str:
+        """Returns the sha256 of the template currently cached for `path`"""
+        return self._current(path)["sha256"]
+
+    @contextmanager
+    def checkout(self, path: str, name: str = None, prepare=None):
+        """Yields a private copy of the cached workbook for `path`, or of its `prepared` variant `name`"""
+        entry = self._current(path)
+        snapshot = entry["snapshot"] if name is None else self.prepared(path, name, prepare)
+
+        with self._copies:
+            with stage("load_workbook"):
+                workbook = pickle.loads(snapshot)
+                if entry["keep_vba"] and name is None:
+                    workbook.vba_archive = zipfile.ZipFile(io.BytesIO(entry["raw"]), "r")
+            try:
+                yield workbook
+            finally:
+                workbook.close()
+                if workbook.vba_archive is not None:
+                    workbook.vba_archive.close()
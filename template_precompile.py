@@ -0,0 +1,404 @@
+import io
+import os
+import re
+import sys
+import time
+import pickle
+import zipfile
+import argparse
+from copy import copy
+from openpyxl import load_workbook
+from xlsx_patch import (
+    CALC_CHAIN_PART, CONTENT_TYPES_PART, WORKBOOK_RELS_PART, ANY_CELL_RE, VALUE_RE, TYPE_RE, STYLE_RE,
+    WORKSHEET_PART_RE, _drop_calc_chain, _resolve_sheet_part,
+)
+
+
+# Offline precompiler deriving a lean runtime template from the authored workbook. Formulas,
+# values, resolved styles and pictures stay the same; what only Excel or its add-ins use goes.
+#
+#   python template_precompile.py dynamic_excel.xlsx     writes dynamic_excel.runtime.xlsx
+#   python template_precompile.py hist_fin.xlsx          writes hist_fin.runtime.xlsx
+#
+# index.py serves them when TEMPLATE_PATH / TEMPLATE_PATH_HIST point at them.
+
+SHARED_STRINGS_PART = "xl/sharedStrings.xml"
+STYLES_PART = "xl/styles.xml"
+
+# Sheets whose cells nothing in the model reads: the Capital IQ add-in keeps its query cache in
+# _CIQHiddenCacheSheet and refills it when the workbook is opened with the add-in
+STRIP_SHEETS = ("_CIQHiddenCacheSheet",)
+
+SHEET_DATA_RE = re.compile(r'<sheetData\b[^>]*?(?:/>|>.*?</sheetData>)', re.S)
+DIMENSION_RE = re.compile(r'<dimension\b[^>]*?/>')
+SHARED_STRING_RE = re.compile(r'<si\b[^>]*?(?:/>|>.*?</si>)', re.S)
+ROW_TAG_RE = re.compile(r'<row\b[^>]*>')
+COL_TAG_RE = re.compile(r'<col\b[^>]*>')
+COL_STYLE_RE = re.compile(r'\sstyle="([0-9]+)"')
+STYLE_ID_RE = {kind: re.compile(rf'\s{kind}Id="([0-9]+)"') for kind in ("font", "fill", "border")}
+
+
+def _list_section(xml: str, section: str, item: str) -> tuple:
+    """Returns (start, end, items) of a <section count=""> list such as <fonts>, None if missing"""
+    match = re.search(rf'<{section}\b[^>]*?(?:/>|>(.*?)</{section}>)', xml, re.S)
+    if match is None or match.group(1) is None:
+        return None
+    items = [found.group() for found in re.finditer(rf'<{item}\b[^>]*?(?:/>|>.*?</{item}>)', match.group(1), re.S)]
+    return match.start(), match.end(), items
+
+
+def _replace_list(xml: str, section: str, item: str, items: list) -> str:
+    start, end, _ = _list_section(xml, section, item)
+    opening = re.match(rf'<{section}\b[^>]*?>', xml[start:end]).group()
+    opening = re.sub(r'\scount="[0-9]+"', f' count="{len(items)}"', opening)
+    return xml[:start] + opening + "".join(items) + f"</{section}>" + xml[end:]
+
+
+def _dedupe(items: list, keep=None) -> tuple:
+    """Returns the distinct items, first occurrence wins, and old index -> new index"""
+    positions = {}
+    kept = []
+    remap = {}
+    for index, value in enumerate(items):
+        if keep is not None and index not in keep:
+            continue
+        if value not in positions:
+            positions[value] = len(kept)
+            kept.append(value)
+        remap[index] = positions[value]
+    return kept, remap
+
+
+def strip_sheet_data(sheet_xml: str) -> str:
+    """Empties a worksheet, keeping the part (and so every sheet index) in place"""
+    sheet_xml = SHEET_DATA_RE.sub("<sheetData/>", sheet_xml, count=1)
+    return DIMENSION_RE.sub('<dimension ref="A1"/>', sheet_xml, count=1)
+
+
+def compact_shared_strings(sst_xml: str, sheets: dict) -> tuple:
+    """
+    Drops strings no cell uses and merges duplicates, renumbering the t="s" cells of `sheets`
+    ({part name: xml}). Returns the new table XML, the rewritten sheets and the string counts.
+    """
+    items = SHARED_STRING_RE.findall(sst_xml)
+    used = set()
+    references = 0
+    for sheet_xml in sheets.values():
+        for match in ANY_CELL_RE.finditer(sheet_xml):
+            if match.group(3) is not None and _cell_type(match.group(1)) == "s":
+                value = VALUE_RE.search(match.group(3))
+                if value is not None:
+                    used.add(int(value.group(1)))
+                    references += 1
+
+    kept, remap = _dedupe(items, keep=used)
+
+    def renumber(match):
+        if match.group(3) is None or _cell_type(match.group(1)) != "s":
+            return match.group(0)
+        body = VALUE_RE.sub(lambda value: f"<v>{remap[int(value.group(1))]}</v>", match.group(3), count=1)
+        return f"<c{match.group(1)}>{body}</c>"
+
+    sheets = {name: ANY_CELL_RE.sub(renumber, sheet_xml) for name, sheet_xml in sheets.items()}
+
+    # Whatever follows the last string (an extLst) is kept
+    strings = list(SHARED_STRING_RE.finditer(sst_xml))
+    header, tail = sst_xml[:strings[0].start()], sst_xml[strings[-1].end():]
+    header = re.sub(r'\scount="[0-9]+"', f' count="{references}"', header, count=1)
+    header = re.sub(r'\suniqueCount="[0-9]+"', f' uniqueCount="{len(kept)}"', header, count=1)
+    return header + "".join(kept) + tail, sheets, (len(items), len(kept))
+
+
+def _cell_type(attrs: str) -> str:
+    cell_type = TYPE_RE.search(attrs)
+    return cell_type.group(1) if cell_type else "n"
+
+
+def dedupe_styles(styles_xml: str, sheets: dict) -> tuple:
+    """
+    Merges identical fonts, fills and borders, then identical or unused cell formats, and
+    renumbers the s= and style= references of `sheets`. Returns the new styles XML, the
+    rewritten sheets and the cell format counts.
+    """
+    # Fonts, fills and borders are only referenced by id from the cell and cell style formats
+    for section, item in (("fonts", "font"), ("fills", "fill"), ("borders", "border")):
+        listed = _list_section(styles_xml, section, item)
+        if listed is None:
+            continue
+        kept, remap = _dedupe(listed[2])
+        styles_xml = _replace_list(styles_xml, section, item, kept)
+        pattern = STYLE_ID_RE[item]
+        for formats, xf in (("cellStyleXfs", "xf"), ("cellXfs", "xf")):
+            formats_list = _list_section(styles_xml, formats, xf)
+            if formats_list is not None:
+                renumbered = [pattern.sub(lambda m: f' {item}Id="{remap[int(m.group(1))]}"', value) for value in formats_list[2]]
+                styles_xml = _replace_list(styles_xml, formats, xf, renumbered)
+
+    used = {0}
+    for sheet_xml in sheets.values():
+        for tag_re, style_re in ((ANY_CELL_RE, STYLE_RE), (ROW_TAG_RE, STYLE_RE), (COL_TAG_RE, COL_STYLE_RE)):
+            for tag in tag_re.finditer(sheet_xml):
+                attrs = tag.group(1) if tag_re is ANY_CELL_RE else tag.group()
+                style = style_re.search(attrs)
+                if style is not None:
+                    used.add(int(style.group(1)))
+
+    cell_formats = _list_section(styles_xml, "cellXfs", "xf")[2]
+    kept, remap = _dedupe(cell_formats, keep=used)
+    styles_xml = _replace_list(styles_xml, "cellXfs", "xf", kept)
+
+    def restyle(attrs: str, style_re, attribute: str) -> str:
+        return style_re.sub(lambda m: f' {attribute}="{remap[int(m.group(1))]}"', attrs, count=1)
+
+    def restyle_cell(match):
+        attrs = restyle(match.group(1), STYLE_RE, "s")
+        return f"<c{attrs}{match.group(2)}"
+
+    rewritten = {}
+    for name, sheet_xml in sheets.items():
+        sheet_xml = ANY_CELL_RE.sub(restyle_cell, sheet_xml)
+        sheet_xml = ROW_TAG_RE.sub(lambda m: restyle(m.group(), STYLE_RE, "s"), sheet_xml)
+        sheet_xml = COL_TAG_RE.sub(lambda m: restyle(m.group(), COL_STYLE_RE, "style"), sheet_xml)
+        rewritten[name] = sheet_xml
+    return styles_xml, rewritten, (len(cell_formats), len(kept))
+
+
+def recompress_png(data: bytes) -> bytes:
+    """Losslessly re-encodes a PNG, returns `data` unless the result is smaller with identical pixels"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        options = {"optimize": True}
+        for key in ("dpi", "gamma", "transparency", "icc_profile"):
+            if key in image.info:
+                options[key] = image.info[key]
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", **options)
+
+    candidate = buffer.getvalue()
+    if len(candidate) >= len(data):
+        return data
+    with Image.open(io.BytesIO(data)) as original, Image.open(io.BytesIO(candidate)) as optimized:
+        if original.mode != optimized.mode or original.tobytes() != optimized.tobytes():
+            return data
+    return candidate
+
+
+def precompile_template(source: str, output: str, strip_sheets=STRIP_SHEETS, verify: bool = True) -> dict:
+    """
+    Writes the runtime template for `source` to `output`: empties `strip_sheets`, drops the
+    calculation chain, compacts shared strings, merges duplicate styles and re-encodes PNGs.
+    Returns the per-part sizes and what changed. With `verify`, `output` is only replaced when
+    verify_template finds no differences, which the report then lists under "differences".
+    """
+    with zipfile.ZipFile(source) as reader:
+        names = reader.namelist()
+
+        def read_member(name: str) -> bytes:
+            return reader.read(name)
+
+        replaced = {}
+        report = {"stripped_sheets": [], "parts": {}}
+
+        sheets = {name: reader.read(name).decode("utf-8") for name in names if WORKSHEET_PART_RE.match(name)}
+        for sheet_name in strip_sheets:
+            try:
+                part = _resolve_sheet_part(read_member, sheet_name)
+            except KeyError:
+                continue
+            sheets[part] = strip_sheet_data(sheets[part])
+            report["stripped_sheets"].append(sheet_name)
+
+        if SHARED_STRINGS_PART in names:
+            sst_xml, sheets, counts = compact_shared_strings(reader.read(SHARED_STRINGS_PART).decode("utf-8"), sheets)
+            replaced[SHARED_STRINGS_PART] = sst_xml.encode("utf-8")
+            report["shared_strings"] = {"before": counts[0], "after": counts[1]}
+
+        if STYLES_PART in names:
+            styles_xml, sheets, counts = dedupe_styles(reader.read(STYLES_PART).decode("utf-8"), sheets)
+            replaced[STYLES_PART] = styles_xml.encode("utf-8")
+            report["cell_formats"] = {"before": counts[0], "after": counts[1]}
+
+        for name, sheet_xml in sheets.items():
+            replaced[name] = sheet_xml.encode("utf-8")
+
+        # Excel rebuilds the chain on load and openpyxl never reads it
+        has_calc_chain = CALC_CHAIN_PART in names
+        if has_calc_chain:
+            content_types_xml, rels_xml = _drop_calc_chain(
+                reader.read(CONTENT_TYPES_PART).decode("utf-8"),
+                reader.read(WORKBOOK_RELS_PART).decode("utf-8"),
+            )
+            replaced[CONTENT_TYPES_PART] = content_types_xml.encode("utf-8")
+            replaced[WORKBOOK_RELS_PART] = rels_xml.encode("utf-8")
+
+        for name in names:
+            if name.startswith("xl/media/") and name.lower().endswith(".png"):
+                replaced[name] = recompress_png(reader.read(name))
+
+        partial_path = f"{output}.part"
+        # The previous runtime template stays in place until the new one is written and verified
+        try:
+            with zipfile.ZipFile(partial_path, "w") as writer:
+                for info in reader.infolist():
+                    if has_calc_chain and info.filename == CALC_CHAIN_PART:
+                        report["parts"][info.filename] = (info.file_size, 0)
+                        continue
+
+                    data = replaced.get(info.filename)
+                    if data is None:
+                        data = reader.read(info)
+                    target_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                    target_info.compress_type = info.compress_type
+                    target_info.external_attr = info.external_attr
+                    writer.writestr(target_info, data, compresslevel=9 if info.compress_type == zipfile.ZIP_DEFLATED else None)
+                    report["parts"][info.filename] = (info.file_size, len(data))
+
+            if verify:
+                with open(partial_path, "rb") as file:
+                    report["differences"] = verify_template(source, file, strip_sheets)
+            if not report.get("differences"):
+                os.replace(partial_path, output)
+                report["size"] = (os.path.getsize(source), os.path.getsize(output))
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    return report
+
+
+def _cell_snapshot(cell) -> tuple:
+    # Copies, the style proxies openpyxl hands out do not compare by value; neither do array
+    # and data table formulas
+    value = cell.value
+    if hasattr(value, "ref"):
+        value = (type(value).__name__, value.ref, getattr(value, "text", None), dict(value))
+    return (
+        value, cell.number_format, copy(cell.font), copy(cell.fill), copy(cell.border),
+        copy(cell.alignment), copy(cell.protection),
+    )
+
+
+def verify_template(source: str, output: str, skip_sheets=STRIP_SHEETS) -> list:
+    """
+    Compares every cell of every kept sheet of the two templates (paths or binary files), formulas
+    and constants with their resolved styles, and the pictures of each sheet. Returns the differences found.
+    """
+    differences = []
+    original = load_workbook(source, read_only=False, keep_links=True)
+    compiled = load_workbook(output, read_only=False, keep_links=True)
+    try:
+        if original.sheetnames != compiled.sheetnames:
+            return [f"Sheet list changed: {original.sheetnames} -> {compiled.sheetnames}"]
+
+        for sheet_name in original.sheetnames:
+            if sheet_name in skip_sheets:
+                continue
+            before, after = original[sheet_name], compiled[sheet_name]
+            coordinates = set(before._cells) | set(after._cells)
+            for row, column in sorted(coordinates):
+                if _cell_snapshot(before.cell(row, column)) != _cell_snapshot(after.cell(row, column)):
+                    differences.append(f"{sheet_name}!{before.cell(row, column).coordinate} changed")
+                    if len(differences) >= 20:
+                        return differences
+
+            images_before = [_image_pixels(image) for image in before._images]
+            images_after = [_image_pixels(image) for image in after._images]
+            if images_before != images_after:
+                differences.append(f"{sheet_name} pictures changed")
+
+        if original.defined_names.keys() != compiled.defined_names.keys():
+            differences.append("Defined names changed")
+        return differences
+
+    finally:
+        original.close()
+        compiled.close()
+
+
+def _image_pixels(image) -> tuple:
+    from PIL import Image
+
+    data = image._data()
+    try:
+        with Image.open(io.BytesIO(data)) as picture:
+            return picture.mode, picture.size, picture.tobytes()
+    except Exception:
+        # Vector formats are copied untouched, compare their bytes
+        return data
+
+
+def measure_load(path: str, repeat: int = 3) -> dict:
+    """Best of `repeat` timings of what TemplateCache does per template and per checkout"""
+    with open(path, "rb") as file:
+        raw = file.read()
+
+    parse_seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        workbook = load_workbook(io.BytesIO(raw), keep_vba=True, data_only=True)
+        parse_seconds.append(time.perf_counter() - started)
+    workbook.vba_archive = None
+    snapshot = pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL)
+    workbook.close()
+
+    checkout_seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pickle.loads(snapshot)
+        checkout_seconds.append(time.perf_counter() - started)
+
+    return {
+        "file_bytes": len(raw),
+        "parse_seconds": min(parse_seconds),
+        "snapshot_bytes": len(snapshot),
+        "checkout_seconds": min(checkout_seconds),
+    }
+
+
+def _print_report(report: dict, before: dict, after: dict):
+    print(f"Stripped sheets: {', '.join(report['stripped_sheets']) or 'none'}")
+    if "shared_strings" in report:
+        print(f"Shared strings: {report['shared_strings']['before']} -> {report['shared_strings']['after']}")
+    if "cell_formats" in report:
+        print(f"Cell formats: {report['cell_formats']['before']} -> {report['cell_formats']['after']}")
+
+    changed = [(name, sizes) for name, sizes in report["parts"].items() if sizes[0] != sizes[1]]
+    changed.sort(key=lambda entry: entry[1][1] - entry[1][0])
+    for name, (size_before, size_after) in changed[:10]:
+        print(f"  {name:<40} {size_before:>10} -> {size_after:>10} bytes")
+
+    print(f"{'':<24}{'authored':>14}{'runtime':>14}{'change':>10}")
+    for key in ("file_bytes", "parse_seconds", "snapshot_bytes", "checkout_seconds"):
+        change = after[key] / before[key] - 1
+        if key.endswith("_seconds"):
+            print(f"{key:<24}{before[key]:>13.3f}s{after[key]:>13.3f}s{change:>+10.0%}")
+        else:
+            print(f"{key:<24}{before[key]:>14}{after[key]:>14}{change:>+10.0%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive a lean runtime template from an authored Excel template")
+    parser.add_argument("source", help="Authored template, e.g. dynamic_excel.xlsx")
+    parser.add_argument("-o", "--output", help="Runtime template, defaults to <source>.runtime.xlsx")
+    parser.add_argument("--strip-sheet", action="append", dest="strip_sheets",
+                        help=f"Sheet to empty, repeatable (default: {', '.join(STRIP_SHEETS)})")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the cell by cell comparison")
+    parser.add_argument("--repeat", type=int, default=3, help="Load timings are the best of this many runs")
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.splitext(args.source)[0]}.runtime.xlsx"
+    strip_sheets = tuple(args.strip_sheets or STRIP_SHEETS)
+
+    report = precompile_template(args.source, output, strip_sheets, verify=not args.no_verify)
+
+    if report.get("differences"):
+        for difference in report["differences"]:
+            print(f"MISMATCH {difference}")
+        print(f"The runtime template differs from the authored one, {output} was left as it was")
+        sys.exit(1)
+    if not args.no_verify:
+        print("Verified: formulas, values, styles and pictures of every kept sheet are unchanged")
+
+    _print_report(report, measure_load(args.source, args.repeat), measure_load(output, args.repeat))
+    print(f"Wrote {output}")
@@ -0,0 +1,201 @@
+import io
+import re
+import html
+import zipfile
+from openpyxl.utils.cell import range_boundaries, get_column_letter
+from xlsx_patch import WORKBOOK_PART, CELL_RE, _resolve_sheet_part
+
+
+# Excel sheet limits, anything outside is a typo in the registry
+MAX_ROW = 1048576
+MAX_COLUMN = 16384
+
+SHEET_NAME_RE = re.compile(r'<sheet\b[^>]*?\sname="([^"]*)"')
+DIMENSION_RE = re.compile(r'<dimension\s+ref="([^"]*)"')
+FORMULA_RE = re.compile(r'<f\b[^>]*?(?:/>|>(.*?)</f>)', re.S)
+# A formula that only links another cell or name (=Form!N15) is an input placeholder the fill may replace
+LINK_FORMULA_RE = re.compile(r"^(?:(?:'[^']+'|[\w.]+)!)?\$?[A-Za-z_][\w.]*?\$?[0-9]*$")
+
+
+def sheet_names(raw: bytes) -> list:
+    """Reads the sheet names straight from the workbook part, without parsing the workbook"""
+    with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+        workbook_xml = archive.read(WORKBOOK_PART).decode("utf-8")
+    return [html.unescape(name) for name in SHEET_NAME_RE.findall(workbook_xml)]
+
+
+class MappedField:
+    """
+    One `answers` field compiled to a block of numeric cell coordinates. A single cell takes
+    a scalar, a row or column takes a list (or `name_0`, `name_1`, ... keys) and a block takes
+    a list of rows (or `name_0_0`, `name_0_1`, ... keys).
+    """
+
+    def __init__(self, name: str, cell_range: str):
+        min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+        if not (1 <= min_row <= max_row <= MAX_ROW and 1 <= min_col <= max_col <= MAX_COLUMN):
+            raise ValueError(f"Field '{name}' maps to an invalid range '{cell_range}'")
+
+        self.name = name
+        self.min_row = min_row
+        self.min_col = min_col
+        self.rows = max_row - min_row + 1
+        self.cols = max_col - min_col + 1
+
+        # Flattened answers keys, one list per row
+        if self.rows == 1 and self.cols == 1:
+            self.keys = [[name]]
+        elif self.rows == 1 or self.cols == 1:
+            self.keys = [[f"{name}_{row + col}" for col in range(self.cols)] for row in range(self.rows)]
+        else:
+            self.keys = [[f"{name}_{row}_{col}" for col in range(self.cols)] for row in range(self.rows)]
+
+    @property
+    def max_row(self) -> int:
+        return self.min_row + self.rows - 1
+
+    @property
+    def max_col(self) -> int:
+        return self.min_col + self.cols - 1
+
+    def cells(self):
+        """Yields (flattened key, row, column) for every cell of the field"""
+        for row_offset, keys in enumerate(self.keys):
+            for col_offset, key in enumerate(keys):
+                yield key, self.min_row + row_offset, self.min_col + col_offset
+
+    def block(self, data: dict) -> list:
+        """Returns the field's values from `data` as a list of rows, nested or flattened answers alike"""
+        nested = data.get(self.name)
+        if isinstance(nested, (list, tuple)) and (self.rows > 1 or self.cols > 1):
+            if self.rows == 1 or self.cols == 1:
+                items = [nested[index] if index < len(nested) else None for index in range(self.rows * self.cols)]
+                return [items] if self.rows == 1 else [[item] for item in items]
+
+            rows = []
+            for row_index in range(self.rows):
+                row = nested[row_index] if row_index < len(nested) and isinstance(nested[row_index], (list, tuple)) else ()
+                rows.append([row[col_index] if col_index < len(row) else None for col_index in range(self.cols)])
+            return rows
+
+        return [[data.get(key) for key in keys] for keys in self.keys]
+
+
+class CompiledTemplate:
+    """A template sheet and its fields, compiled to numeric coordinates once at startup"""
+
+    def __init__(self, name: str, path: str, sheet_name: str, fields: dict, overrides=()):
+        self.name = name
+        self.path = path
+        self.sheet_name = sheet_name
+        self.fields = [MappedField(field, cell_range) for field, cell_range in fields.items()]
+        # Fields allowed to replace a computed formula of the template
+        self.overrides = set(overrides)
+
+        # Flattened key -> (row, column) and A1 reference, in registry order
+        self.cells = {}
+        self.refs = {}
+        owners = {}
+        for field in self.fields:
+            for key, row, column in field.cells():
+                if (row, column) in owners:
+                    raise ValueError(
+                        f"Template '{name}': fields '{owners[(row, column)]}' and '{field.name}' "
+                        f"both map to {get_column_letter(column)}{row}"
+                    )
+                owners[(row, column)] = field.name
+                self.cells[key] = (row, column)
+                self.refs[key] = f"{get_column_letter(column)}{row}"
+
+    @property
+    def answer_fields(self) -> list:
+        """Every answers key the mapping can read, field names (nested form) and flattened keys"""
+        return [field.name for field in self.fields] + list(self.cells)
+
+    def flat_values(self, data: dict) -> dict:
+        """Returns {flattened key: value} for every mapped cell, the canonical form used for cache keys"""
+        values = {}
+        for field in self.fields:
+            for keys, row_values in zip(field.keys, field.block(data)):
+                values.update(zip(keys, row_values))
+        return values
+
+    def cell_values(self, data: dict) -> dict:
+        """Returns {A1 reference: value} for the mapped cells, as the zip patcher takes them"""
+        return {self.refs[key]: value for key, value in self.flat_values(data).items()}
+
+    def write(self, worksheet, data: dict):
+        """Writes `data` into `worksheet` block by block at the compiled coordinates, skipping missing answers"""
+        # openpyxl has no bulk write, worksheet.cell() is its cheapest per-cell path (iter_rows over each range is slower)
+        for field in self.fields:
+            for row, values in enumerate(field.block(data), field.min_row):
+                for column, value in enumerate(values, field.min_col):
+                    if value is not None:
+                        worksheet.cell(row=row, column=column, value=value)
+
+    def validate(self, raw: bytes):
+        """
+        Checks the template file `raw` has the mapped sheet, that every field lies inside the sheet's
+        dimension and that none replaces a computed formula unless listed in `overrides`
+        """
+        if self.sheet_name not in sheet_names(raw):
+            raise ValueError(f"Template '{self.name}' is missing '{self.sheet_name}' sheet")
+
+        with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+            sheet_xml = archive.read(_resolve_sheet_part(archive.read, self.sheet_name)).decode("utf-8")
+
+        dimension = DIMENSION_RE.search(sheet_xml)
+        if dimension is not None:
+            min_col, min_row, max_col, max_row = range_boundaries(dimension.group(1))
+            for field in self.fields:
+                if not (min_row <= field.min_row and field.max_row <= max_row
+                        and min_col <= field.min_col and field.max_col <= max_col):
+                    raise ValueError(
+                        f"Template '{self.name}': field '{field.name}' lies outside "
+                        f"'{self.sheet_name}'!{dimension.group(1)}"
+                    )
+
+        owners = {
+            f"{get_column_letter(column)}{row}": field.name
+            for field in self.fields if field.name not in self.overrides
+            for _, row, column in field.cells()
+        }
+        for match in CELL_RE.finditer(sheet_xml):
+            ref = match.group(1)
+            formula = FORMULA_RE.search(match.group(4) or "") if ref in owners else None
+            if formula is not None and not LINK_FORMULA_RE.match(html.unescape(formula.group(1) or "")):
+                raise ValueError(
+                    f"Template '{self.name}': field '{owners[ref]}' would overwrite the formula "
+                    f"in '{self.sheet_name}'!{ref}"
+                )
+
+
+# Templates the generation endpoints can fill, compiled and validated at startup
+class TemplateRegistry:
+    """Declarative answers-to-range mappings for every template, keyed by template name"""
+
+    def __init__(self, template_cache):
+        self.template_cache = template_cache
+        self._templates = {}
+
+    def register(self, name: str, path: str, sheet_name: str, fields: dict, overrides=()) -> CompiledTemplate:
+        """
+        Compiles `fields` ({answers field: "A1" or "A1:B2"}) for `sheet_name` of the template at `path`,
+        `overrides` names the fields that deliberately replace a computed formula
+        """
+        template = CompiledTemplate(name, path, sheet_name, fields, overrides)
+        template.validate(self.template_cache.raw(path))
+        self._templates[name] = template
+        print(f"Template mapping '{name}' compiled: {len(template.fields)} fields, {len(template.cells)} cells")
+        return template
+
+    def get(self, name: str) -> CompiledTemplate:
+        if name not in self._templates:
+            raise KeyError(f"Unknown template '{name}'")
+        return self._templates[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def names(self) -> list:
+        return list(self._templates)
@@ -0,0 +1,57 @@
+import io
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+from bench_routes import sample_answers, fake_credentials
+from check_generation_modes import compare_workbooks
+
+
+# GENERATION_MODE "patch" must produce the same workbook as "openpyxl": every cell of every sheet,
+# for every registered template, compared by value. The same check as benchmarks/check_generation_modes.py.
+
+
+@pytest.fixture(scope="module")
+def index():
+    os.environ["RENDER"] = "1"
+    os.environ.setdefault("FIREBASE_CREDENTIALS", fake_credentials())
+    os.environ.setdefault("CONVERT_API_KEY", "test")
+    os.environ.setdefault("STARTUP_MODE", "lazy")
+
+    import index
+
+    return index
+
+
+def generate(index, template_name: str, data: dict, mode: str) -> bytes:
+    from workbook_generation import fill_template
+
+    output = io.BytesIO()
+    fill_template(index.template_cache, index.template_registry.get(template_name), data, output, mode)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("template_name", ["main", "hist"])
+@pytest.mark.parametrize("number", [1, 2])
+def test_patch_mode_matches_openpyxl_mode(index, template_name, number):
+    assert template_name in index.template_registry.names()
+    data = sample_answers(number)
+
+    differences = compare_workbooks(
+        generate(index, template_name, data, "openpyxl"),
+        generate(index, template_name, data, "patch"),
+    )
+    assert differences == []
+
+
+def test_unanswered_fields_keep_template_values(index):
+    # Every mapped field left out, both modes must still agree on the template's own values
+    data = {"clientName": "Only client name"}
+
+    differences = compare_workbooks(generate(index, "main", data, "openpyxl"), generate(index, "main", data, "patch"))
+    assert differences == []
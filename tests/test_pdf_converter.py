@@ -0,0 +1,97 @@
+import io
+import os
+import sys
+import json
+import base64
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_converter import stream_file_data
+
+
+# stream_file_data decodes the base64 "FileData" of a ConvertAPI response while it downloads,
+# so the PDF must come out the same however the response is cut into chunks.
+
+
+def response_body(files: list, escape_slashes: bool = True, separator: str = ":") -> bytes:
+    """A ConvertAPI JSON response holding `files`, with "/" escaped as "\\/" like some encoders do"""
+    body = json.dumps({
+        "ConversionCost": 1,
+        "Files": [
+            {"FileName": f"report-{index}.pdf", "FileExt": "pdf", "FileSize": len(data),
+             "FileData": base64.b64encode(data).decode("ascii")}
+            for index, data in enumerate(files)
+        ],
+    }, separators=(",", separator))
+    if escape_slashes:
+        body = body.replace("/", "\\/")
+    return body.encode("ascii")
+
+
+def random_chunks(body: bytes, rng: random.Random) -> list:
+    """Cuts `body` at random points, with empty and single-byte chunks among them"""
+    chunks = []
+    position = 0
+    while position < len(body):
+        size = rng.choice([0, 1, 1, 2, 3, 4, 5, 7, 64, rng.randint(1, 4096)])
+        chunks.append(body[position:position + size])
+        position += size
+    return chunks
+
+
+def decode(chunks) -> tuple:
+    output = io.BytesIO()
+    size = stream_file_data(iter(chunks), output)
+    return size, output.getvalue()
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_chunks_decode_the_first_file(seed):
+    rng = random.Random(seed)
+    # Lengths around multiples of 3 give every base64 padding, the bytes give plenty of "/"
+    pdf = rng.randbytes(rng.choice([0, 1, 2, 3, 4, 5, 100, rng.randint(1, 50000)]))
+    other = rng.randbytes(rng.randint(1, 100))
+    body = response_body([pdf, other], escape_slashes=rng.random() < 0.8, separator=rng.choice([":", ": ", " : "]))
+
+    assert decode(random_chunks(body, rng)) == (len(pdf), pdf)
+
+
+def test_every_split_point():
+    pdf = bytes(range(256)) * 3
+    body = response_body([pdf])
+    assert b"\\/" in body
+
+    for split in range(len(body) + 1):
+        assert decode([body[:split], body[split:]]) == (len(pdf), pdf), split
+
+
+def test_one_byte_chunks():
+    pdf = b"%PDF-1.4\n" + bytes(range(256)) * 40
+    body = response_body([pdf])
+    assert decode([body[index:index + 1] for index in range(len(body))]) == (len(pdf), pdf)
+
+
+def test_stops_reading_after_the_file_data():
+    pdf = b"%PDF-1.4 first"
+    body = response_body([pdf, b"second"])
+    end = body.index(b'"', body.index(b'"FileData"') + len(b'"FileData":"')) + 1
+
+    def chunks():
+        yield body[:end]
+        raise AssertionError("read past the file data")
+
+    assert decode(chunks()) == (len(pdf), pdf)
+
+
+def test_response_without_files():
+    with pytest.raises(ValueError, match="No files"):
+        decode([json.dumps({"ConversionCost": 1, "Files": []}).encode("ascii")])
+
+
+def test_response_ending_inside_the_file_data():
+    body = response_body([b"%PDF-1.4" * 100])
+    with pytest.raises(ValueError, match="ended before"):
+        decode([body[:body.index(b'"FileData"') + 40]])
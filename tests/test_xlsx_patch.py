@@ -0,0 +1,218 @@
+import io
+import os
+import re
+import sys
+import zipfile
+
+import pytest
+from openpyxl import load_workbook
+from openpyxl.utils.cell import column_index_from_string
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xlsx_patch import strip_formulas, patch_workbook
+
+
+# strip_formulas and patch_workbook on a hand-written workbook, so every cell flavour is explicit:
+# shared and array formulas, inline strings, cached errors, formula strings and missing cells.
+
+SHEET_PART = "xl/worksheets/sheet1.xml"
+CALC_CHAIN_PART = "xl/calcChain.xml"
+
+SHEET_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+    '<row r="1">'
+    '<c r="A1"><v>1</v></c>'
+    '<c r="B1" s="1"><f t="shared" ref="B1:B3" si="0">A1*2</f><v>2</v></c>'
+    '<c r="C1"><f t="array" ref="C1:C2">A1:A2*3</f><v>3</v></c>'
+    '<c r="D1" t="inlineStr"><is><t>hello</t></is></c>'
+    '<c r="E1" t="e"><f>1/0</f><v>#DIV/0!</v></c>'
+    '<c r="F1" t="str"><f>"a"&amp;"b"</f><v>a&amp;b</v></c>'
+    '<c r="G1"><f>Z1</f><v></v></c>'
+    '</row>'
+    '<row r="2"><c r="A2"><v>2</v></c><c r="B2"><f t="shared" si="0"/><v>4</v></c><c r="C2"><v>6</v></c></row>'
+    '<row r="3"><c r="B3"><f t="shared" si="0"/><v>6</v></c></row>'
+    '<row r="5"><c r="A5"><v>5</v></c></row>'
+    '</sheetData></worksheet>'
+)
+
+PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '<Override PartName="/xl/calcChain.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Inputs" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '<Relationship Id="rId3" Target="calcChain.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/calcChain"/>'
+        '</Relationships>'
+    ),
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="0.000"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+    SHEET_PART: SHEET_XML,
+    CALC_CHAIN_PART: (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<calcChain xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><c r="B1" i="1"/></calcChain>'
+    ),
+}
+
+
+def build_template() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in PARTS.items():
+            archive.writestr(name, xml)
+    return buffer.getvalue()
+
+
+def cell_values(data: bytes) -> dict:
+    worksheet = load_workbook(io.BytesIO(data))["Inputs"]
+    return {cell.coordinate: cell.value for row in worksheet.iter_rows() for cell in row if cell.value is not None}
+
+
+def stripped() -> bytes:
+    output = io.BytesIO()
+    strip_formulas(io.BytesIO(build_template()), output)
+    return output.getvalue()
+
+
+def patched(values: dict) -> bytes:
+    output = io.BytesIO()
+    patch_workbook(build_template(), "Inputs", values, output)
+    return output.getvalue()
+
+
+def test_strip_formulas_keeps_cached_values():
+    assert cell_values(stripped()) == {
+        "A1": 1, "B1": 2, "C1": 3, "D1": "hello", "E1": "#DIV/0!", "F1": "a&b",
+        "A2": 2, "B2": 4, "C2": 6, "B3": 6, "A5": 5,
+    }
+
+
+def test_strip_formulas_leaves_no_formula_or_calc_chain():
+    with zipfile.ZipFile(io.BytesIO(stripped())) as archive:
+        sheet_xml = archive.read(SHEET_PART).decode("utf-8")
+        assert CALC_CHAIN_PART not in archive.namelist()
+        assert "calcChain" not in archive.read("[Content_Types].xml").decode("utf-8")
+        assert "calcChain" not in archive.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+
+    assert "<f" not in sheet_xml
+    # Every shared formula cell keeps its value, the master and the cells that only point at it
+    assert '<c r="B2"><v>4</v></c>' in sheet_xml
+    # Cached errors stay errors, formula strings become inline strings
+    assert '<c r="E1" t="e"><v>#DIV/0!</v></c>' in sheet_xml
+    assert '<c r="F1" t="inlineStr">' in sheet_xml
+    # A formula without a cached value becomes an empty cell
+    assert '<c r="G1"/>' in sheet_xml
+
+
+def test_strip_formulas_keeps_styles():
+    worksheet = load_workbook(io.BytesIO(stripped()))["Inputs"]
+    assert worksheet["B1"].number_format == "0.000"
+
+
+def test_patch_workbook_copies_untouched_members():
+    with zipfile.ZipFile(io.BytesIO(patched({"A1": 10}))) as archive:
+        assert archive.testzip() is None
+        assert archive.read("xl/styles.xml").decode("utf-8") == PARTS["xl/styles.xml"]
+        assert CALC_CHAIN_PART not in archive.namelist()
+
+
+def test_patch_workbook_overwrites_inline_string_and_cached_error():
+    values = cell_values(patched({"D1": "a < b & c", "E1": 7}))
+    assert values["D1"] == "a < b & c"
+    assert values["E1"] == 7
+
+    with zipfile.ZipFile(io.BytesIO(patched({"E1": 7}))) as archive:
+        # The error type goes with the formula, the number is a plain value
+        assert '<c r="E1"><v>7</v></c>' in archive.read(SHEET_PART).decode("utf-8")
+
+
+def test_patch_workbook_keeps_shared_formula_group_valid():
+    values = cell_values(patched({"B1": 10}))
+    assert values["B1"] == 10
+    # The master held the formula of the whole group, the other cells now carry their own
+    assert values["B2"] == "=A2*2"
+    assert values["B3"] == "=A3*2"
+
+
+def test_patch_workbook_leaves_shared_formula_group_alone():
+    with zipfile.ZipFile(io.BytesIO(patched({"B2": 3}))) as archive:
+        sheet_xml = archive.read(SHEET_PART).decode("utf-8")
+    assert '<f t="shared" ref="B1:B3" si="0">A1*2</f>' in sheet_xml
+    assert '<c r="B3"><f t="shared" si="0"/><v>6</v></c>' in sheet_xml
+
+
+def test_patch_workbook_overwrites_array_formula_master():
+    values = cell_values(patched({"C1": 9}))
+    assert values["C1"] == 9
+    assert values["C2"] == 6
+
+
+def test_patch_workbook_keeps_style_of_patched_cell():
+    worksheet = load_workbook(io.BytesIO(patched({"B1": 1.5})))["Inputs"]
+    assert worksheet["B1"].value == 1.5
+    assert worksheet["B1"].number_format == "0.000"
+
+
+def test_patch_workbook_skips_none_values():
+    with zipfile.ZipFile(io.BytesIO(patched({"A1": None, "B4": None}))) as archive:
+        assert archive.read(SHEET_PART).decode("utf-8") == SHEET_XML
+
+
+@pytest.mark.parametrize("ref, value", [("H2", "new"), ("A1", 0), ("A4", 4.5), ("B7", True)])
+def test_patch_workbook_adds_cells_missing_from_template(ref, value):
+    data = patched({ref: value, "A5": 50})
+    values = cell_values(data)
+    assert values[ref] == value
+    assert values["A5"] == 50
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        sheet_xml = archive.read(SHEET_PART).decode("utf-8")
+    # Rows and the cells inside each row stay in order, Excel rejects the file otherwise
+    rows = [int(row) for row in re.findall(r'<row r="([0-9]+)"', sheet_xml)]
+    assert rows == sorted(set(rows))
+    for row_xml in re.findall(r'<row [^>]*>(.*?)</row>', sheet_xml):
+        columns = [column_index_from_string(column) for column in re.findall(r'<c r="([A-Z]+)[0-9]+"', row_xml)]
+        assert columns == sorted(set(columns))
@@ -0,0 +1,168 @@
+import os
+import datetime
+import logging
+import threading
+from openpyxl.utils.cell import range_boundaries, get_column_letter
+from openpyxl.utils.datetime import to_excel
+from pycel import ExcelCompiler
+from pycel.excelformula import UnknownFunction
+from pycel.excelwrapper import ExcelOpxWrapper
+from metrics import stage
+
+
+# Cells returned by default from the evaluation endpoint
+VALUATION_OUTPUTS = {
+    "ValSum": ["D20:F28", "D31:F38", "D41:F44", "D47:F48", "D51:F56", "D59:F64"],
+    "Key Outputs": ["H21:Q26", "H29:Q34"],
+}
+
+# Plugin module with the Excel functions pycel is missing
+EXCEL_FUNCTION_PLUGINS = ("excel_functions",)
+
+
+class TemplateWrapper(ExcelOpxWrapper):
+    """pycel workbook wrapper that reads defined names the openpyxl 3.1 way"""
+
+    @property
+    def defined_names(self):
+        if self.workbook is not None and self._defined_names is None:
+            self._defined_names = {}
+
+            for name, d_name in self.workbook.defined_names.items():
+                destinations = [
+                    (alias, worksheet) for worksheet, alias in d_name.destinations
+                    if worksheet in self.workbook]
+                if destinations:
+                    self._defined_names[str(name)] = destinations
+        return self._defined_names
+
+
+def expand_cells(sheet_name: str, ranges: list) -> list:
+    """Expands A1 ranges on `sheet_name` into individual "Sheet!A1" addresses"""
+    addresses = []
+    for cell_range in ranges:
+        min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+        for row in range(min_row, max_row + 1):
+            for column in range(min_col, max_col + 1):
+                addresses.append(f"{sheet_name}!{get_column_letter(column)}{row}")
+    return addresses
+
+
+def to_model_value(value):
+    """Converts a Firestore answer into the value a cell would hold in Excel"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+        return to_excel(value)
+    return value
+
+
+class ValuationEngine:
+    """Compiled formula graph of the valuation template with incremental recalculation"""
+
+    def __init__(self, template_path: str, input_cells: list, outputs: dict = None):
+        self.template_path = template_path
+        self.input_cells = list(input_cells)
+        self.outputs = outputs or VALUATION_OUTPUTS
+        self._lock = threading.Lock()
+        self._compiler = None
+        self._mtime = None
+        self._baseline = {}
+
+    def compile(self):
+        """Builds the dependency graph from the inputs to every output cell"""
+        logging.getLogger("pycel").setLevel(logging.CRITICAL)
+
+        mtime = os.path.getmtime(self.template_path)
+        excel = TemplateWrapper(self.template_path)
+        excel.load()
+        compiler = ExcelCompiler(excel=excel, plugins=EXCEL_FUNCTION_PLUGINS, cycles=False)
+
+        output_cells = [
+            address
+            for sheet_name, ranges in self.outputs.items()
+            for address in expand_cells(sheet_name, ranges)
+        ]
+        for address in output_cells:
+            compiler.evaluate(address)
+
+        # Mapped inputs become constants holding the template's cached values, the same
+        # thing the data_only workbook written by generate_excel_file contains
+        baseline = {}
+        for address in self.input_cells:
+            if address in compiler.cell_map:
+                baseline[address] = compiler.evaluate(address)
+        for address, value in baseline.items():
+            compiler.set_value(address, value)
+
+        self._compiler = compiler
+        self._baseline = baseline
+        self._mtime = mtime
+        print(f"Valuation graph compiled: {len(compiler.cell_map)} cells, {len(baseline)} mapped inputs")
+
+    def _ensure_compiled(self):
+        if self._compiler is None or os.path.getmtime(self.template_path) != self._mtime:
+            self.compile()
+
+    @property
+    def workbook(self):
+        """The openpyxl workbook (with formulas) the graph was compiled from"""
+        with self._lock:
+            self._ensure_compiled()
+            return self._compiler.excel.workbook
+
+    def _set_inputs(self, inputs: dict):
+        # Unanswered fields fall back to the template value so nothing leaks between projects
+        for address, baseline_value in self._baseline.items():
+            value = inputs.get(address)
+            self._compiler.set_value(address, baseline_value if value is None else to_model_value(value))
+
+    def _evaluate(self, address: str):
+        """
+        Evaluates one cell, the caller holds the lock. Broken references come back as "#REF!" and
+        functions the engine lacks as "#NAME?", any other evaluation failure is raised.
+        """
+        try:
+            return self._compiler.evaluate(address)
+        except UnknownFunction as e:
+            print(f"Could not evaluate {address}: {type(e).__name__}: {str(e).strip()}")
+            return "#NAME?"
+        except NotImplementedError as e:
+            # pycel cannot parse references Excel already broke, e.g. Inputs!#REF!
+            if "#REF!" not in str(e):
+                raise
+            print(f"Could not evaluate {address}: {type(e).__name__}: {e}")
+            return "#REF!"
+
+    def evaluate(self, inputs: dict, extra_cells: list = ()) -> dict:
+        """
+        Sets `inputs` ({"Inputs!E19": value}) and returns the output cells grouped by sheet.
+        Only cells downstream of inputs whose value changed since the last call are recalculated.
+        Errors are mapped like values() does.
+        """
+        with stage("evaluate"), self._lock:
+            self._ensure_compiled()
+            self._set_inputs(inputs)
+
+            results = {}
+            for sheet_name, ranges in self.outputs.items():
+                for address in expand_cells(sheet_name, ranges):
+                    results.setdefault(sheet_name, {})[address.split("!", 1)[1]] = self._evaluate(address)
+
+            for address in extra_cells:
+                sheet_name, cell = address.rsplit("!", 1)
+                results.setdefault(sheet_name.strip("'"), {})[cell] = self._evaluate(address)
+
+            return results
+
+    def values(self, inputs: dict, addresses: list) -> dict:
+        """
+        Sets `inputs` and returns {"Sheet!A1": value} for `addresses`.
+        Broken references come back as "#REF!" and functions the engine lacks as "#NAME?",
+        any other evaluation failure is raised.
+        """
+        with stage("evaluate"), self._lock:
+            self._ensure_compiled()
+            self._set_inputs(inputs)
+
+            return {address: self._evaluate(address) for address in addresses}
@@ -0,0 +1,71 @@
+import io
+from template_cache import TemplateCache
+from template_registry import CompiledTemplate
+from xlsx_patch import patch_workbook
+from metrics import stage
+
+
+def fill_template(cache: TemplateCache, template: CompiledTemplate, data: dict, output, mode: str):
+    """Writes `data` into the compiled template's sheet and saves the result to `output` (path or binary file)"""
+    if mode == "patch":
+        # Copy the formula-free template zip as-is and rewrite only the sheet XML, so the output
+        # holds the same values as the data_only workbook saved below and no stale formulas
+        values = template.cell_values(data)
+        template_bytes = cache.formula_free(template.path)
+        with stage("patch_workbook"):
+            if isinstance(output, str):
+                with open(output, "wb") as output_file:
+                    patch_workbook(template_bytes, template.sheet_name, values, output_file)
+            else:
+                patch_workbook(template_bytes, template.sheet_name, values, output)
+        return
+
+    # Take a private copy of the cached Excel template
+    with cache.checkout(template.path) as workbook:
+        if template.sheet_name not in workbook.sheetnames:
+            raise Exception(f"Excel template is missing '{template.sheet_name}' sheet")
+
+        # One range write per field at precompiled coordinates
+        with stage("write_cells"):
+            template.write(workbook[template.sheet_name], data)
+
+        # Save the workbook, the cache closes the copy
+        with stage("save_workbook"):
+            workbook.save(output)
+
+
+# Template cache of a batch worker process, adopted from the parent so nothing is reparsed
+_worker_cache = None
+
+
+def init_worker(entries: dict):
+    """Process pool initializer, preloads the parent's parsed templates"""
+    global _worker_cache
+    _worker_cache = TemplateCache(max_copies=1)
+    _worker_cache.adopt(entries)
+
+
+def generate_in_worker(template: CompiledTemplate, data: dict, mode: str) -> bytes:
+    """Fills the template inside a batch worker process and returns the workbook bytes"""
+    buffer = io.BytesIO()
+    fill_template(_worker_cache, template, data, buffer, mode)
+    return buffer.getvalue()
+
+
+class ArchiveStream:
+    """Write-only buffer for zipfile, drained chunk by chunk into a streamed response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
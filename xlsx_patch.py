@@ -0,0 +1,375 @@
+import re
+import codecs
+import struct
+import zlib
+import shutil
+import zipfile
+import posixpath
+import datetime
+from xml.sax.saxutils import escape, unescape
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+from openpyxl.utils.datetime import to_excel
+from openpyxl.formula.translate import Translator
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+
+# Zip record layouts (see APPNOTE.TXT 4.3.7, 4.3.12 and 4.3.16)
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_OF_CENTRAL_DIR = struct.Struct("<4s4H2LH")
+
+CALC_CHAIN_PART = "xl/calcChain.xml"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+WORKBOOK_PART = "xl/workbook.xml"
+WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+
+CELL_RE = re.compile(r'<c r="([A-Z]+[0-9]+)"((?:\s[^>]*?)?)(/>|>(.*?)</c>)', re.S)
+ROW_RE = re.compile(r'<row r="([0-9]+)"((?:\s[^>]*?)?)(/>|>(.*?)</row>)', re.S)
+STYLE_RE = re.compile(r'\ss="([0-9]+)"')
+FORMULA_RE = re.compile(r'<f\b([^>]*?)(?:/>|>(.*?)</f>)', re.S)
+SHARED_INDEX_RE = re.compile(r'\ssi="([0-9]+)"')
+
+# Any <c> element, whatever its attribute order, for the formula stripper
+ANY_CELL_RE = re.compile(r'<c\b([^>]*?)(/>|>(.*?)</c>)', re.S)
+VALUE_RE = re.compile(r'<v(?:\s[^>]*)?>(.*?)</v>', re.S)
+TYPE_RE = re.compile(r'\st="([^"]*)"')
+WORKSHEET_PART_RE = re.compile(r'^xl/worksheets/[^/]+\.xml$')
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def _read_central_directory(raw: bytes) -> list:
+    """Returns (name, central header bytes, local header offset) for every member of `raw`"""
+    eocd_offset = raw.rfind(b"PK\x05\x06")
+    if eocd_offset < 0:
+        raise ValueError("Template is not a valid zip archive")
+
+    _, _, _, _, count, size, offset, _ = END_OF_CENTRAL_DIR.unpack_from(raw, eocd_offset)
+    if count == 0xFFFF or offset == 0xFFFFFFFF:
+        raise ValueError("Zip64 templates are not supported by the patch writer")
+
+    members = []
+    position = offset
+    for _ in range(count):
+        fields = CENTRAL_HEADER.unpack_from(raw, position)
+        name_length, extra_length, comment_length = fields[10], fields[11], fields[12]
+        end = position + CENTRAL_HEADER.size + name_length + extra_length + comment_length
+        name = raw[position + CENTRAL_HEADER.size:position + CENTRAL_HEADER.size + name_length].decode("utf-8")
+        members.append((name, raw[position:end], fields[16]))
+        position = end
+
+    return members, offset
+
+
+def _resolve_sheet_part(read_member, sheet_name: str) -> str:
+    """Finds the zip path of the worksheet called `sheet_name`"""
+    workbook_xml = read_member(WORKBOOK_PART).decode("utf-8")
+    rel_id = None
+    for match in re.finditer(r'<sheet\s[^>]*?/>', workbook_xml):
+        tag = match.group()
+        name = re.search(r'\sname="([^"]*)"', tag)
+        if name and unescape(name.group(1), {"&quot;": '"', "&apos;": "'"}) == sheet_name:
+            rel_id = re.search(r'\sr:id="([^"]*)"', tag).group(1)
+            break
+
+    if rel_id is None:
+        raise KeyError(f"Excel template is missing '{sheet_name}' sheet")
+
+    rels_xml = read_member(WORKBOOK_RELS_PART).decode("utf-8")
+    for match in re.finditer(r'<Relationship\s[^>]*?/>', rels_xml):
+        tag = match.group()
+        if f'Id="{rel_id}"' in tag:
+            target = re.search(r'\sTarget="([^"]*)"', tag).group(1)
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join("xl", target))
+
+    raise KeyError(f"Relationship '{rel_id}' for sheet '{sheet_name}' not found")
+
+
+def _cell_xml(ref: str, style: str, value) -> str:
+    """Serialises `value` as a <c> element, using the same type rules as openpyxl"""
+    style_attr = f' s="{style}"' if style else ""
+
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+        return f'<c r="{ref}"{style_attr}><v>{to_excel(value)!r}</v></c>'
+
+    if isinstance(value, str):
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise ValueError(f"Cell {ref} value contains characters Excel cannot store")
+        value = value[:32767]
+
+        if value.startswith("=") and len(value) > 1:
+            return f'<c r="{ref}"{style_attr}><f>{escape(value[1:])}</f><v></v></c>'
+
+        return (
+            f'<c r="{ref}"{style_attr} t="inlineStr">'
+            f'<is><t xml:space="preserve">{escape(value)}</t></is></c>'
+        )
+
+    raise ValueError(f"Cannot convert {value!r} to Excel")
+
+
+def _sort_key(ref: str) -> tuple:
+    column, row = coordinate_from_string(ref)
+    return row, column_index_from_string(column)
+
+
+def _insert_cells(sheet_xml: str, missing: dict) -> str:
+    """Adds cells that have no <c> element yet, keeping rows and columns ordered"""
+    by_row = {}
+    for ref, cell in missing.items():
+        by_row.setdefault(_sort_key(ref)[0], []).append((ref, cell))
+
+    for row_number, cells in sorted(by_row.items()):
+        cells.sort(key=lambda item: _sort_key(item[0]))
+        row_match = None
+        for match in ROW_RE.finditer(sheet_xml):
+            if int(match.group(1)) == row_number:
+                row_match = match
+                break
+
+        if row_match is None:
+            # Place the new row before the first row with a higher number
+            new_row = f'<row r="{row_number}">' + "".join(cell for _, cell in cells) + "</row>"
+            position = sheet_xml.index("</sheetData>") if "</sheetData>" in sheet_xml else None
+            for match in ROW_RE.finditer(sheet_xml):
+                if int(match.group(1)) > row_number:
+                    position = match.start()
+                    break
+            if position is None:
+                sheet_xml = sheet_xml.replace("<sheetData/>", f"<sheetData>{new_row}</sheetData>", 1)
+            else:
+                sheet_xml = sheet_xml[:position] + new_row + sheet_xml[position:]
+            continue
+
+        content = row_match.group(4) or ""
+        for ref, cell in cells:
+            column = _sort_key(ref)[1]
+            position = len(content)
+            for existing in CELL_RE.finditer(content):
+                if _sort_key(existing.group(1))[1] > column:
+                    position = existing.start()
+                    break
+            content = content[:position] + cell + content[position:]
+
+        row_xml = f'<row r="{row_number}"{row_match.group(2)}>{content}</row>'
+        sheet_xml = sheet_xml[:row_match.start()] + row_xml + sheet_xml[row_match.end():]
+
+    return sheet_xml
+
+
+def _shared_formula(cell_body: str):
+    """Returns (formula match, shared index) if the cell belongs to a shared formula, else None"""
+    formula = FORMULA_RE.search(cell_body or "")
+    if formula is None or ' t="shared"' not in formula.group(1):
+        return None
+    index = SHARED_INDEX_RE.search(formula.group(1))
+    return (formula, index.group(1)) if index else None
+
+
+def patch_sheet_xml(sheet_xml: str, values: dict) -> str:
+    """Rewrites the cells in `values` ({"E19": value}) inside a worksheet XML document"""
+    pending = {ref: value for ref, value in values.items() if value is not None}
+    parts = []
+    last = 0
+    # Shared index -> (cell, formula) of overwritten shared formula masters, the master comes first in the sheet
+    orphaned = {}
+
+    for match in CELL_RE.finditer(sheet_xml):
+        ref = match.group(1)
+        shared = _shared_formula(match.group(4)) if orphaned or ref in pending else None
+
+        if ref not in pending:
+            if shared is not None and shared[1] in orphaned and not shared[0].group(2):
+                # The rest of the group loses its formula with the master, each cell gets its own copy
+                origin, text = orphaned[shared[1]]
+                translated = Translator(f"={text}", origin=origin).translate_formula(ref)[1:]
+                body = match.group(4)
+                parts.append(sheet_xml[last:match.start(4)])
+                parts.append(body[:shared[0].start()] + f"<f>{escape(translated)}</f>" + body[shared[0].end():])
+                last = match.end(4)
+            continue
+
+        if shared is not None and shared[0].group(2):
+            orphaned[shared[1]] = (ref, unescape(shared[0].group(2)))
+
+        style = STYLE_RE.search(match.group(2) or "")
+        parts.append(sheet_xml[last:match.start()])
+        parts.append(_cell_xml(ref, style.group(1) if style else "", pending.pop(ref)))
+        last = match.end()
+
+    parts.append(sheet_xml[last:])
+    sheet_xml = "".join(parts)
+
+    if pending:
+        sheet_xml = _insert_cells(sheet_xml, {ref: _cell_xml(ref, "", value) for ref, value in pending.items()})
+
+    return sheet_xml
+
+
+def _drop_calc_chain(content_types_xml: str, rels_xml: str) -> tuple:
+    """Removes the calcChain references, Excel rebuilds the chain on load"""
+    content_types_xml = re.sub(r'<Override\s[^>]*?PartName="/xl/calcChain\.xml"[^>]*?/>', "", content_types_xml)
+    rels_xml = re.sub(r'<Relationship\s[^>]*?Target="[^"]*calcChain\.xml"[^>]*?/>', "", rels_xml)
+    return content_types_xml, rels_xml
+
+
+def _write_deflated(output, name: str, data: bytes, offset: int) -> tuple:
+    """Writes one freshly compressed member, returns its central header and size on disk"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    crc = zlib.crc32(data)
+    encoded_name = name.encode("utf-8")
+    # 1980-01-01 00:00, same timestamp the template members carry
+    dos_time, dos_date = 0, (0 << 9) | (1 << 5) | 1
+
+    local = LOCAL_HEADER.pack(
+        b"PK\x03\x04", 20, 0x800, 8, dos_time, dos_date,
+        crc, len(compressed), len(data), len(encoded_name), 0,
+    )
+    output.write(local + encoded_name)
+    output.write(compressed)
+
+    central = CENTRAL_HEADER.pack(
+        b"PK\x01\x02", 20, 20, 0x800, 8, dos_time, dos_date,
+        crc, len(compressed), len(data), len(encoded_name), 0, 0, 0, 0, 0, offset,
+    ) + encoded_name
+    return central, len(local) + len(encoded_name) + len(compressed)
+
+
+def patch_workbook(template: bytes, sheet_name: str, values: dict, output):
+    """
+    Streams `template` to the binary file object `output`, rewriting only the cells of
+    `sheet_name` listed in `values`. Every other zip member is copied byte-for-byte.
+    """
+    members, central_offset = _read_central_directory(template)
+    offsets = sorted(offset for _, _, offset in members) + [central_offset]
+    spans = {offset: offsets[index + 1] for index, offset in enumerate(offsets[:-1])}
+
+    def read_member(name: str) -> bytes:
+        for member_name, central, offset in members:
+            if member_name == name:
+                fields = CENTRAL_HEADER.unpack_from(central)
+                local = LOCAL_HEADER.unpack_from(template, offset)
+                start = offset + LOCAL_HEADER.size + local[9] + local[10]
+                data = template[start:start + fields[8]]
+                return zlib.decompress(data, -15) if fields[4] == 8 else data
+        raise KeyError(name)
+
+    sheet_part = _resolve_sheet_part(read_member, sheet_name)
+    replaced = {
+        sheet_part: patch_sheet_xml(read_member(sheet_part).decode("utf-8"), values).encode("utf-8"),
+    }
+
+    has_calc_chain = any(name == CALC_CHAIN_PART for name, _, _ in members)
+    if has_calc_chain:
+        content_types_xml, rels_xml = _drop_calc_chain(
+            read_member(CONTENT_TYPES_PART).decode("utf-8"),
+            read_member(WORKBOOK_RELS_PART).decode("utf-8"),
+        )
+        replaced[CONTENT_TYPES_PART] = content_types_xml.encode("utf-8")
+        replaced[WORKBOOK_RELS_PART] = rels_xml.encode("utf-8")
+
+    written = 0
+    central_directory = []
+    for name, central, offset in members:
+        if has_calc_chain and name == CALC_CHAIN_PART:
+            continue
+
+        if name in replaced:
+            entry, size = _write_deflated(output, name, replaced[name], written)
+        else:
+            # Local header, data and any data descriptor are copied as they are
+            output.write(template[offset:spans[offset]])
+            entry = central[:42] + struct.pack("<L", written) + central[46:]
+            size = spans[offset] - offset
+
+        central_directory.append(entry)
+        written += size
+
+    directory = b"".join(central_directory)
+    output.write(directory)
+    output.write(END_OF_CENTRAL_DIR.pack(
+        b"PK\x05\x06", 0, 0, len(central_directory), len(central_directory), len(directory), written, 0,
+    ))
+
+
+def _strip_cell_formula(match) -> str:
+    """Replaces a formula cell with its cached value, leaves every other cell untouched"""
+    attrs, body = match.group(1), match.group(3)
+    if body is None or "<f" not in body:
+        return match.group(0)
+
+    value = VALUE_RE.search(body)
+    cell_type = TYPE_RE.search(attrs)
+
+    # Formula strings carry their result in <v>, plain cells need it as an inline string
+    if cell_type is not None and cell_type.group(1) == "str":
+        attrs = TYPE_RE.sub(' t="inlineStr"', attrs, count=1)
+        text = value.group(1) if value else ""
+        return f'<c{attrs}><is><t xml:space="preserve">{text}</t></is></c>'
+
+    if value is None or value.group(1) == "":
+        return f'<c{TYPE_RE.sub("", attrs, count=1)}/>'
+
+    return f'<c{attrs}><v>{value.group(1)}</v></c>'
+
+
+def _strip_sheet_formulas(source, target):
+    """Streams worksheet XML from `source` to `target` in row-sized pieces without formulas"""
+    pending = ""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    while True:
+        chunk = source.read(STREAM_CHUNK_SIZE)
+        pending += decoder.decode(chunk, final=not chunk)
+
+        # Only whole rows are rewritten, the tail waits for the next chunk
+        cut = len(pending) if not chunk else pending.rfind("</row>") + len("</row>")
+        if cut >= len("</row>") or not chunk:
+            target.write(ANY_CELL_RE.sub(_strip_cell_formula, pending[:cut]).encode("utf-8"))
+            pending = pending[cut:]
+
+        if not chunk:
+            break
+
+
+def strip_formulas(source, output):
+    """
+    Copies the workbook `source` (path or seekable file) to `output` with every formula
+    replaced by its cached value. Sheets are streamed one at a time, other parts are copied.
+    """
+    with zipfile.ZipFile(source) as reader, zipfile.ZipFile(output, "w") as writer:
+        names = reader.namelist()
+        has_calc_chain = CALC_CHAIN_PART in names
+
+        for info in reader.infolist():
+            if info.filename == CALC_CHAIN_PART:
+                continue
+
+            target_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            target_info.compress_type = info.compress_type
+            target_info.external_attr = info.external_attr
+
+            if has_calc_chain and info.filename in (CONTENT_TYPES_PART, WORKBOOK_RELS_PART):
+                content_types_xml, rels_xml = _drop_calc_chain(
+                    reader.read(CONTENT_TYPES_PART).decode("utf-8"),
+                    reader.read(WORKBOOK_RELS_PART).decode("utf-8"),
+                )
+                data = content_types_xml if info.filename == CONTENT_TYPES_PART else rels_xml
+                writer.writestr(target_info, data.encode("utf-8"))
+                continue
+
+            with reader.open(info) as member, writer.open(target_info, "w", force_zip64=info.file_size > 0x7FFFFFFF) as target:
+                if WORKSHEET_PART_RE.match(info.filename):
+                    _strip_sheet_formulas(member, target)
+                else:
+                    shutil.copyfileobj(member, target, STREAM_CHUNK_SIZE)